@@ -3,7 +3,6 @@ LINE Event Handler
 處理 LINE Bot 的各種事件
 """
 import json
-import uuid
 from datetime import datetime
 from sqlalchemy.orm import Session
 from linebot.models import (
@@ -12,262 +11,372 @@ from linebot.models import (
 )
 
 from app.config import settings
-from app.database import SessionLocal
+from app.ids import new_job_id
+from app.database import reading, run_after_commit, run_after_rollback, unit_of_work
 from app import models
 from app.services import line_service
-from app.worker import process_elder_image
-from app.utils import get_or_create_user_in_db
+from app.services.points_service import points_service
+from app.services.job_partitions import hot_since, job_ids_filter
+from app.services.user_cache import UserSnapshot, user_cache
+from app.services.message_templates import render
+from app.services.job_scheduler import job_scheduler
+from app.services.image_sets import COMPLETE, FIRST, LATE, WAITING, image_set_collector
+from app.worker import INSTANT_QUEUE
+from app.utils import activity_is_stale, get_or_create_user_in_db
 
 
 def handle_line_events(body: str, signature: str):
     """
     處理 LINE Webhook 事件
+    每個事件一個工作單元（一個 Session、一個交易）：處理完 commit 一次，
+    回覆訊息與送出任務等副作用在 commit 之後才執行；單一事件失敗不影響其他事件
 
     Args:
         body: 請求 body (JSON string)
         signature: LINE 簽章 (X-Line-Signature header)
     """
-    from linebot import WebhookHandler
-    from app.config import settings
+    from linebot import WebhookParser
 
-    handler = WebhookHandler(settings.LINE_CHANNEL_SECRET)
+    # 解析事件（parser 會自動驗證簽章）
+    events = WebhookParser(settings.LINE_CHANNEL_SECRET).parse(body, signature)
 
-    # 註冊事件處理器
-    handler.add(MessageEvent, message=TextMessage, handle_text_message)
-    handler.add(MessageEvent, message=ImageMessage, handle_image_message)
-    handler.add(PostbackEvent, handle_postback)
-    handler.add(FollowEvent, handle_follow)
-    handler.add(UnfollowEvent, handle_unfollow)
+    for event in events:
+        if isinstance(event, MessageEvent):
+            handler = MESSAGE_HANDLERS.get(type(event.message))
+        else:
+            handler = EVENT_HANDLERS.get(type(event))
+        if handler is None:
+            continue
 
-    # 解析並處理事件（handler 會自動驗證簽章）
-    handler.handle(body, signature)
+        try:
+            with unit_of_work() as db:
+                handler(event, db)
+        except Exception as e:
+            print(f"❌ LINE 事件處理失敗 ({event.type}): {e}")
 
 
-def get_or_create_user(line_user_id: str, profile: dict = None) -> models.ElderUser:
+def get_or_create_user(db: Session, line_user_id: str, refresh_profile: bool = False) -> UserSnapshot:
     """
-    取得或建立用戶（使用共用函數）
+    取得或建立用戶
+    優先讀用戶快取；新用戶、超過一小時沒互動或指定 refresh_profile 時
+    才向 LINE 取個人資料並寫入 DB（使用共用函數）
 
     Args:
+        db: 事件的 Session（不 commit）
         line_user_id: LINE User ID
-        profile: LINE 用戶資料 (可選)
+        refresh_profile: 是否一定要更新 LINE 個人資料
 
     Returns:
-        ElderUser 物件
+        UserSnapshot（唯讀）
     """
-    db: Session = SessionLocal()
+    if not refresh_profile:
+        user = user_cache.get(line_user_id)
+        if user is not None and not activity_is_stale(user.last_active_at):
+            return user
+
+    profile = line_service.get_user_profile(line_user_id)
+    return UserSnapshot.from_model(get_or_create_user_in_db(db, line_user_id, profile, commit=False))
+
+
+PENDING_REQUEST_KEY = "elder:pending:{line_user_id}"
+PENDING_REQUEST_TTL = 10 * 60  # 秒
+
+
+def set_pending_request(line_user_id: str, **fields):
+    """記錄用戶下一張照片要用的生成設定（mode / prompt / caption）"""
+    from app.redis_client import get_redis
+
+    key = PENDING_REQUEST_KEY.format(line_user_id=line_user_id)
+    pipe = get_redis().pipeline()
+    pipe.delete(key)
+    pipe.hset(key, mapping=fields)
+    pipe.expire(key, PENDING_REQUEST_TTL)
+    pipe.execute()
+
+
+def pop_pending_request(line_user_id: str) -> dict:
+    """取出並清除用戶的生成設定，沒有時回傳空 dict"""
+    from app.redis_client import get_redis
+
+    key = PENDING_REQUEST_KEY.format(line_user_id=line_user_id)
     try:
-        return get_or_create_user_in_db(db, line_user_id, profile)
-    finally:
-        db.close()
+        pipe = get_redis().pipeline()
+        pipe.hgetall(key)
+        pipe.delete(key)
+        fields, _ = pipe.execute()
+        return fields
+    except Exception as e:
+        print(f"讀取生成設定失敗: {e}")
+        return {}
 
 
-def handle_text_message(event: MessageEvent):
+def handle_text_message(event: MessageEvent, db: Session):
     """處理文字訊息"""
     line_user_id = event.source.user_id
     text = event.message.text.strip()
 
     # 取得或建立用戶
-    profile = line_service.get_user_profile(line_user_id)
-    user = get_or_create_user(line_user_id, profile)
+    user = get_or_create_user(db, line_user_id)
 
     # 指令處理
     if text == "/menu" or text == "選單":
-        line_service.reply_message(
-            event.reply_token,
-            [line_service.create_menu_flex()]
-        )
+        line_service.reply_message(event.reply_token, [render("menu")])
         return
 
     elif text == "/points" or text == "點數":
-        line_service.reply_message(
-            event.reply_token,
-            [line_service.text_message(f"💰 您的點數: {user.points}")]
-        )
+        line_service.reply_message(event.reply_token, [render("points", points=user.points)])
         return
 
     elif text == "/topup" or text == "儲值":
         # 建立儲值連結
         topup_url = f"{settings.NEWEBPAY_CLIENT_BACK_URL}/topup?user_id={user.id}"
-        line_service.reply_message(
-            event.reply_token,
-            [line_service.text_message(f"💳 點擊下方連結儲值\n{topup_url}")]
-        )
+        line_service.reply_message(event.reply_token, [render("topup", url=topup_url)])
         return
 
     elif text == "/history" or text == "我的作品":
-        # 查詢最近的生成記錄
-        db: Session = SessionLocal()
-        jobs = db.query(models.ElderImageJob).filter(
-            models.ElderImageJob.user_id == user.id,
-            models.ElderImageJob.status == "COMPLETED"
-        ).order_by(models.ElderImageJob.created_at.desc()).limit(5).all()
-        db.close()
+        # 查詢最近的生成記錄（讀副本；剛送出任務的用戶沿用事件的 Session 讀主庫）
+        with reading(db, user.line_user_id) as reader:
+            jobs = reader.query(models.ElderImageJob).filter(
+                models.ElderImageJob.user_id == user.id,
+                models.ElderImageJob.status == "COMPLETED",
+                models.ElderImageJob.created_at >= hot_since()
+            ).order_by(models.ElderImageJob.created_at.desc()).limit(5).all()
 
         if jobs:
-            text_msg = "📸 最近的作品:\n\n"
-            for i, job in enumerate(jobs, 1):
-                text_msg += f"{i}. {job.created_at.strftime('%m/%d %H:%M')}\n"
-            line_service.reply_message(
-                event.reply_token,
-                [line_service.text_message(text_msg)]
+            items = "".join(
+                f"{i}. {job.created_at.strftime('%m/%d %H:%M')}\n" for i, job in enumerate(jobs, 1)
             )
+            line_service.reply_message(event.reply_token, [render("history", items=items)])
         else:
-            line_service.reply_message(
-                event.reply_token,
-                [line_service.text_message("還沒有作品哦，快來生成一張吧！")]
-            )
+            line_service.reply_message(event.reply_token, [render("history_empty")])
         return
 
     elif text.startswith("/generate ") or text.startswith("生成 "):
         # 處理生成指令 (例如: /generate 可愛的老人)
         prompt = text.replace("/generate ", "").replace("生成 ", "")
+        set_pending_request(line_user_id, mode="ai", prompt=prompt)
         # 繼續請用戶上傳圖片
-        line_service.reply_message(
-            event.reply_token,
-            [line_service.text_message("請上傳一張照片，我會根據您的提示生成長輩圖")]
-        )
+        line_service.reply_message(event.reply_token, [render("ask_photo_generate")])
+        return
+
+    elif text.startswith("/caption ") or text.startswith("文字 "):
+        # 只加標語，不經過 AI（例如: /caption 早安）
+        caption = text.replace("/caption ", "").replace("文字 ", "").strip()
+        set_pending_request(line_user_id, mode="caption", caption=caption)
+        line_service.reply_message(event.reply_token, [render("ask_photo_caption", caption=caption)])
+        return
+
+    elif text.startswith("/instant") or text.startswith("快速 "):
+        # 快速模式：照片合成進節慶模板（例如: /instant 中秋）
+        from app.services import template_service
+
+        title = text.replace("/instant", "").replace("快速 ", "").strip()
+        if not template_service.find(title):
+            line_service.reply_message(event.reply_token, [render("instant_templates")])
+            return
+        set_pending_request(line_user_id, mode="instant", template=title)
+        line_service.reply_message(event.reply_token, [render("ask_photo_instant", title=title)])
         return
 
     # 預設回應
-    line_service.reply_message(
-        event.reply_token,
-        [
-            line_service.text_message(
-                "👋 歡迎來到長輩圖販賣機！\n\n"
-                "指令列表:\n"
-                "📸 /generate - 生成長輩圖\n"
-                "💰 /points - 查詢點數\n"
-                "💳 /topup - 儲值點數\n"
-                "📚 /history - 我的作品\n"
-                "📋 /menu - 主選單"
-            )
-        ]
-    )
+    line_service.reply_message(event.reply_token, [render("help")])
 
 
-def handle_image_message(event: MessageEvent):
-    """處理圖片訊息 - 用戶上傳要處理的照片"""
+def handle_image_message(event: MessageEvent, db: Session):
+    """處理圖片訊息 - 用戶上傳要處理的照片（一次傳多張時整組一起處理）"""
     line_user_id = event.source.user_id
     message_id = event.message.id
+    image_set = getattr(event.message, "image_set", None)
+
+    if image_set and image_set.total and image_set.total > 1:
+        try:
+            state = image_set_collector.add(
+                image_set.id, image_set.index, image_set.total,
+                message_id, event.reply_token, line_user_id
+            )
+        except Exception as e:
+            print(f"⚠️  imageSet 收集失敗，單張處理: {e}")
+            state = LATE
+
+        if state == FIRST:
+            # 等待時間內沒收齊，由延遲任務處理已收到的照片
+            from app.worker import flush_image_set
+
+            flush_image_set.apply_async(args=[image_set.id], countdown=settings.IMAGE_SET_WINDOW_SECONDS)
+            return
+        if state == WAITING:
+            return
+        if state == COMPLETE:
+            claimed = image_set_collector.claim(image_set.id)
+            if claimed:
+                accept_images(db, line_user_id, claimed["reply_token"], claimed["message_ids"])
+            return
+
+    accept_images(db, line_user_id, event.reply_token, [message_id])
+
+
+def process_image_set(set_id: str):
+    """等待時間到了還沒收齊的 imageSet：處理已收到的照片（已被處理過就略過）"""
+    claimed = image_set_collector.claim(set_id)
+    if not claimed:
+        return
+    with unit_of_work() as db:
+        accept_images(db, claimed["line_user_id"], claimed["reply_token"], claimed["message_ids"])
+
+
+def accept_images(db: Session, line_user_id: str, reply_token: str, message_ids: list[str]):
+    """
+    扣點並建立任務：一張照片一個任務，一組照片一起扣點、回覆一次、送出一個批次任務
+    點數不足時整組都不處理
+    """
+    count = len(message_ids)
+    cost = settings.POINTS_PER_IMAGE
 
     # 取得或建立用戶
-    profile = line_service.get_user_profile(line_user_id)
-    user = get_or_create_user(line_user_id, profile)
+    user = get_or_create_user(db, line_user_id)
 
-    # 檢查點數
-    if user.points < settings.POINTS_PER_IMAGE:
-        line_service.reply_message(
-            event.reply_token,
-            [line_service.text_message(
-                f"❌ 點數不足！\n"
-                f"需要 {settings.POINTS_PER_IMAGE} 點，您目前有 {user.points} 點\n"
-                f"請使用 /topup 儲值"
-            )]
-        )
+    # 快速擋掉點數明顯不足的情況（實際扣款在下方的條件式 UPDATE）
+    if user.points < cost * count:
+        line_service.reply_message(reply_token, [_insufficient_points(count, user.points)])
         return
 
-    # 取得圖片內容
-    image_content = line_service.api.get_message_content(message_id)
-    image_data = image_content.content
+    # 用戶先前指定的生成設定（/generate 或 /caption），一組照片共用
+    pending = pop_pending_request(line_user_id)
+    if pending:
+        # 交易失敗時設定留給用戶重傳的照片
+        run_after_rollback(db, set_pending_request, line_user_id, **pending)
+    mode = pending.get("mode", "ai")
+    prompt = pending.get("prompt") or "elderly person meme"
+    caption = pending.get("caption")
+    template = pending.get("template")
+
+    # 扣點 + 寫帳本 + 建立任務記錄（單一 SQL，並行上傳也不會超扣）
+    job_ids = [new_job_id() for _ in message_ids]
+    reserved = points_service.reserve_jobs(
+        db,
+        user_id=user.id,
+        job_ids=job_ids,
+        cost=cost,
+        mode=mode,
+        prompt_used={"caption": caption, "instant": template}.get(mode, prompt),
+    )
 
-    # 上傳原圖到 Supabase
-    import asyncio
-    from app.services import storage_service
+    if not reserved["success"]:
+        # 生成設定留給下一張照片
+        if pending:
+            set_pending_request(line_user_id, **pending)
+        line_service.reply_message(reply_token, [_insufficient_points(count, reserved["points"])])
+        return
 
-    upload_result = asyncio.run(storage_service.upload_image(
-        image_data=image_data,
-        user_id=user.id,
-        prefix="original"
-    ))
+    # 任務記錄 commit 之後才提交任務並回覆用戶（worker 要讀得到任務）
+    if count == 1:
+        accepted = render("job_accepted", points=reserved["points"])
+    else:
+        accepted = render("job_set_accepted", count=count, cost=cost * count, points=reserved["points"])
+
+    # 排進用戶的子佇列，由公平排程輪流送進 Celery（下載 / 正規化 / 上傳原圖都在 worker 進行）
+    options = {
+        "user_line_id": user.id,
+        "prompt": prompt,
+        "mode": mode,
+        "caption": caption,
+        "template": template,
+    }
+    queue = INSTANT_QUEUE if mode == "instant" else None
+    if count == 1:
+        run_after_commit(
+            db, submit_jobs, reply_token, accepted, job_ids,
+            user.id, job_ids[0], {"job_id": job_ids[0], "message_id": message_ids[0], **options},
+            queue=queue
+        )
+    else:
+        run_after_commit(
+            db, submit_jobs, reply_token, accepted, job_ids,
+            user.id, job_ids[0], {"job_ids": job_ids, "message_ids": message_ids, **options},
+            queue=queue, task="tasks.process_elder_image_set", weight=count
+        )
 
-    if not upload_result["success"]:
+
+def submit_jobs(reply_token: str, accepted, job_ids: list[str], *args, **kwargs):
+    """
+    commit 後把任務交給公平排程，成功才回覆已收到
+    送不出去（Redis / broker 都無法使用）時任務標為失敗並退點，不會一直停在 QUEUED
+    """
+    try:
+        job_scheduler.submit(*args, **kwargs)
+    except Exception as e:
+        print(f"❌ 任務 {job_ids[0]} 送出失敗: {e}")
+        fail_unsubmitted_jobs(job_ids, f"任務送出失敗: {e}")
         line_service.reply_message(
-            event.reply_token,
-            [line_service.text_message("❌ 圖片上傳失敗，請稍後再試")]
+            reply_token, [render("job_failed", error="系統忙碌中，請稍後再傳一次")]
         )
         return
+    line_service.reply_message(reply_token, [accepted])
 
-    # 扣除點數
-    user.points -= settings.POINTS_PER_IMAGE
-    db: Session = SessionLocal()
-    db.commit()
-    db.close()
-
-    # 建立任務記錄
-    job_id = str(uuid.uuid4())
-    db: Session = SessionLocal()
-    job = models.ElderImageJob(
-        job_id=job_id,
-        user_id=user.id,
-        original_url=upload_result["full_url"],
-        original_image_path=upload_result["path"],
-        status="QUEUED",
-        cost_points=settings.POINTS_PER_IMAGE,
-    )
-    db.add(job)
-    db.commit()
-    db.close()
-
-    # 提交 Celery 任務
-    process_elder_image.delay(
-        job_id=job_id,
-        user_line_id=user.id,
-        prompt="elderly person meme",
-        original_url=upload_result["full_url"]
-    )
 
-    # 回覆用戶
-    line_service.reply_message(
-        event.reply_token,
-        [line_service.text_message(
-            f"✅ 圖片已上傳！\n"
-            f"消耗 {settings.POINTS_PER_IMAGE} 點，剩餘 {user.points} 點\n"
-            f"預計 30 秒內完成，請稍候..."
-        )]
-    )
+def fail_unsubmitted_jobs(job_ids: list[str], error: str):
+    """沒送出的任務標為 FAILED 並退點（帳本唯一鍵保證只退一次）"""
+    with unit_of_work() as db:
+        jobs = db.query(models.ElderImageJob).filter(*job_ids_filter(job_ids)).all()
+        for job in jobs:
+            if job.status == "QUEUED":
+                job.status = "FAILED"
+                job.error_message = error
+                job.completed_at = datetime.now()
+                points_service.refund(db, job.job_id)
+
+
+def _insufficient_points(count: int, points: int):
+    if count == 1:
+        return render("insufficient_points", points=points)
+    return render("insufficient_points_set", count=count, cost=settings.POINTS_PER_IMAGE * count, points=points)
 
 
-def handle_postback(event: PostbackEvent):
+def handle_postback(event: PostbackEvent, db: Session):
     """處理 Postback 事件（用戶點擊按鈕）"""
     data = event.postback.data
 
     if data == "menu":
-        line_service.reply_message(
-            event.reply_token,
-            [line_service.create_menu_flex()]
-        )
+        line_service.reply_message(event.reply_token, [render("menu")])
     elif data == "generate":
-        line_service.reply_message(
-            event.reply_token,
-            [line_service.text_message("請上傳一張照片，我會生成長輩圖")]
-        )
+        line_service.reply_message(event.reply_token, [render("postback_generate")])
     elif data == "points":
-        line_service.reply_message(
-            event.reply_token,
-            [line_service.text_message("查詢點數中...")]
-        )
+        line_service.reply_message(event.reply_token, [render("postback_points")])
 
 
-def handle_follow(event: FollowEvent):
+def handle_follow(event: FollowEvent, db: Session):
     """處理用戶加入好友"""
     line_user_id = event.source.user_id
-    profile = line_service.get_user_profile(line_user_id)
-    user = get_or_create_user(line_user_id, profile)
-
-    line_service.reply_message(
-        event.reply_token,
-        [
-            line_service.text_message(
-                f"👋 歡迎 {user.display_name or '您'}！\n\n"
-                f"送您 {settings.FREE_INITIAL_POINTS} 點免費點數\n"
-                f"現在就可以生成長輩圖了！"
-            ),
-            line_service.create_menu_flex()
-        ]
+    user = get_or_create_user(db, line_user_id, refresh_profile=True)
+    if not user.is_following:
+        set_following(db, line_user_id, True)
+
+    run_after_commit(
+        db, line_service.reply_message,
+        event.reply_token, [render("welcome", name=user.display_name or "您"), render("menu")]
     )
 
 
-def handle_unfollow(event: UnfollowEvent):
-    """處理用戶刪除好友"""
-    # 可以選擇保留或清理用戶資料
-    pass
+def set_following(db: Session, line_user_id: str, following: bool):
+    """記錄好友狀態（封鎖的用戶不列入推播；不 commit）"""
+    db.query(models.ElderUser).filter(
+        models.ElderUser.line_user_id == line_user_id
+    ).update({"is_following": following}, synchronize_session=False)
+    user_cache.invalidate_on_commit(db, line_user_id)
+
+
+def handle_unfollow(event: UnfollowEvent, db: Session):
+    """處理用戶刪除好友 / 封鎖（保留用戶資料，只停止推播）"""
+    set_following(db, event.source.user_id, False)
+
+
+# 事件分派表（MessageEvent 依訊息類型）
+MESSAGE_HANDLERS = {
+    TextMessage: handle_text_message,
+    ImageMessage: handle_image_message,
+}
+EVENT_HANDLERS = {
+    PostbackEvent: handle_postback,
+    FollowEvent: handle_follow,
+    UnfollowEvent: handle_unfollow,
+}
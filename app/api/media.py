@@ -0,0 +1,161 @@
+"""
+Media Routes
+本地 / 記憶體儲存後端的檔案服務（支援 HTTP Range，伺服器支援時以 sendfile 傳送）
+"""
+import mimetypes
+import os
+import stat
+from typing import Optional
+import anyio
+from fastapi import APIRouter, HTTPException, Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.services import storage_service
+from app.services.storage_backends import LocalStorageBackend, MemoryStorageBackend
+
+router = APIRouter()
+
+CHUNK_SIZE = 64 * 1024
+# 內容定址路徑的內容永遠不變，可以長期快取
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class RangeNotSatisfiable(Exception):
+    """Range 超出檔案範圍"""
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """
+    解析單一 Range：bytes=start-end / bytes=start- / bytes=-suffix
+
+    Returns:
+        (start, end)（含 end），沒有 Range 或無法解析時回傳 None（回傳整個檔案）
+
+    Raises:
+        RangeNotSatisfiable: 起點超出檔案大小
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    # 不支援的單位或多段 Range 直接忽略，回傳整個檔案（RFC 9110 允許）
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            suffix = int(end_text)
+            if suffix <= 0:
+                raise RangeNotSatisfiable()
+            start = max(size - suffix, 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def _range_headers(byte_range: Optional[tuple], size: int) -> tuple:
+    """回傳 (status_code, headers, start, length)"""
+    start, end = byte_range or (0, size - 1)
+    length = max(end - start + 1, 0)
+    headers = {
+        "accept-ranges": "bytes",
+        "content-length": str(length),
+        "cache-control": CACHE_CONTROL,
+    }
+    if byte_range:
+        headers["content-range"] = f"bytes {start}-{end}/{size}"
+    return (206 if byte_range else 200), headers, start, length
+
+
+class FileRangeResponse(Response):
+    """
+    檔案（或其中一段）回應
+    伺服器支援 ASGI http.response.zerocopysend 擴充時交給 sendfile，否則在執行緒中分段讀取
+    """
+
+    def __init__(self, path: str, size: int, byte_range: Optional[tuple], media_type: str, head: bool = False):
+        status_code, headers, self.start, self.length = _range_headers(byte_range, size)
+        self.path = path
+        self.head = head
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.head or self.length == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        file = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": self.start,
+                    "count": self.length,
+                })
+                return
+
+            offset, remaining = self.start, self.length
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(
+                    os.pread, file.fileno(), min(CHUNK_SIZE, remaining), offset
+                )
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            await anyio.to_thread.run_sync(file.close)
+
+
+def _not_satisfiable(size: int) -> Response:
+    return Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+
+
+@router.api_route("/media/{path:path}", methods=["GET", "HEAD"])
+async def serve_media(path: str, request: Request):
+    """提供 local / memory 儲存後端的物件（UDA LINK 的物件由 R2 直接提供）"""
+    backend = storage_service.backend
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    head = request.method == "HEAD"
+    range_header = request.headers.get("range")
+
+    if isinstance(backend, LocalStorageBackend):
+        try:
+            full_path = backend.resolve(path)
+            info = await anyio.to_thread.run_sync(os.stat, full_path)
+        except (ValueError, OSError):
+            raise HTTPException(status_code=404, detail="找不到檔案")
+        if not stat.S_ISREG(info.st_mode):
+            raise HTTPException(status_code=404, detail="找不到檔案")
+        try:
+            byte_range = parse_range(range_header, info.st_size)
+        except RangeNotSatisfiable:
+            return _not_satisfiable(info.st_size)
+        return FileRangeResponse(full_path, info.st_size, byte_range, media_type, head)
+
+    if isinstance(backend, MemoryStorageBackend):
+        data = await backend.get(path)
+        if data is None:
+            raise HTTPException(status_code=404, detail="找不到檔案")
+        try:
+            byte_range = parse_range(range_header, len(data))
+        except RangeNotSatisfiable:
+            return _not_satisfiable(len(data))
+        status_code, headers, start, length = _range_headers(byte_range, len(data))
+        body = b"" if head else data[start:start + length]
+        return Response(body, status_code=status_code, headers=headers, media_type=media_type)
+
+    raise HTTPException(status_code=404, detail="找不到檔案")
@@ -0,0 +1 @@
+# Benchmarks（手動執行：python -m app.benchmarks.<name>）
@@ -0,0 +1,124 @@
+"""
+Insert Benchmark：job_id / order_no 產生方式
+比較隨機 uuid4 與 UUIDv7、舊訂單號（年月日時 + 用戶後 4 碼 + 4 位隨機）與 Snowflake：
+產生速度、撞號數、插入速度與主鍵索引大小
+
+用法：
+    python -m app.benchmarks.insert_ids --rows 200000 --database-url postgresql://.../bench
+    指定 --database-url（或 BENCHMARK_DATABASE_URL）時在該資料庫建立測試表（結束後刪除），否則使用暫存 SQLite 檔
+    不會使用 DATABASE_URL：測試會建立 / 刪除資料表，請指向專用的測試資料庫
+    隨機主鍵的差距要在索引超過 shared_buffers 後才明顯，正式比較請加大 --rows
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from sqlalchemy import create_engine, text
+from app.ids import new_job_id, new_order_no
+
+BATCH_SIZE = 1000
+
+
+def legacy_order_no() -> str:
+    """舊版 generate_order_no（模擬 10 萬個用戶同時下單）"""
+    user_suffix = str(random.randint(1, 100000))[-4:].zfill(4)
+    return f"EG{datetime.now().strftime('%y%m%d%H')}{user_suffix}{random.randint(1000, 9999)}"
+
+
+SCHEMES = {
+    "uuid4": lambda: str(uuid.uuid4()),
+    "uuid7": new_job_id,
+    "legacy_order_no": legacy_order_no,
+    "snowflake_order_no": new_order_no,
+}
+
+
+def _insert_sql(dialect: str, table: str):
+    if dialect == "postgresql":
+        return text(f"INSERT INTO {table} (id, payload) VALUES (:id, :payload) ON CONFLICT DO NOTHING")
+    return text(f"INSERT OR IGNORE INTO {table} (id, payload) VALUES (:id, :payload)")
+
+
+def _index_bytes(conn, dialect: str, table: str):
+    if dialect == "postgresql":
+        return conn.execute(text(f"SELECT pg_relation_size('{table}_pkey')")).scalar()
+    return None
+
+
+def run_scheme(engine, name: str, rows: int) -> dict:
+    generate = SCHEMES[name]
+    dialect = engine.dialect.name
+    table = f"bench_ids_{name}"
+
+    started = time.perf_counter()
+    ids = [generate() for _ in range(rows)]
+    generate_seconds = time.perf_counter() - started
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        conn.execute(text(f"CREATE TABLE {table} (id VARCHAR(50) PRIMARY KEY, payload TEXT)"))
+
+    insert = _insert_sql(dialect, table)
+    try:
+        started = time.perf_counter()
+        for offset in range(0, rows, BATCH_SIZE):
+            with engine.begin() as conn:
+                conn.execute(insert, [{"id": i, "payload": "x" * 64} for i in ids[offset:offset + BATCH_SIZE]])
+        insert_seconds = time.perf_counter() - started
+
+        with engine.connect() as conn:
+            stored = conn.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+            index_bytes = _index_bytes(conn, dialect, table)
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
+    return {
+        "scheme": name,
+        "generate_per_sec": rows / generate_seconds,
+        "insert_per_sec": rows / insert_seconds,
+        "collisions": rows - stored,
+        "index_mb": index_bytes / 1024 / 1024 if index_bytes is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="job_id / order_no 插入效能比較")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--schemes", nargs="+", default=list(SCHEMES), choices=list(SCHEMES))
+    parser.add_argument(
+        "--database-url", default=os.environ.get("BENCHMARK_DATABASE_URL"),
+        help="測試用資料庫（會建立並刪除 bench_ids_* 資料表），未指定時使用暫存 SQLite"
+    )
+    args = parser.parse_args()
+
+    sqlite_path = None
+    if args.database_url:
+        # Supabase 給的是 postgres://，SQLAlchemy 需要 postgresql://
+        engine = create_engine(args.database_url.replace("postgres://", "postgresql://", 1))
+    else:
+        fd, sqlite_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        engine = create_engine(f"sqlite:///{sqlite_path}")
+    print(f"📊 {engine.dialect.name}，每種 {args.rows} 筆，每批 {BATCH_SIZE} 筆")
+
+    try:
+        print(f"{'scheme':<20}{'產生/秒':>14}{'插入/秒':>12}{'撞號':>8}{'索引 MB':>10}")
+        for name in args.schemes:
+            result = run_scheme(engine, name, args.rows)
+            index_mb = f"{result['index_mb']:.1f}" if result["index_mb"] is not None else "-"
+            print(
+                f"{result['scheme']:<20}{result['generate_per_sec']:>14,.0f}"
+                f"{result['insert_per_sec']:>12,.0f}{result['collisions']:>8}{index_mb:>10}"
+            )
+    finally:
+        engine.dispose()
+        if sqlite_path:
+            os.unlink(sqlite_path)
+
+
+if __name__ == "__main__":
+    main()
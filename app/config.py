@@ -20,17 +20,62 @@ class Settings(BaseSettings):
     LINE_CHANNEL_ACCESS_TOKEN: Optional[str] = None
     LINE_CHANNEL_SECRET: Optional[str] = None
 
+    # 推播 Dispatcher（所有行程共用 Redis 上的 token bucket）
+    LINE_DISPATCH_RATE: float = 500.0  # 每秒請求數（LINE push API 上限 2,000 req/s）
+    LINE_MULTICAST_RATE: float = 100.0  # multicast 另外限速（LINE 上限 200 req/s）
+    LINE_DISPATCH_BURST: int = 100
+    LINE_DISPATCH_CONCURRENCY: int = 8  # 每個 dispatcher 的並行 sender 數
+    LINE_DISPATCH_MAX_ATTEMPTS: int = 8  # 超過後移到 dead-letter queue
+    LINE_DISPATCH_BACKOFF_BASE: float = 1.0  # 秒，指數退避
+    LINE_DISPATCH_BACKOFF_MAX: float = 300.0
+    LINE_DISPATCHER_IN_API: bool = True  # 在 API 行程內執行 dispatcher（也可用 python -m app.services.line_dispatcher 獨立執行）
+
+    # 推播活動（multicast）
+    CAMPAIGN_CHUNK_SIZE: int = 500  # 每次 multicast 的人數（LINE 上限 500）
+    CAMPAIGN_MAX_PENDING: int = 200  # 推播佇列中尚未送出的訊息超過此數就暫停入列
+
+    # 一次傳多張照片（imageSet）合併處理
+    IMAGE_SET_WINDOW_SECONDS: int = 5  # 第一張到達後最多等多久，沒收齊就用已收到的照片處理
+    IMAGE_SET_TTL_SECONDS: int = 600
+
     # ============= Database (Supabase Transaction Mode) =============
     DATABASE_URL: Optional[str] = None
+    DATABASE_READ_URL: Optional[str] = None  # 唯讀副本，查詢用戶 / 任務等唯讀路由使用
+    DATABASE_READ_PIN_SECONDS: int = 10  # 用戶寫入後這段時間內讀取走主庫（需大於副本延遲）
+
+    # 任務表每月分區：預先建立未來的分區，超過保留月數的分區搬到冷資料表 elder_image_jobs_archive
+    JOB_PARTITION_MONTHS_AHEAD: int = 3
+    JOB_ARCHIVE_AFTER_MONTHS: int = 12
+    JOB_PARTITION_INTERVAL_SECONDS: int = 86400
 
     # ============= Redis (Zeabur Internal) =============
     REDIS_URL: str = "redis://localhost:6379/0"
 
+    # 用戶資料快取（Redis + 行程內兩層，寫入時以 pub/sub 失效）
+    USER_CACHE_TTL: int = 300  # Redis 層（秒）
+    USER_CACHE_LOCAL_TTL: float = 30.0  # 行程內層（秒），漏接失效訊息時的上限
+    USER_CACHE_LOCAL_MAX: int = 10000
+
     # ============= UDA LINK Image Hosting (Elder Gen) =============
     SUPABASE_URL: Optional[str] = None
     ELDER_GEN_EMAIL: Optional[str] = None  # Elder Gen VIP 用戶 Email
     ELDER_GEN_PASSWORD: Optional[str] = None  # Elder Gen VIP 用戶 Password
     R2_PUBLIC_URL: Optional[str] = None  # R2 公開 URL (可選，上傳回應已包含完整 URL)
+    STORAGE_DELETE_CONCURRENCY: int = 8  # 刪除時同時進行的 HTTP 請求數
+
+    # 儲存後端：uda（UDA LINK / R2）、local（本地檔案，由 /media 提供）、memory（單行程測試用）
+    STORAGE_BACKEND: str = "uda"
+    STORAGE_LOCAL_ROOT: str = "/tmp/elder-gen/media"
+    MEDIA_BASE_URL: Optional[str] = None  # local / memory 後端對外的網址，例如 https://xxx.zeabur.app
+
+    # Storage GC（保留天數，依路徑前綴）
+    STORAGE_RETENTION_ORIGINAL_DAYS: int = 7
+    STORAGE_RETENTION_RESULT_DAYS: int = 90
+    STORAGE_RETENTION_PREVIEW_DAYS: int = 90
+    STORAGE_RETENTION_FAILED_DAYS: int = 3  # 失敗任務的所有圖片
+    STORAGE_GC_BATCH_SIZE: int = 500
+    STORAGE_GC_MAX_BATCHES: int = 200  # 單次執行上限，剩下的由檢查點接續
+    STORAGE_GC_INTERVAL_SECONDS: int = 3600
 
     # ============= NewebPay (藍新金流) =============
     NEWEBPAY_MERCHANT_ID: Optional[str] = None
@@ -39,15 +84,74 @@ class Settings(BaseSettings):
     NEWEBPAY_RETURN_URL: Optional[str] = None
     NEWEBPAY_NOTIFY_URL: Optional[str] = None
     NEWEBPAY_CLIENT_BACK_URL: Optional[str] = None  # 用戶付款完成後返回的前端 URL
+    NEWEBPAY_API_URL: str = "https://core.newebpay.com"  # 測試環境 https://ccore.newebpay.com
+
+    # 對帳（QueryTradeInfo 查詢 PENDING 與近期訂單）
+    RECONCILE_INTERVAL_SECONDS: int = 900
+    RECONCILE_LOOKBACK_HOURS: int = 72  # 已付款訂單也核對這段時間內的
+    RECONCILE_PAGE_SIZE: int = 200
+    RECONCILE_CONCURRENCY: int = 8
+    ORDER_EXPIRE_HOURS: int = 24 * 8  # ATM / 超商繳費期限預設 7 天，過了仍未付款就標為 EXPIRED
 
     # ============= Banana Pro AI =============
     BANANA_API_KEY: Optional[str] = None
     BANANA_MODEL_KEY: str = ""
 
+    # AI 請求 Hedging（降低長尾延遲）
+    AI_HEDGE_ENABLED: bool = False
+    AI_HEDGE_PERCENTILE: float = 95.0  # 超過近期第 N 百分位延遲才送出 hedge
+    AI_HEDGE_BUDGET_RATIO: float = 0.05  # 額外請求上限（佔主請求比例）
+    AI_HEDGE_MIN_SAMPLES: int = 20  # 樣本不足時不 hedge
+    AI_HEDGE_WINDOW_SIZE: int = 200  # 延遲統計視窗大小
+
+    # AI 後端 Registry（權重負載平衡與故障轉移）
+    AI_BACKENDS: str = "banana:100"  # 格式: name:weight,...（可用: banana, stub）
+    AI_BACKEND_FAILURE_THRESHOLD: int = 3  # 連續失敗幾次後暫停該後端
+    AI_BACKEND_COOLDOWN_SECONDS: int = 60
+    AI_BACKEND_WEIGHTS_REFRESH_SECONDS: int = 30  # Redis 權重覆寫的刷新間隔
+    AI_BATCH_CONCURRENCY: int = 4
+
+    # 本地 Stub 後端（離線開發 / Benchmark）
+    AI_STUB_LATENCY_MS: float = 500  # 延遲中位數
+    AI_STUB_LATENCY_SIGMA: float = 0.5  # log-normal 分佈參數
+    AI_STUB_ERROR_RATE: float = 0.0
+    AI_STUB_SEED: int = 42
+
+    # ============= Image Processing =============
+    # 上傳圖片大小上限；下載時每個任務在記憶體中最多保留 IMAGE_SPOOL_BYTES，超過的部分寫入暫存檔
+    # （解碼後的記憶體由 IMAGE_MAX_PIXELS 與 JPEG draft 降採樣限制，與檔案大小無關）
+    IMAGE_MAX_INPUT_BYTES: int = 20 * 1024 * 1024
+    IMAGE_SPOOL_BYTES: int = 1024 * 1024
+    IMAGE_MAX_PIXELS: int = 50_000_000  # 像素數上限（只讀檔頭判斷）
+    IMAGE_TARGET_SIZE: int = 1024  # AI 模型輸入尺寸
+    IMAGE_JPEG_QUALITY: int = 90
+
+    # 成品圖（LINE 限制：原圖 10 MB、預覽圖 1 MB）
+    RESULT_MAX_SIZE: int = 2048
+    RESULT_MAX_BYTES: int = 10 * 1024 * 1024
+    RESULT_JPEG_QUALITY: int = 88
+    RESULT_PREVIEW_SIZE: int = 240
+    RESULT_PREVIEW_MAX_BYTES: int = 1024 * 1024
+
+    # 標語合成字型（Docker 映像安裝 fonts-noto-cjk）
+    CAPTION_FONT_PATH: str = "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc"
+
+    # 快速模式模板（背景 / 遮罩預先計算後 memory-map 載入）
+    TEMPLATE_ASSET_DIR: Optional[str] = None  # 可選：{name}.png / {name}_mask.png 素材
+    TEMPLATE_CACHE_DIR: str = "/tmp/elder-gen/templates"
+    TEMPLATE_SIZE: int = 1024
+
+    # ============= HTTP Client =============
+    HTTP_MAX_CONNECTIONS: int = 50
+    HTTP_MAX_KEEPALIVE: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+
     # ============= App Settings =============
     APP_NAME: str = "ElderGen API"
     DEBUG: bool = False
     ENVIRONMENT: str = "production"  # development, staging, production
+    ID_WORKER_ID: Optional[int] = None  # Snowflake worker id（0-1023），未設定時向 Redis 租用
+    ID_WORKER_LEASE_SECONDS: int = 300  # worker id 租約，每 1/3 時間續約一次
 
     # Points system
     POINTS_PER_IMAGE: int = 10  # 每次生成消耗點數
@@ -57,6 +161,12 @@ class Settings(BaseSettings):
     CELERY_BROKER_URL: str = ""
     CELERY_RESULT_BACKEND: str = ""
 
+    # 生成任務公平排程（每個用戶一個子佇列，輪流送進 Celery）
+    JOB_SCHEDULER_MAX_DISPATCHED: int = 8  # 每個 queue 同時送出的任務數，約等於該 queue 的 worker 並行數
+    JOB_SCHEDULER_USER_INFLIGHT: int = 2  # 每個用戶同時執行中的任務上限
+    JOB_SCHEDULER_LEASE_SECONDS: int = 2 * 3600  # 送出後超過這個時間仍未結束，視為遺失並釋放額度
+    JOB_SCHEDULER_PUMP_SECONDS: int = 30
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # 如果沒有單獨設定 Celery URL，使用 Redis
@@ -71,11 +181,12 @@ class Settings(BaseSettings):
             self.LINE_CHANNEL_ACCESS_TOKEN,
             self.LINE_CHANNEL_SECRET,
             self.DATABASE_URL,
-            self.SUPABASE_URL,
-            self.ELDER_GEN_EMAIL,
-            self.ELDER_GEN_PASSWORD,
-            self.BANANA_API_KEY,
         ]
+        # 只檢查實際用到的外部服務（本地儲存 / stub 後端不需要）
+        if self.STORAGE_BACKEND == "uda":
+            required += [self.SUPABASE_URL, self.ELDER_GEN_EMAIL, self.ELDER_GEN_PASSWORD]
+        if "banana" in self.AI_BACKENDS:
+            required.append(self.BANANA_API_KEY)
         return all(required)
 
 
@@ -2,26 +2,38 @@
 Database Configuration
 資料庫連線設定與 Session 管理
 """
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Optional
+import redis
 from fastapi import HTTPException
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.pool import QueuePool
 from app.config import settings
+from app.redis_client import get_redis
 
-# 處理資料庫 URL
-if settings.DATABASE_URL:
+# 用戶寫入後的一段時間內，讀取改走主庫（副本可能還沒同步到）
+READ_PIN_KEY = "elder:db:pin:{key}"
+
+# Session.info 中等待 commit 後執行的副作用（回覆訊息、送出任務等）
+AFTER_COMMIT_INFO_KEY = "after_commit_callbacks"
+# Session.info 中 rollback 時要還原的副作用（已從 Redis 取走的暫存設定等）
+AFTER_ROLLBACK_INFO_KEY = "after_rollback_callbacks"
+
+
+def _create_engine(url: str):
     # 修正 Supabase Transaction Mode 的連線字串
     # Supabase 預設給的是 postgres://，需要改為 postgresql://
-    db_url = settings.DATABASE_URL.replace("postgres://", "postgresql://")
+    db_url = url.replace("postgres://", "postgresql://")
 
     # 如果是 pooler connection，需要特殊處理
     if "pooler" in db_url and settings.ENVIRONMENT == "production":
         # Transaction mode pooler
         db_url = db_url.replace("?pgbouncer=true", "") + "?pgbouncer=true"
 
-    # 建立 Engine
-    engine = create_engine(
+    return create_engine(
         db_url,
         poolclass=QueuePool,
         pool_size=5,          # 連線池大小
@@ -30,16 +42,32 @@ if settings.DATABASE_URL:
         echo=settings.DEBUG,  # 開發時顯示 SQL
     )
 
+
+# 處理資料庫 URL
+if settings.DATABASE_URL:
+    # 建立 Engine
+    engine = _create_engine(settings.DATABASE_URL)
+
     # 建立 Session 工廠
     SessionLocal = sessionmaker(
         autocommit=False,
         autoflush=False,
         bind=engine
     )
+
+    # 唯讀副本（沒設定時唯讀查詢也走主庫）
+    read_engine = _create_engine(settings.DATABASE_READ_URL) if settings.DATABASE_READ_URL else None
+    ReadSessionLocal = sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        bind=read_engine or engine
+    )
 else:
     # 沒有設定資料庫時使用 null engine
     engine = None
     SessionLocal = None
+    read_engine = None
+    ReadSessionLocal = None
 
 # ORM Base class
 Base = declarative_base()
@@ -59,7 +87,108 @@ def get_db():
         db.close()
 
 
+def read_pin_key(key: str) -> str:
+    return READ_PIN_KEY.format(key=key)
+
+
+def is_pinned(key: Optional[str]) -> bool:
+    """key（line_user_id）最近有寫入，讀取應走主庫；Redis 無法使用時保守地走主庫"""
+    if not key:
+        return False
+    try:
+        return bool(get_redis().exists(read_pin_key(key)))
+    except redis.RedisError:
+        return True
+
+
+def read_session(pin_key: Optional[str] = None) -> Session:
+    """
+    唯讀 Session：有設定 DATABASE_READ_URL 時連副本
+    pin_key 最近有寫入（DATABASE_READ_PIN_SECONDS 內）時改連主庫，讀得到自己剛寫的資料
+    """
+    if read_engine is None or is_pinned(pin_key):
+        return SessionLocal()
+    return ReadSessionLocal()
+
+
+def get_read_db():
+    """
+    Dependency Injection: 唯讀路由用的 Session（副本）
+    用在 FastAPI 的 Depends(get_read_db)；需要讀到剛寫入的資料時改用 read_session(pin_key)
+    """
+    if ReadSessionLocal is None:
+        raise HTTPException(status_code=503, detail="資料庫未設定")
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@contextmanager
+def reading(db: Session, pin_key: Optional[str] = None):
+    """
+    在一個交易中做唯讀查詢：可以讀副本時另開副本 Session，否則直接沿用 db（不再向主庫多拿一條連線）
+    """
+    if read_engine is None or is_pinned(pin_key):
+        yield db
+        return
+    replica = ReadSessionLocal()
+    try:
+        yield replica
+    finally:
+        replica.close()
+
+
+def run_after_commit(db: Session, callback: Callable, *args, **kwargs):
+    """登記在 unit_of_work commit 之後執行（例外 / rollback 時不執行）"""
+    db.info.setdefault(AFTER_COMMIT_INFO_KEY, []).append(partial(callback, *args, **kwargs))
+
+
+def run_after_rollback(db: Session, callback: Callable, *args, **kwargs):
+    """登記在 unit_of_work rollback 之後執行（正常 commit 時不執行）"""
+    db.info.setdefault(AFTER_ROLLBACK_INFO_KEY, []).append(partial(callback, *args, **kwargs))
+
+
+def _run_callbacks(db: Session, key: str):
+    for callback in db.info.pop(key, []):
+        try:
+            callback()
+        except Exception as e:
+            print(f"❌ 交易結束後的處理失敗: {e}")
+
+
+@contextmanager
+def unit_of_work():
+    """
+    一個工作單元一個 Session：正常結束時 commit 一次，再依序執行 run_after_commit 登記的副作用
+    發生例外時 rollback，登記的副作用全部取消，改執行 run_after_rollback 登記的還原
+    """
+    if SessionLocal is None:
+        raise RuntimeError("資料庫未設定")
+    db = SessionLocal()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        db.info.pop(AFTER_COMMIT_INFO_KEY, None)
+        _run_callbacks(db, AFTER_ROLLBACK_INFO_KEY)
+        raise
+    finally:
+        db.close()
+
+    db.info.pop(AFTER_ROLLBACK_INFO_KEY, None)
+    _run_callbacks(db, AFTER_COMMIT_INFO_KEY)
+
+
 def init_db():
     """初始化資料庫 Table（開發用，生產建議用 Migration）"""
     if engine is not None:
         Base.metadata.create_all(bind=engine)
+        if engine.dialect.name == "postgresql":
+            # 任務表是分區表，沒有對應月份的分區就無法寫入
+            from app.services.job_partitions import job_partitions
+
+            with engine.begin() as conn:
+                job_partitions.ensure_partitions(conn)
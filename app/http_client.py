@@ -0,0 +1,39 @@
+"""
+Shared HTTP Client
+共用 httpx.AsyncClient（keep-alive 連線池）
+httpx 的連線綁定在建立它的 event loop 上，所以每個 loop 各有一個 client；
+搭配 app.utils.run_async 讓同一執行緒重複使用同一個 loop，連線池就能跨任務共用
+"""
+import asyncio
+import weakref
+from typing import Optional
+import httpx
+from app.config import settings
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """取得目前 event loop 的共用 AsyncClient（必須在 coroutine 中呼叫）"""
+    loop = asyncio.get_running_loop()
+    client: Optional[httpx.AsyncClient] = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0),
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def close_http_client():
+    """關閉目前 event loop 的共用 client（應用關閉時呼叫）"""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
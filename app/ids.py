@@ -0,0 +1,183 @@
+"""
+ID Generator
+時間有序的 ID：新資料永遠插在索引尾端，且同一毫秒內也不會重複
+- uuid7()：RFC 9562 UUIDv7（任務 job_id）
+- snowflake()：64-bit Snowflake（訂單號），41 bit 毫秒 + 10 bit worker + 12 bit 序號
+"""
+import os
+import secrets
+import socket
+import threading
+import time
+import uuid
+import zlib
+from app.config import settings
+
+# Snowflake 起算時間（2025-01-01 UTC，毫秒），41 bit 可用約 69 年
+SNOWFLAKE_EPOCH_MS = 1735689600000
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+WORKER_LEASE_KEY = "elder:ids:worker:{worker_id}"  # 值為持有者（hostname:pid:隨機），TTL 到期後可被其他行程領走
+
+# 續約：還是自己持有才延長 TTL
+RENEW_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) and 1 or 0
+"""
+
+
+class _Uuid7Generator:
+    """
+    UUIDv7：48 bit 毫秒時間戳 + 12 bit 遞增計數（rand_a）+ 62 bit 隨機
+    同一毫秒內以計數遞增，行程內嚴格遞增；計數用完時借用下一毫秒
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._counter = 0
+
+    def __call__(self) -> uuid.UUID:
+        with self._lock:
+            ms = time.time_ns() // 1_000_000
+            if ms > self._last_ms:
+                self._last_ms = ms
+                self._counter = secrets.randbits(11)  # 從前半段隨機起跳，保留遞增空間
+            else:
+                # 同一毫秒或時鐘倒退：沿用上一個時間戳繼續遞增
+                self._counter += 1
+                if self._counter > 0xFFF:
+                    self._last_ms += 1
+                    self._counter = 0
+            ms, counter = self._last_ms, self._counter
+
+        value = (ms & 0xFFFFFFFFFFFF) << 80
+        value |= 0x7 << 76  # version
+        value |= counter << 64
+        value |= 0b10 << 62  # variant
+        value |= secrets.randbits(62)
+        return uuid.UUID(int=value)
+
+
+class _SnowflakeGenerator:
+    """
+    Snowflake ID（worker id 每個行程分配一次，fork 後重新分配）
+    向 Redis 租用 worker id（SET NX EX），背景執行緒定期續約；
+    Celery 子行程回收後租約自然到期，號碼可以重複利用，同時存活的行程不會拿到同一個號碼
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._worker_id = 0
+        self._owner = None
+        self._last_ms = 0
+        self._sequence = 0
+
+    def _lease(self, client) -> int:
+        """從隨機位置開始找一個沒被租用的號碼"""
+        start = secrets.randbelow(MAX_WORKER_ID + 1)
+        for offset in range(MAX_WORKER_ID + 1):
+            worker_id = (start + offset) & MAX_WORKER_ID
+            if client.set(
+                WORKER_LEASE_KEY.format(worker_id=worker_id), self._owner,
+                nx=True, ex=settings.ID_WORKER_LEASE_SECONDS
+            ):
+                return worker_id
+        raise RuntimeError(f"{MAX_WORKER_ID + 1} 個 worker id 都已被租用")
+
+    def _allocate_worker_id(self) -> int:
+        """
+        優先使用 ID_WORKER_ID 設定；否則向 Redis 租用一個號碼並啟動續約執行緒
+        Redis 無法使用時退回 hostname + pid 的雜湊
+        """
+        if settings.ID_WORKER_ID is not None:
+            return settings.ID_WORKER_ID & MAX_WORKER_ID
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        try:
+            from app.redis_client import get_redis
+
+            worker_id = self._lease(get_redis())
+        except Exception as e:
+            print(f"⚠️  無法分配 ID worker，改用 hostname/pid 雜湊: {e}")
+            return zlib.crc32(f"{socket.gethostname()}:{os.getpid()}".encode()) & MAX_WORKER_ID
+
+        threading.Thread(target=self._renew_loop, args=(os.getpid(),), daemon=True).start()
+        return worker_id
+
+    def _renew_loop(self, pid: int):
+        """定期續約；號碼被別的行程領走（續約中斷超過 TTL）時換一個新號碼"""
+        from app.redis_client import get_redis
+
+        interval = settings.ID_WORKER_LEASE_SECONDS / 3
+        while self._pid in (None, pid):
+            time.sleep(interval)
+            if self._pid != pid:
+                return
+            try:
+                client = get_redis()
+                key = WORKER_LEASE_KEY.format(worker_id=self._worker_id)
+                if not client.eval(RENEW_LEASE_SCRIPT, 1, key, self._owner, settings.ID_WORKER_LEASE_SECONDS):
+                    worker_id = self._lease(client)
+                    with self._lock:
+                        print(f"⚠️  ID worker {self._worker_id} 租約已被領走，改用 {worker_id}")
+                        self._worker_id = worker_id
+            except Exception as e:
+                print(f"⚠️  ID worker 續約失敗: {e}")
+
+    @property
+    def worker_id(self) -> int:
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._worker_id = self._allocate_worker_id()
+                    self._last_ms = 0
+                    self._sequence = 0
+                    self._pid = os.getpid()
+        return self._worker_id
+
+    def __call__(self) -> int:
+        worker_id = self.worker_id
+        with self._lock:
+            ms = time.time_ns() // 1_000_000 - SNOWFLAKE_EPOCH_MS
+            if ms > self._last_ms:
+                self._last_ms = ms
+                self._sequence = 0
+            else:
+                # 同一毫秒或時鐘倒退：沿用上一個時間戳，序號用完就借用下一毫秒
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    self._last_ms += 1
+                    self._sequence = 0
+            return (self._last_ms << (WORKER_BITS + SEQUENCE_BITS)) | (worker_id << SEQUENCE_BITS) | self._sequence
+
+
+uuid7 = _Uuid7Generator()
+snowflake = _SnowflakeGenerator()
+
+
+def new_job_id() -> str:
+    """圖片任務 ID（UUIDv7 字串，36 字元）"""
+    return str(uuid7())
+
+
+def new_order_no(prefix: str = "EG") -> str:
+    """訂單號：EG + Snowflake（最多 21 字元，符合藍新 MerchantOrderNo 30 字元限制）"""
+    return f"{prefix}{snowflake()}"
+
+
+def snowflake_timestamp(value: int) -> float:
+    """Snowflake ID 的產生時間（Unix 秒），除錯 / 對帳用"""
+    return ((value >> (WORKER_BITS + SEQUENCE_BITS)) + SNOWFLAKE_EPOCH_MS) / 1000
+
+
+def uuid7_timestamp(value: uuid.UUID | str) -> float:
+    """UUIDv7 的產生時間（Unix 秒）"""
+    if isinstance(value, str):
+        value = uuid.UUID(value)
+    return (value.int >> 80) / 1000
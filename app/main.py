@@ -8,15 +8,25 @@ from datetime import datetime, timedelta
 from typing import Optional
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request, Depends, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Request, Response, Depends, HTTPException, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
+from sqlalchemy import func, tuple_, update
 from sqlalchemy.orm import Session
 from linebot.exceptions import InvalidSignatureError
 
 from app.config import settings
-from app.database import engine, get_db, init_db
+from app.database import SessionLocal, engine, get_db, get_read_db, init_db
+from app.http_client import close_http_client
+from app.redis_client import close_async_redis
 from app import models, schemas
-from app.services import line_service, storage_service, payment_service
+from app.api.media import router as media_router
+from app.services import line_service, storage_service, payment_service, ai_service
+from app.services.line_dispatcher import line_dispatcher
+from app.services.points_service import points_service
+from app.services.job_partitions import hot_since, job_id_filter
+from app.services.user_cache import user_cache
+from app.services import message_templates
 from app.utils import get_or_create_user_in_db
 
 
@@ -43,10 +53,21 @@ async def lifespan(app: FastAPI):
         init_db()
         print("✅ 資料庫初始化完成")
 
+    # LINE 推播 dispatcher（背景執行）
+    dispatcher_stop = asyncio.Event()
+    dispatcher_task = None
+    if settings.LINE_DISPATCHER_IN_API and settings.LINE_CHANNEL_ACCESS_TOKEN:
+        dispatcher_task = asyncio.create_task(line_dispatcher.run(dispatcher_stop))
+
     yield
 
     # 關閉時執行
     print("👋 應用關閉中...")
+    if dispatcher_task is not None:
+        dispatcher_stop.set()
+        await dispatcher_task
+    await close_async_redis()
+    await close_http_client()
 
 
 # ============= FastAPI App =============
@@ -57,6 +78,9 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# 本地 / 記憶體儲存後端的檔案（STORAGE_BACKEND=local / memory）
+app.include_router(media_router)
+
 
 # ============= Health Check =============
 @app.get("/health")
@@ -69,6 +93,17 @@ async def health_check():
     }
 
 
+@app.get("/health/ai")
+async def ai_health_check():
+    """AI 後端健康狀態與目前權重"""
+    registry = ai_service.registry
+    states = await registry.health()
+    return {
+        name: {"healthy": healthy, "weight": registry.weight(name)}
+        for name, healthy in states.items()
+    }
+
+
 # ============= LINE Webhook =============
 @app.post("/callback/line")
 async def line_webhook(request: Request, background_tasks: BackgroundTasks):
@@ -119,55 +154,58 @@ async def newebpay_notify(request: Request, db: Session = Depends(get_db)):
     # 處理付款結果
     if status == "SUCCESS":
         order_no = data.get("MerchantOrderNo")
-        await handle_payment_success(db, order_no, data)
+        await run_in_threadpool(handle_payment_success, db, order_no, data)
 
     return "OK"
 
 
-async def handle_payment_success(db: Session, order_no: str, payment_data: dict):
-    """處理付款成功邏輯"""
-    order = db.query(models.ElderOrder).filter(
-        models.ElderOrder.order_no == order_no
-    ).first()
-
-    if not order:
-        print(f"找不到訂單: {order_no}")
-        return
-
-    if order.status == "PAID":
-        print(f"訂單 {order_no} 已經處理過了")
-        return
-
-    # 更新訂單狀態
-    order.status = "PAID"
-    order.neweb_trade_no = payment_data.get("TradeNo")
-    order.neweb_payment_type = payment_data.get("PaymentType")
-    order.pay_time = datetime.now()
+def handle_payment_success(db: Session, order_no: str, payment_data: dict) -> bool:
+    """
+    處理付款成功邏輯（在執行緒中執行，不阻塞 event loop）
+    訂單狀態以條件式 UPDATE 轉換，只有從 PENDING（或對帳標成的 EXPIRED）轉成 PAID 的那一次會加點數
+    藍新重送通知或同時收到多次時，其餘請求都會更新 0 筆，不會重複加點
 
-    # 加點數
-    user = db.query(models.ElderUser).filter(
-        models.ElderUser.id == order.user_id
+    Returns:
+        是否為第一次處理（有加點數）
+    """
+    order = db.execute(
+        update(models.ElderOrder)
+        .where(
+            models.ElderOrder.order_no == order_no,
+            models.ElderOrder.status.in_(("PENDING", "EXPIRED"))
+        )
+        .values(
+            status="PAID",
+            neweb_trade_no=payment_data.get("TradeNo"),
+            neweb_payment_type=payment_data.get("PaymentType"),
+            pay_time=func.now()
+        )
+        .returning(models.ElderOrder.user_id, models.ElderOrder.points_added)
     ).first()
 
-    if user:
-        user.points += order.points_added
+    if order is None:
+        db.rollback()
+        print(f"訂單 {order_no} 不存在或已經處理過了")
+        return False
 
+    # 同一個 transaction 加點數並寫入帳本（原子遞增，不讀回再寫）
+    credited = points_service.credit(db, order.user_id, order.points_added, "topup", order_no)
     db.commit()
 
-    # 通知用戶
-    line_service.push_message(
-        user.line_user_id,
-        [line_service.text_message(f"💰 儲值成功！獲得 {order.points_added} 點")]
-    )
+    # 通知用戶（只入列，由 dispatcher 送出）
+    if credited:
+        line_dispatcher.enqueue_push(
+            credited["line_user_id"],
+            [message_templates.render("topup_success", points=order.points_added)]
+        )
+    return True
 
 
 # ============= API Routes =============
 @app.get("/api/user/{line_user_id}", response_model=schemas.UserResponse)
-async def get_user(line_user_id: str, db: Session = Depends(get_db)):
-    """取得用戶資料"""
-    user = db.query(models.ElderUser).filter(
-        models.ElderUser.line_user_id == line_user_id
-    ).first()
+async def get_user(line_user_id: str):
+    """取得用戶資料（讀用戶快取，命中時不查資料庫；未命中時讀副本）"""
+    user = await run_in_threadpool(user_cache.get, line_user_id)
 
     if not user:
         raise HTTPException(status_code=404, detail="找不到用戶")
@@ -186,11 +224,12 @@ async def create_or_get_user(user_data: schemas.UserCreate, db: Session = Depend
 
 
 @app.get("/api/jobs/{job_id}", response_model=schemas.ImageJobResponse)
-async def get_job(job_id: str, db: Session = Depends(get_db)):
-    """查詢圖片生成任務狀態"""
-    job = db.query(models.ElderImageJob).filter(
-        models.ElderImageJob.job_id == job_id
-    ).first()
+def get_job(job_id: str, db: Session = Depends(get_read_db)):
+    """查詢圖片生成任務狀態（讀副本；剛建立的任務副本可能還沒有，改查主庫）"""
+    job = db.query(models.ElderImageJob).filter(*job_id_filter(job_id)).first()
+    if not job and db.get_bind() is not engine:
+        with SessionLocal() as primary:
+            job = primary.query(models.ElderImageJob).filter(*job_id_filter(job_id)).first()
 
     if not job:
         raise HTTPException(status_code=404, detail="找不到任務")
@@ -199,17 +238,44 @@ async def get_job(job_id: str, db: Session = Depends(get_db)):
 
 
 @app.get("/api/user/{user_id}/jobs", response_model=list[schemas.ImageJobResponse])
-async def get_user_jobs(
+def get_user_jobs(
     user_id: int,
-    db: Session = Depends(get_db),
+    response: Response,
+    db: Session = Depends(get_read_db),
     limit: int = 20,
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None
 ):
-    """取得用戶的圖片生成記錄"""
-    jobs = db.query(models.ElderImageJob).filter(
-        models.ElderImageJob.user_id == user_id
-    ).order_by(models.ElderImageJob.created_at.desc()).offset(offset).limit(limit).all()
+    """
+    取得用戶的圖片生成記錄（讀副本，新到舊）
 
+    - since: 最早的建立時間，預設為成品保留期間（STORAGE_RETENTION_RESULT_DAYS）內，只掃描最近的分區；
+      要查更早的記錄請明確指定（超過 JOB_ARCHIVE_AFTER_MONTHS 的任務已封存，不會出現在這裡）
+    - cursor: 分頁游標，傳入上一頁回應 X-Next-Cursor header 的值取得下一頁
+    """
+    since = since or hot_since()
+    query = db.query(models.ElderImageJob).filter(
+        models.ElderImageJob.user_id == user_id,
+        models.ElderImageJob.created_at >= since
+    )
+    if cursor:
+        # 同一組照片的任務 created_at 相同，以 (created_at, job_id) 排序與分頁
+        try:
+            created_at, job_id = cursor.rsplit("|", 1)
+            created_at = datetime.fromisoformat(created_at)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="cursor 格式錯誤")
+        query = query.filter(
+            tuple_(models.ElderImageJob.created_at, models.ElderImageJob.job_id) < (created_at, job_id)
+        )
+    jobs = query.order_by(
+        models.ElderImageJob.created_at.desc(), models.ElderImageJob.job_id.desc()
+    ).offset(offset).limit(limit).all()
+
+    response.headers["X-Jobs-Since"] = since.isoformat()
+    if len(jobs) == limit:
+        response.headers["X-Next-Cursor"] = f"{jobs[-1].created_at.isoformat()}|{jobs[-1].job_id}"
     return jobs
 
 
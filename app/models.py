@@ -3,7 +3,8 @@ SQLAlchemy ORM Models
 資料庫模型定義
 """
 from sqlalchemy import (
-    Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Index
+    Column, Integer, BigInteger, String, Boolean, DateTime, Text, ForeignKey, Index,
+    UniqueConstraint
 )
 from sqlalchemy.sql import func
 from app.database import Base
@@ -25,9 +26,19 @@ class ElderUser(Base):
     # 統計
     total_images_generated = Column(Integer, default=0)
 
+    # 推播對象篩選
+    is_following = Column(Boolean, default=True, nullable=False)  # 封鎖 / 刪除好友後為 False
+    last_active_at = Column(DateTime(timezone=True), server_default=func.now())  # 最後互動時間（約略，每小時最多更新一次）
+
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+    __table_args__ = (
+        # 推播分眾：依 id 遞增掃描，條件欄位放在 partial index 的 WHERE 中
+        Index("idx_elder_users_active", "last_active_at", "id", postgresql_where=is_following),
+        Index("idx_elder_users_vip", "id", postgresql_where=(is_vip & is_following)),
+    )
+
 
 class ElderOrder(Base):
     """訂單表（紀錄藍新金流交易）"""
@@ -54,14 +65,15 @@ class ElderOrder(Base):
 
 
 class ElderImageJob(Base):
-    """圖片生成任務表"""
+    """圖片生成任務表（PostgreSQL 依 created_at 每月分區，見 app/services/job_partitions.py）"""
     __tablename__ = "elder_image_jobs"
 
-    # 使用字串主 key (Celery Task ID)
+    # 使用字串主 key (Celery Task ID)；分區表的主鍵必須包含分區欄位
     job_id = Column(String(50), primary_key=True)
     user_id = Column(Integer, ForeignKey("elder_users.id", ondelete="CASCADE"))
 
     # 輸入
+    mode = Column(String(20), default="ai")  # ai, caption, instant
     prompt_used = Column(Text)
     original_url = Column(Text)  # 用戶上傳的原圖 URL
     original_image_path = Column(String(500))  # Supabase Storage path
@@ -69,6 +81,8 @@ class ElderImageJob(Base):
     # 輸出
     result_url = Column(Text)  # 生成後的成品 URL
     result_image_path = Column(String(500))  # Supabase Storage path
+    preview_url = Column(Text)  # LINE 聊天泡泡用的預覽圖 URL
+    preview_image_path = Column(String(500))
 
     # 狀態
     status = Column(String(20), default="QUEUED")  # QUEUED, PROCESSING, COMPLETED, FAILED
@@ -81,13 +95,58 @@ class ElderImageJob(Base):
     celery_task_id = Column(String(100))  # Celery 實際 task ID
     retry_count = Column(Integer, default=0)
 
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
     completed_at = Column(DateTime(timezone=True))
 
+    __table_args__ = (
+        Index("idx_elder_jobs_user", "user_id", "created_at"),
+        Index("idx_elder_jobs_status", "status"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+class ElderPointsLedger(Base):
+    """點數帳本（只新增、不修改；每次點數異動一列）"""
+    __tablename__ = "elder_points_ledger"
+
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, ForeignKey("elder_users.id", ondelete="CASCADE"), nullable=False)
+    delta = Column(Integer, nullable=False)  # 正數加點、負數扣點
+    reason = Column(String(20), nullable=False)  # signup, reserve, refund, topup
+    ref = Column(String(50))  # 對應的 job_id / order_no
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # 同一任務只會扣一次、退一次；同一訂單只會加一次
+        UniqueConstraint("reason", "ref", name="uq_elder_points_ledger_ref"),
+        Index("idx_elder_points_ledger_user", "user_id", "created_at"),
+    )
+
+
+class ElderStorageObject(Base):
+    """內容定址的儲存物件索引（去重與引用計數）"""
+    __tablename__ = "elder_storage_objects"
+
+    content_hash = Column(String(64), primary_key=True)  # sha256 hex
+    path = Column(String(500), nullable=False)  # sha256/ab/cd/{hash}.{ext}
+    url = Column(Text)  # 上傳完成前為 NULL
+    remote_id = Column(String(200))  # 刪除遠端物件用的 ID
+    content_type = Column(String(50))
+    size_bytes = Column(Integer)
+
+    # 被幾個任務欄位引用，歸零才能刪除；-1 表示 GC 已認領、刪除中
+    ref_count = Column(Integer, default=1, nullable=False)
+
+    # 先認領再上傳：uploading 時只有認領者上傳，其他人等 ready；claimed_at 過久視為認領者已中斷
+    status = Column(String(10), default="ready", nullable=False)
+    claimed_at = Column(DateTime(timezone=True))
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_referenced_at = Column(DateTime(timezone=True), server_default=func.now())
+
 
 # 建立索引
 Index("idx_elder_users_line", ElderUser.line_user_id)
 Index("idx_elder_orders_no", ElderOrder.order_no)
 Index("idx_elder_orders_user", ElderOrder.user_id)
-Index("idx_elder_jobs_user", ElderImageJob.user_id)
-Index("idx_elder_jobs_status", ElderImageJob.status)
@@ -0,0 +1,54 @@
+"""
+Redis Client
+共用 Redis 連線（延遲建立，每個 process 一個連線池）
+"""
+import asyncio
+import weakref
+from typing import Optional
+import redis
+import redis.asyncio
+from app.config import settings
+
+_client: Optional[redis.Redis] = None
+
+
+def get_redis() -> redis.Redis:
+    """
+    取得共用 Redis client
+    redis-py 的連線池會在 fork 後自動重建，Celery prefork 子行程可直接使用
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_timeout=5,
+            socket_connect_timeout=5,
+        )
+    return _client
+
+
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, redis.asyncio.Redis]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_async_redis() -> redis.asyncio.Redis:
+    """取得目前 event loop 的 async Redis client（連線綁定在 loop 上，每個 loop 各一個）"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = redis.asyncio.Redis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_connect_timeout=5,
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def close_async_redis():
+    """關閉目前 event loop 的 async Redis client"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
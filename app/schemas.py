@@ -88,9 +88,11 @@ class ImageJobResponse(BaseModel):
     """圖片任務回應"""
     job_id: str
     user_id: int
+    mode: Optional[str] = "ai"
     prompt_used: Optional[str]
     original_url: Optional[str]
     result_url: Optional[str]
+    preview_url: Optional[str] = None
     status: Literal["QUEUED", "PROCESSING", "COMPLETED", "FAILED"]
     error_message: Optional[str]
     cost_points: int
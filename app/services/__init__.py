@@ -1,12 +1,49 @@
 # Services module
-from .line_service import LineService
-from .storage_service import StorageService
-from .payment_service import NewebPayService
-from .ai_service import BananaProService
+from .line_service import LineService, line_service
+from .storage_service import StorageService, storage_service
+from .payment_service import NewebPayService, payment_service
+from .ai_service import BananaProService, ai_service
+from .image_service import ImageService, image_service
+from .caption_service import CaptionService, caption_service
+from .template_service import TemplateService, template_service
+from .ai_backends import BackendRegistry, ImageBackend, GenerationRequest
+from .storage_backends import StorageBackend
+from .line_dispatcher import LineDispatcher, line_dispatcher
+from .campaign_service import CampaignService, campaign_service
+from .points_service import PointsService, points_service
+from .user_cache import UserCache, user_cache
+from .job_scheduler import JobScheduler, job_scheduler
+from .image_sets import ImageSetCollector, image_set_collector
 
 __all__ = [
     "LineService",
     "StorageService",
     "NewebPayService",
     "BananaProService",
+    "ImageService",
+    "CaptionService",
+    "TemplateService",
+    "BackendRegistry",
+    "ImageBackend",
+    "GenerationRequest",
+    "StorageBackend",
+    "LineDispatcher",
+    "CampaignService",
+    "PointsService",
+    "UserCache",
+    "JobScheduler",
+    "ImageSetCollector",
+    "line_service",
+    "storage_service",
+    "payment_service",
+    "ai_service",
+    "image_service",
+    "caption_service",
+    "template_service",
+    "line_dispatcher",
+    "campaign_service",
+    "points_service",
+    "user_cache",
+    "job_scheduler",
+    "image_set_collector",
 ]
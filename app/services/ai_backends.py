@@ -0,0 +1,463 @@
+"""
+AI Image Generation Backends
+圖片生成後端介面、實作與權重負載平衡 Registry
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import math
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+import httpx
+from app.config import settings
+from app.http_client import get_http_client
+
+
+class BackendError(Exception):
+    """後端呼叫失敗"""
+
+
+@dataclass(frozen=True)
+class GenerationRequest:
+    """單次生成請求（與後端 payload 格式無關）"""
+    prompt: str
+    image_url: Optional[str] = None
+    style: str = "realistic"
+    strength: float = 0.7
+
+
+# ============= Hedging =============
+class LatencyTracker:
+    """滑動視窗延遲統計（Hedging 門檻用）"""
+
+    def __init__(self, window_size: int = 200):
+        self._samples: deque = deque(maxlen=window_size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float):
+        """記錄一次成功呼叫的延遲（秒）"""
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """取得第 p 百分位延遲，沒有樣本時回傳 None"""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        rank = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+        return ordered[min(rank, len(ordered) - 1)]
+
+
+class HedgeBudget:
+    """
+    Hedging 預算（Token Bucket）
+    每個主請求補充 ratio 個 token，每次 hedge 消耗 1 個，
+    長期下額外請求數不會超過主請求數 * ratio
+    """
+
+    def __init__(self, ratio: float = 0.05, max_tokens: float = 5.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = 0.0
+
+    def on_request(self):
+        """每個主請求呼叫一次"""
+        self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        """嘗試取得一次 hedge 額度"""
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+
+# ============= Backend Interface =============
+class ImageBackend:
+    """
+    圖片生成後端基底類別
+    子類別實作 _generate_once / health；hedging 與批次由基底類別處理
+    """
+
+    name = "base"
+
+    def __init__(self):
+        # Hedging 狀態（每個後端、每個 process 各自統計）
+        self._latency = LatencyTracker(settings.AI_HEDGE_WINDOW_SIZE)
+        self._hedge_budget = HedgeBudget(settings.AI_HEDGE_BUDGET_RATIO)
+
+    def is_configured(self) -> bool:
+        """檢查是否已設定"""
+        return True
+
+    async def _generate_once(self, request: GenerationRequest) -> dict:
+        """
+        呼叫一次後端
+
+        Returns:
+            {"image_url": "..."} 或 {"image_bytes": b"..."}
+
+        Raises:
+            BackendError / httpx.HTTPError
+        """
+        raise NotImplementedError
+
+    async def health(self) -> bool:
+        """健康檢查"""
+        raise NotImplementedError
+
+    async def generate(self, request: GenerationRequest) -> dict:
+        """生成一張圖片（支援 hedging）"""
+        return await self._call_with_hedging(request)
+
+    async def generate_batch(self, requests: list[GenerationRequest]) -> list:
+        """
+        批次生成（預設以有限並行度逐一呼叫）
+
+        Returns:
+            與 requests 等長的 list，每個元素為結果 dict 或 Exception
+        """
+        semaphore = asyncio.Semaphore(settings.AI_BATCH_CONCURRENCY)
+
+        async def _one(request: GenerationRequest):
+            async with semaphore:
+                return await self.generate(request)
+
+        return await asyncio.gather(
+            *(_one(request) for request in requests),
+            return_exceptions=True
+        )
+
+    async def _timed_generate(self, request: GenerationRequest) -> dict:
+        """呼叫一次後端，成功時記錄延遲"""
+        started = time.monotonic()
+        result = await self._generate_once(request)
+        self._latency.record(time.monotonic() - started)
+        return result
+
+    async def _call_with_hedging(self, request: GenerationRequest) -> dict:
+        """
+        Hedged request：主請求超過近期第 N 百分位延遲仍未回應時，
+        在預算內送出第二個相同請求，採用先成功者並取消另一個
+        """
+        if not settings.AI_HEDGE_ENABLED:
+            return await self._timed_generate(request)
+
+        self._hedge_budget.on_request()
+
+        hedge_delay = None
+        if len(self._latency) >= settings.AI_HEDGE_MIN_SAMPLES:
+            hedge_delay = self._latency.percentile(settings.AI_HEDGE_PERCENTILE)
+        if hedge_delay is None:
+            return await self._timed_generate(request)
+
+        primary = asyncio.create_task(self._timed_generate(request))
+        pending = {primary}
+        first_error: Optional[BaseException] = None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=hedge_delay)
+            if done or not self._hedge_budget.try_acquire():
+                return await primary
+
+            print(f"⏱️  [{self.name}] AI 請求超過 {hedge_delay:.1f}s，送出 hedge 請求")
+            pending.add(asyncio.create_task(self._timed_generate(request)))
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    first_error = first_error or task.exception()
+            raise first_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+# ============= Banana Pro =============
+class BananaBackend(ImageBackend):
+    """Banana Pro 後端"""
+
+    name = "banana"
+
+    def __init__(self):
+        super().__init__()
+        self.api_key = settings.BANANA_API_KEY or ""
+        self.model_key = settings.BANANA_MODEL_KEY or ""
+        self.base_url = "https://api.banana.dev"
+
+    def is_configured(self) -> bool:
+        return bool(self.api_key)
+
+    async def _generate_once(self, request: GenerationRequest) -> dict:
+        # Banana Pro API 呼叫
+        # 注意: 這裡需要根據實際的 Banana Pro API 文件調整
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = self._build_payload(request)
+
+        response = await get_http_client().post(
+            f"{self.base_url}/generate",
+            headers=headers,
+            json=payload,
+            timeout=120.0
+        )
+        response.raise_for_status()
+        result = response.json()
+
+        # 處理回傳結果
+        if "image_url" in result:
+            return {"image_url": result["image_url"]}
+        if "image_base64" in result:
+            return {"image_bytes": base64.b64decode(result["image_base64"])}
+        raise BackendError("未知的回應格式")
+
+    async def health(self) -> bool:
+        if not self.is_configured():
+            return False
+        try:
+            response = await get_http_client().get(self.base_url, timeout=5.0)
+            return response.status_code < 500
+        except httpx.HTTPError:
+            return False
+
+    def _build_payload(self, request: GenerationRequest) -> dict:
+        """
+        建構 API Payload
+        """
+        # 根據風格調整 prompt
+        style_prompts = {
+            "realistic": "realistic photo, high quality, detailed, 8k",
+            "anime": "anime style, vibrant colors, detailed illustration",
+            "sketch": "pencil sketch, artistic, hand-drawn",
+            "painting": "oil painting style, classic art, masterpiece"
+        }
+
+        style_prompt = style_prompts.get(request.style, style_prompts["realistic"])
+        enhanced_prompt = f"{request.prompt}, {style_prompt}"
+
+        payload = {
+            "model": self.model_key or "stable-diffusion-xl",
+            "prompt": enhanced_prompt,
+            "negative_prompt": "ugly, blurry, low quality, distorted, deformed, text, letters, watermark",
+            "width": 1024,
+            "height": 1024,
+            "num_inference_steps": 30,
+            "guidance_scale": 7.5,
+        }
+
+        # 如果有來源圖片，做 img2img
+        if request.image_url:
+            payload["init_image"] = request.image_url
+            payload["strength"] = request.strength
+
+        return payload
+
+
+# ============= Local Stub =============
+class StubBackend(ImageBackend):
+    """
+    本地 Stub 後端（離線 Benchmark / 開發用）
+    延遲為 log-normal 分佈、錯誤依固定機率發生，亂數種子固定所以結果可重現；
+    圖片顏色由請求內容決定，同一請求永遠得到同一張圖
+    """
+
+    name = "stub"
+
+    def __init__(self):
+        super().__init__()
+        self._rng = random.Random(settings.AI_STUB_SEED)
+
+    async def _generate_once(self, request: GenerationRequest) -> dict:
+        median = settings.AI_STUB_LATENCY_MS / 1000
+        latency = median * math.exp(self._rng.gauss(0, settings.AI_STUB_LATENCY_SIGMA))
+        failed = self._rng.random() < settings.AI_STUB_ERROR_RATE
+        await asyncio.sleep(latency)
+
+        if failed:
+            raise BackendError("stub 模擬錯誤")
+        return {"image_bytes": self._render(request)}
+
+    async def health(self) -> bool:
+        return True
+
+    @staticmethod
+    def _render(request: GenerationRequest) -> bytes:
+        """產生 1024x1024 純色 PNG（顏色由請求內容雜湊決定）"""
+        from PIL import Image
+
+        digest = hashlib.sha256(
+            f"{request.prompt}|{request.image_url}|{request.style}".encode("utf-8")
+        ).digest()
+        image = Image.new("RGB", (1024, 1024), tuple(digest[:3]))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+
+BACKEND_CLASSES = {
+    "banana": BananaBackend,
+    "stub": StubBackend,
+}
+
+
+# ============= Registry =============
+class BackendRegistry:
+    """
+    後端 Registry：權重負載平衡 + 故障轉移 + 簡易斷路器
+    權重來自 AI_BACKENDS，可用 Redis hash 即時覆寫（不需重新部署）
+    """
+
+    WEIGHTS_KEY = "elder:ai:backend_weights"
+
+    def __init__(self, spec: str):
+        self.backends: dict[str, ImageBackend] = {}
+        self._weights: dict[str, float] = {}
+        self._overrides: dict[str, float] = {}
+        self._overrides_loaded_at = 0.0
+        self._failures: dict[str, int] = {}
+        self._open_until: dict[str, float] = {}
+
+        for name, weight in self._parse_spec(spec):
+            backend_cls = BACKEND_CLASSES.get(name)
+            if backend_cls is None:
+                print(f"⚠️  未知的 AI 後端: {name}")
+                continue
+            self.backends[name] = backend_cls()
+            self._weights[name] = weight
+
+    @staticmethod
+    def _parse_spec(spec: str) -> list[tuple[str, float]]:
+        """解析 "banana:80,stub:20" 格式"""
+        entries = []
+        for item in spec.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            name, _, weight = item.partition(":")
+            entries.append((name.strip(), float(weight) if weight else 1.0))
+        return entries
+
+    async def _refresh_overrides(self):
+        """定期從 Redis 讀取權重覆寫（失敗時沿用上次結果）"""
+        now = time.monotonic()
+        if now - self._overrides_loaded_at < settings.AI_BACKEND_WEIGHTS_REFRESH_SECONDS:
+            return
+        self._overrides_loaded_at = now
+        try:
+            from app.redis_client import get_redis
+            raw = await asyncio.to_thread(get_redis().hgetall, self.WEIGHTS_KEY)
+            self._overrides = {name: float(weight) for name, weight in raw.items()}
+        except Exception as e:
+            print(f"⚠️  讀取 AI 後端權重失敗: {e}")
+
+    def weight(self, name: str) -> float:
+        """目前生效的權重"""
+        return self._overrides.get(name, self._weights.get(name, 0.0))
+
+    def set_weight(self, name: str, weight: float):
+        """寫入 Redis 權重覆寫，所有 worker 於下次刷新時生效"""
+        from app.redis_client import get_redis
+        get_redis().hset(self.WEIGHTS_KEY, name, weight)
+        self._overrides[name] = weight
+
+    def _is_open(self, name: str) -> bool:
+        return self._open_until.get(name, 0.0) > time.monotonic()
+
+    def _record_success(self, name: str):
+        self._failures[name] = 0
+        self._open_until.pop(name, None)
+
+    def _record_failure(self, name: str):
+        self._failures[name] = self._failures.get(name, 0) + 1
+        if self._failures[name] >= settings.AI_BACKEND_FAILURE_THRESHOLD:
+            self._open_until[name] = time.monotonic() + settings.AI_BACKEND_COOLDOWN_SECONDS
+            print(f"⚠️  AI 後端 {name} 連續失敗，暫停 {settings.AI_BACKEND_COOLDOWN_SECONDS}s")
+
+    def _candidates(self) -> list[ImageBackend]:
+        """
+        依權重隨機排序可用後端（Efraimidis-Spirakis 加權抽樣）
+        斷路中的後端排在最後，僅在其他後端都失敗時嘗試
+        """
+        keyed = []
+        for name, backend in self.backends.items():
+            weight = self.weight(name)
+            if weight <= 0 or not backend.is_configured():
+                continue
+            key = random.random() ** (1.0 / weight)
+            keyed.append((not self._is_open(name), key, backend))
+        keyed.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        return [backend for _, _, backend in keyed]
+
+    async def generate(self, request: GenerationRequest) -> dict:
+        """
+        依權重挑選後端生成圖片，失敗時轉移到下一個後端
+
+        Returns:
+            {"success": True, "backend": "...", "image_url"/"image_bytes": ...}
+            或 {"success": False, "error": "..."}
+        """
+        await self._refresh_overrides()
+        candidates = self._candidates()
+        if not candidates:
+            return {"success": False, "error": "沒有可用的 AI 後端"}
+
+        errors = []
+        for backend in candidates:
+            try:
+                result = await backend.generate(request)
+            except httpx.HTTPStatusError as e:
+                errors.append(f"{backend.name}: API 呼叫失敗: {e.response.status_code}")
+                self._record_failure(backend.name)
+                continue
+            except Exception as e:
+                errors.append(f"{backend.name}: {e}")
+                self._record_failure(backend.name)
+                continue
+
+            self._record_success(backend.name)
+            return {"success": True, "backend": backend.name, **result}
+
+        return {"success": False, "error": "; ".join(errors)}
+
+    async def generate_batch(self, requests: list[GenerationRequest]) -> list[dict]:
+        """
+        批次生成：整批交給同一個後端，失敗的項目再個別故障轉移
+        """
+        await self._refresh_overrides()
+        candidates = self._candidates()
+        if not candidates:
+            return [{"success": False, "error": "沒有可用的 AI 後端"} for _ in requests]
+
+        backend = candidates[0]
+        raw_results = await backend.generate_batch(requests)
+
+        results = []
+        for request, raw in zip(requests, raw_results):
+            if isinstance(raw, Exception):
+                self._record_failure(backend.name)
+                results.append(await self.generate(request))
+            else:
+                self._record_success(backend.name)
+                results.append({"success": True, "backend": backend.name, **raw})
+        return results
+
+    async def health(self) -> dict[str, bool]:
+        """各後端健康狀態"""
+        names = list(self.backends)
+        states = await asyncio.gather(
+            *(self.backends[name].health() for name in names),
+            return_exceptions=True
+        )
+        return {
+            name: state is True and not self._is_open(name)
+            for name, state in zip(names, states)
+        }
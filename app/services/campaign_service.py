@@ -0,0 +1,147 @@
+"""
+Campaign Service
+全體 / 分眾推播（例如節慶問候）：以 server-side cursor 串流收件人，每 500 人一次 multicast
+實際送出交給 line_dispatcher（共用速率限制與重試），這裡只負責分批、背壓與檢查點
+"""
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import select
+from app.config import settings
+from app.redis_client import get_redis
+from app.services.line_dispatcher import line_dispatcher
+
+CAMPAIGN_KEY = "elder:campaign:{campaign_id}"
+CAMPAIGN_LOCK_KEY = "elder:campaign:{campaign_id}:lock"
+CAMPAIGN_TTL = 30 * 24 * 3600  # 進度保留 30 天
+
+# 產生每批固定 retry key 用的 namespace
+CAMPAIGN_NAMESPACE = uuid.UUID("6f1c2a9e-5b7d-4c1e-9a53-2d8f0e4b7c61")
+
+
+@dataclass(frozen=True)
+class Segment:
+    """推播對象篩選（只會送給仍是好友的用戶）"""
+    vip_only: bool = False
+    active_within_days: Optional[int] = None  # 最近 N 天有互動
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "Segment":
+        return cls(**(data or {}))
+
+
+class CampaignService:
+    """推播活動"""
+
+    def __init__(self):
+        self.chunk_size = min(settings.CAMPAIGN_CHUNK_SIZE, 500)
+
+    def _recipients(self, segment: Segment, after_id: int):
+        """
+        收件人查詢，依 id 遞增（配合檢查點）
+        布林條件直接寫欄位本身，與 partial index 的 WHERE 寫法一致，planner 才會使用
+        """
+        from app.models import ElderUser
+
+        stmt = (
+            select(ElderUser.id, ElderUser.line_user_id)
+            .where(ElderUser.is_following, ElderUser.id > after_id)
+            .order_by(ElderUser.id)
+        )
+        if segment.vip_only:
+            stmt = stmt.where(ElderUser.is_vip)
+        if segment.active_within_days:
+            cutoff = datetime.now(timezone.utc) - timedelta(days=segment.active_within_days)
+            stmt = stmt.where(ElderUser.last_active_at >= cutoff)
+        return stmt
+
+    def _retry_key(self, campaign_id: str, first_user_id: int) -> str:
+        """同一活動的同一批收件人永遠得到同一個 retry key，中斷重跑也不會重複送達"""
+        return str(uuid.uuid5(CAMPAIGN_NAMESPACE, f"{campaign_id}:{first_user_id}"))
+
+    def _wait_for_capacity(self):
+        """背壓：推播佇列積太多時先等 dispatcher 消化"""
+        while line_dispatcher.stats()["ready"] > settings.CAMPAIGN_MAX_PENDING:
+            time.sleep(1)
+
+    def progress(self, campaign_id: str) -> dict:
+        """活動進度"""
+        return get_redis().hgetall(CAMPAIGN_KEY.format(campaign_id=campaign_id))
+
+    def run(self, campaign_id: str, messages: list, segment: Optional[Segment] = None) -> dict:
+        """
+        執行（或從檢查點接續）一個推播活動
+
+        Args:
+            campaign_id: 活動 ID（同一 ID 重跑會從上次進度接續）
+            messages: LINE 訊息（dict 或 SDK 物件，最多 5 則）
+            segment: 推播對象
+
+        Returns:
+            {"success": True, "recipients": 12000, "chunks": 24}
+        """
+        from app.database import SessionLocal
+
+        if SessionLocal is None:
+            return {"success": False, "error": "資料庫未設定"}
+
+        segment = segment or Segment()
+        client = get_redis()
+        key = CAMPAIGN_KEY.format(campaign_id=campaign_id)
+        lock = client.lock(
+            CAMPAIGN_LOCK_KEY.format(campaign_id=campaign_id), timeout=600, thread_local=False
+        )
+        if not lock.acquire(blocking=False):
+            return {"success": False, "error": "活動正在執行中"}
+
+        try:
+            state = client.hgetall(key)
+            if state.get("status") == "COMPLETED":
+                return {"success": True, "recipients": int(state["recipients"]), "chunks": int(state["chunks"])}
+
+            last_id = int(state.get("last_user_id", 0))
+            recipients = int(state.get("recipients", 0))
+            chunks = int(state.get("chunks", 0))
+            client.hset(key, mapping={"status": "RUNNING", "segment": str(asdict(segment))})
+            client.expire(key, CAMPAIGN_TTL)
+            payload = line_dispatcher.serialize_messages(messages)  # 每一批共用同一份 JSON
+
+            db = SessionLocal()
+            try:
+                result = db.execute(
+                    self._recipients(segment, last_id)
+                    .execution_options(stream_results=True, yield_per=self.chunk_size)
+                )
+                for rows in result.partitions():
+                    self._wait_for_capacity()
+                    line_dispatcher.enqueue_multicast(
+                        [row.line_user_id for row in rows],
+                        payload,
+                        retry_key=self._retry_key(campaign_id, rows[0].id)
+                    )
+                    last_id = rows[-1].id
+                    recipients += len(rows)
+                    chunks += 1
+                    client.hset(key, mapping={
+                        "last_user_id": last_id,
+                        "recipients": recipients,
+                        "chunks": chunks,
+                    })
+                    lock.extend(600, replace_ttl=True)
+            finally:
+                db.close()
+
+            client.hset(key, mapping={"status": "COMPLETED", "finished_at": datetime.now(timezone.utc).isoformat()})
+            print(f"📣 推播活動 {campaign_id} 完成：{recipients} 人，{chunks} 批")
+            return {"success": True, "recipients": recipients, "chunks": chunks}
+        finally:
+            try:
+                lock.release()
+            except Exception:
+                pass
+
+
+# 單例模式
+campaign_service = CampaignService()
@@ -0,0 +1,222 @@
+"""
+Caption Rendering Service
+長輩圖文字合成：在圖片上繪製大字 CJK 標語（描邊、漸層、預設樣式）
+字型、字寬、排版結果都有快取，單次合成只需數毫秒
+"""
+import io
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo
+from app.config import settings
+
+
+@dataclass(frozen=True)
+class CaptionStyle:
+    """標語樣式"""
+    text: str
+    top_color: tuple  # 漸層上方顏色 (R, G, B)
+    bottom_color: tuple  # 漸層下方顏色
+    outline_color: tuple = (255, 255, 255)
+    outline_ratio: float = 0.08  # 描邊寬度 / 字高
+    size_ratio: float = 0.16  # 字高 / 圖片高度
+    position: str = "bottom"  # top, center, bottom
+    max_lines: int = 2
+
+
+# 預設樣式（key 同時作為觸發詞）
+PRESETS = {
+    "早安": CaptionStyle("早安", (255, 214, 0), (255, 64, 0), position="top"),
+    "午安": CaptionStyle("午安", (255, 170, 0), (230, 40, 90), position="top"),
+    "晚安": CaptionStyle("晚安", (120, 200, 255), (110, 40, 200), outline_color=(255, 250, 210)),
+    "平安喜樂": CaptionStyle("平安喜樂", (255, 120, 200), (200, 0, 80)),
+    "福氣滿滿": CaptionStyle("福氣滿滿", (255, 230, 80), (220, 0, 0), outline_color=(120, 0, 0)),
+    "身體健康": CaptionStyle("身體健康", (120, 255, 120), (0, 140, 60)),
+}
+
+DEFAULT_STYLE = CaptionStyle("", (255, 230, 0), (255, 40, 40))
+
+TAIPEI = ZoneInfo("Asia/Taipei")
+
+
+def default_caption(now: Optional[datetime] = None) -> str:
+    """依台北時間挑選問候語"""
+    hour = (now or datetime.now(TAIPEI)).hour
+    if 4 <= hour < 11:
+        return "早安"
+    if 11 <= hour < 14:
+        return "午安"
+    if 14 <= hour < 20:
+        return "平安喜樂"
+    return "晚安"
+
+
+def style_for(text: str) -> CaptionStyle:
+    """依文字挑選樣式，沒有對應預設時用預設配色"""
+    preset = PRESETS.get(text)
+    if preset:
+        return preset
+    return CaptionStyle(
+        text,
+        DEFAULT_STYLE.top_color,
+        DEFAULT_STYLE.bottom_color,
+        DEFAULT_STYLE.outline_color,
+    )
+
+
+# ============= 快取 =============
+@lru_cache(maxsize=32)
+def _load_font(path: str, size: int):
+    """字型快取（FreeType 載入 CJK 字型檔很慢）"""
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError:
+        print(f"⚠️  找不到字型 {path}，改用內建字型（不支援中文）")
+        return ImageFont.load_default(size)
+
+
+@lru_cache(maxsize=8192)
+def _glyph_advance(path: str, size: int, char: str) -> float:
+    """單字寬度快取"""
+    return _load_font(path, size).getlength(char)
+
+
+@lru_cache(maxsize=1024)
+def _layout(text: str, path: str, size: int, max_width: int) -> tuple:
+    """
+    排版快取：CJK 逐字換行
+
+    Returns:
+        (lines, line_widths, block_width)
+    """
+    lines = []
+    widths = []
+    for paragraph in text.split("\n"):
+        line = ""
+        width = 0.0
+        for char in paragraph:
+            advance = _glyph_advance(path, size, char)
+            if line and width + advance > max_width:
+                lines.append(line)
+                widths.append(width)
+                line, width = "", 0.0
+            line += char
+            width += advance
+        lines.append(line)
+        widths.append(width)
+    return tuple(lines), tuple(widths), max(widths, default=0.0)
+
+
+@lru_cache(maxsize=64)
+def _gradient(width: int, height: int, top: tuple, bottom: tuple):
+    """垂直漸層填色快取"""
+    from PIL import Image, ImageOps
+
+    ramp = Image.linear_gradient("L").resize((width, height))
+    return ImageOps.colorize(ramp, top, bottom)
+
+
+class CaptionService:
+    """長輩圖文字合成"""
+
+    def __init__(self):
+        self.font_path = settings.CAPTION_FONT_PATH
+
+    def _fit(self, style: CaptionStyle, text: str, image_width: int, image_height: int) -> tuple:
+        """從樣式字高開始縮小，直到行數與高度都放得下"""
+        max_width = int(image_width * 0.9)
+        size = max(12, int(image_height * style.size_ratio))
+        while True:
+            lines, widths, block_width = _layout(text, self.font_path, size, max_width)
+            block_height = len(lines) * size * 1.15
+            if (len(lines) <= style.max_lines and block_height <= image_height * 0.45) or size <= 12:
+                return size, lines, widths, block_width
+            size = int(size * 0.85)
+
+    def render_image(self, image, text: Optional[str] = None):
+        """
+        在 PIL Image 上合成標語
+
+        Args:
+            image: PIL Image
+            text: 標語文字，省略時依時段挑選問候語
+
+        Returns:
+            合成後的 RGB PIL Image
+        """
+        from PIL import Image, ImageDraw
+
+        text = (text or default_caption()).strip()
+        style = style_for(text)
+        image = image.convert("RGB")
+        if not text:
+            return image
+
+        size, lines, widths, block_width = self._fit(style, text, image.width, image.height)
+        font = _load_font(self.font_path, size)
+        stroke = max(1, int(size * style.outline_ratio))
+        line_height = int(size * 1.15)
+        block_height = line_height * len(lines)
+
+        margin = int(image.height * 0.04)
+        if style.position == "top":
+            top = margin
+        elif style.position == "center":
+            top = (image.height - block_height) // 2
+        else:
+            top = image.height - block_height - margin
+
+        # 只處理文字所在區域，減少合成像素數
+        box_width = int(block_width) + stroke * 2
+        box_height = block_height + stroke * 2
+        left = max(0, (image.width - box_width) // 2)
+        top = max(0, top)
+        box_width = min(box_width, image.width - left)
+        box_height = min(box_height, image.height - top)
+
+        fill_mask = Image.new("L", (box_width, box_height), 0)
+        outline_mask = Image.new("L", (box_width, box_height), 0)
+        fill_draw = ImageDraw.Draw(fill_mask)
+        outline_draw = ImageDraw.Draw(outline_mask)
+        for index, (line, width) in enumerate(zip(lines, widths)):
+            x = (box_width - width) / 2
+            y = stroke + index * line_height
+            outline_draw.text((x, y), line, font=font, fill=255, stroke_width=stroke, stroke_fill=255)
+            fill_draw.text((x, y), line, font=font, fill=255)
+
+        region = image.crop((left, top, left + box_width, top + box_height))
+        region.paste(Image.new("RGB", region.size, style.outline_color), mask=outline_mask)
+        region.paste(
+            _gradient(box_width, box_height, style.top_color, style.bottom_color),
+            mask=fill_mask
+        )
+        image.paste(region, (left, top))
+        return image
+
+    def render(self, image_data: bytes, text: Optional[str] = None) -> dict:
+        """
+        在圖片 bytes 上合成標語
+
+        Returns:
+            {"success": True, "data": b"...", "content_type": "image/png"}
+            或 {"success": False, "error": "..."}
+        """
+        from PIL import Image
+
+        try:
+            with Image.open(io.BytesIO(image_data)) as source:
+                image = self.render_image(source, text)
+        except (OSError, ValueError, SyntaxError) as e:
+            return {"success": False, "error": f"標語合成失敗: {e}"}
+
+        buffer = io.BytesIO()
+        # 之後還會經過成品圖編碼，這裡用 PNG 避免重複壓縮失真
+        image.save(buffer, format="PNG", compress_level=1)
+        return {"success": True, "data": buffer.getvalue(), "content_type": "image/png"}
+
+
+# 單例模式
+caption_service = CaptionService()
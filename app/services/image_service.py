@@ -0,0 +1,252 @@
+"""
+Image Processing Service
+用戶上傳圖片的前處理與成品圖編碼（CPU 密集工作在執行緒執行，Pillow 解碼 / 縮圖 / 編碼時會釋放 GIL）
+"""
+import asyncio
+import io
+from typing import BinaryIO, Optional, Union
+from app.config import settings
+
+# 允許的輸入格式
+ALLOWED_INPUT_FORMATS = {"JPEG", "PNG", "WEBP", "GIF", "BMP", "MPO"}
+
+CONTENT_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+}
+
+
+# 檔案開頭的 magic bytes → 格式（下載途中就能判斷，不必等整個檔案）
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+)
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """從檔案開頭判斷圖片格式，不是允許的格式時回傳 None"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for signature, image_format in _SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    return None
+
+
+def _as_file(data: Union[bytes, BinaryIO]) -> BinaryIO:
+    """bytes 或檔案物件（下載時的暫存檔）都當成檔案讀，從頭開始"""
+    if isinstance(data, (bytes, bytearray)):
+        return io.BytesIO(data)
+    data.seek(0)
+    return data
+
+
+def _byte_size(data: Union[bytes, BinaryIO]) -> int:
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    return data.seek(0, io.SEEK_END)
+
+
+def probe_image(data: Union[bytes, BinaryIO], max_bytes: int, max_pixels: int) -> dict:
+    """
+    只讀取檔頭檢查圖片（不解碼像素資料）
+    data 可以是 bytes 或檔案物件
+
+    Returns:
+        {"success": True, "format": "JPEG", "width": 4032, "height": 3024}
+        或 {"success": False, "error": "..."}
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    size = _byte_size(data)
+    if not size:
+        return {"success": False, "error": "空白檔案"}
+    if size > max_bytes:
+        return {"success": False, "error": f"檔案過大 ({size // 1024} KB)"}
+
+    try:
+        # Image.open 是延遲載入，這裡只會解析檔頭
+        with Image.open(_as_file(data)) as image:
+            image_format = image.format
+            width, height = image.size
+    except Image.DecompressionBombError as e:
+        # 超過 Pillow 內建上限（約 1.79 億像素）時 Image.open 就會拒絕，與尺寸過大同樣處理
+        return {"success": False, "error": f"圖片尺寸過大: {e}"}
+    except (UnidentifiedImageError, OSError, SyntaxError) as e:
+        return {"success": False, "error": f"無法辨識的圖片: {e}"}
+
+    if image_format not in ALLOWED_INPUT_FORMATS:
+        return {"success": False, "error": f"不支援的格式: {image_format}"}
+    if width * height > max_pixels:
+        return {"success": False, "error": f"圖片尺寸過大 ({width}x{height})"}
+
+    return {"success": True, "format": image_format, "width": width, "height": height}
+
+
+def normalize_image(data: Union[bytes, BinaryIO], target_size: int, jpeg_quality: int) -> dict:
+    """
+    解碼並正規化圖片（在執行緒中執行，不碰 event loop），data 可以是 bytes 或檔案物件
+    1. JPEG 使用 draft() 在解碼階段直接降採樣
+    2. 套用 EXIF 方向
+    3. 縮到 target_size 以內
+    4. 有透明度輸出 PNG，否則輸出 JPEG
+
+    Returns:
+        {"success": True, "data": b"...", "content_type": "image/jpeg", "width": ..., "height": ...}
+    """
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(_as_file(data)) as image:
+            if image.format == "JPEG":
+                image.draft("RGB", (target_size, target_size))
+            image = ImageOps.exif_transpose(image)
+
+            has_alpha = image.mode in ("RGBA", "LA") or (
+                image.mode == "P" and "transparency" in image.info
+            )
+            image = image.convert("RGBA" if has_alpha else "RGB")
+            image.thumbnail((target_size, target_size), Image.Resampling.LANCZOS)
+
+            buffer = io.BytesIO()
+            if has_alpha:
+                image.save(buffer, format="PNG", optimize=True)
+                content_type = CONTENT_TYPES["PNG"]
+            else:
+                image.save(buffer, format="JPEG", quality=jpeg_quality, optimize=True)
+                content_type = CONTENT_TYPES["JPEG"]
+
+            return {
+                "success": True,
+                "data": buffer.getvalue(),
+                "content_type": content_type,
+                "width": image.width,
+                "height": image.height,
+            }
+    except Image.DecompressionBombError as e:
+        return {"success": False, "error": f"圖片尺寸過大: {e}"}
+    except (OSError, ValueError, SyntaxError) as e:
+        return {"success": False, "error": f"圖片解碼失敗: {e}"}
+
+
+def _encode_jpeg_within(image, max_bytes: int, quality: int, min_quality: int = 60) -> bytes:
+    """以 JPEG 編碼並逐步降低品質 / 尺寸，直到小於 max_bytes"""
+    from PIL import Image
+
+    while True:
+        for q in range(quality, min_quality - 1, -10):
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=q, optimize=True, progressive=True)
+            if buffer.tell() <= max_bytes:
+                return buffer.getvalue()
+        # 降品質仍超過上限，縮小尺寸再試
+        if min(image.size) <= 64:
+            return buffer.getvalue()
+        image = image.resize(
+            (int(image.width * 0.8), int(image.height * 0.8)),
+            Image.Resampling.LANCZOS
+        )
+
+
+def encode_result(
+    data: bytes,
+    original_max_size: int,
+    original_max_bytes: int,
+    original_quality: int,
+    preview_size: int,
+    preview_max_bytes: int,
+) -> dict:
+    """
+    將 AI 生成結果編碼成 LINE 推播用的成品圖與預覽圖（在執行緒中執行）
+    LINE 圖片訊息只接受 JPEG / PNG，所以統一輸出 JPEG
+
+    Returns:
+        {
+            "success": True,
+            "original": {"data": b"...", "content_type": "image/jpeg", "width": ..., "height": ...},
+            "preview": {...}
+        }
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            image = source.convert("RGBA") if "A" in source.getbands() else source.convert("RGB")
+    except Image.DecompressionBombError as e:
+        return {"success": False, "error": f"圖片尺寸過大: {e}"}
+    except (OSError, ValueError, SyntaxError) as e:
+        return {"success": False, "error": f"圖片解碼失敗: {e}"}
+
+    if image.mode == "RGBA":
+        # JPEG 沒有透明度，鋪在白底上
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+
+    image.thumbnail((original_max_size, original_max_size), Image.Resampling.LANCZOS)
+    original = _encode_jpeg_within(image, original_max_bytes, original_quality)
+
+    preview_image = image.copy()
+    preview_image.thumbnail((preview_size, preview_size), Image.Resampling.LANCZOS)
+    preview = _encode_jpeg_within(preview_image, preview_max_bytes, 80)
+
+    return {
+        "success": True,
+        "original": {
+            "data": original,
+            "content_type": CONTENT_TYPES["JPEG"],
+            "width": image.width,
+            "height": image.height,
+        },
+        "preview": {
+            "data": preview,
+            "content_type": CONTENT_TYPES["JPEG"],
+            "width": preview_image.width,
+            "height": preview_image.height,
+        },
+    }
+
+
+class ImageService:
+    """
+    圖片前處理服務
+    只在 Celery prefork 子行程使用，子行程是 daemon 不能再開 Process Pool；
+    並行度由 worker concurrency 決定，這裡只把 CPU 工作移出 event loop
+    """
+
+    def _normalize_args(self, data: Union[bytes, BinaryIO]) -> tuple:
+        return (data, settings.IMAGE_TARGET_SIZE, settings.IMAGE_JPEG_QUALITY)
+
+    def probe(self, data: Union[bytes, BinaryIO]) -> dict:
+        """檢查檔頭（大小 / 格式 / 像素數）"""
+        return probe_image(data, settings.IMAGE_MAX_INPUT_BYTES, settings.IMAGE_MAX_PIXELS)
+
+    async def normalize_async(self, data: Union[bytes, BinaryIO]) -> dict:
+        """正規化用戶上傳圖片（不阻塞 event loop）"""
+        probe = self.probe(data)
+        if not probe["success"]:
+            return probe
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, normalize_image, *self._normalize_args(data))
+
+    async def encode_result_async(self, data: bytes) -> dict:
+        """產生成品圖與預覽圖（不阻塞 event loop）"""
+        args = (
+            data,
+            settings.RESULT_MAX_SIZE,
+            settings.RESULT_MAX_BYTES,
+            settings.RESULT_JPEG_QUALITY,
+            settings.RESULT_PREVIEW_SIZE,
+            settings.RESULT_PREVIEW_MAX_BYTES,
+        )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, encode_result, *args)
+
+
+# 單例模式
+image_service = ImageService()
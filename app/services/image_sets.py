@@ -0,0 +1,105 @@
+"""
+Image Sets
+用戶一次傳多張照片時，LINE 會送出多個帶有相同 imageSet.id 的 ImageMessage 事件（可能分散在不同 webhook）
+在 Redis 收集同一組的 message_id：收齊時由最後一個事件處理，沒收齊則等待時間到了由延遲任務處理
+一組照片只扣一次點、回覆一次、送出一個批次任務
+"""
+from typing import Optional
+from app.config import settings
+from app.redis_client import get_redis
+
+MESSAGES_KEY = "elder:imageset:{set_id}:messages"  # {index: message_id}
+META_KEY = "elder:imageset:{set_id}:meta"  # reply_token（第一個事件的）、user、claimed
+
+# add 的結果
+FIRST = "first"  # 這組的第一張，需要排定等待逾時的處理
+WAITING = "waiting"  # 還沒收齊
+COMPLETE = "complete"  # 收齊了，由這個事件處理
+LATE = "late"  # 這組已經被處理過，單獨處理這張
+
+ADD_SCRIPT = """
+if redis.call('HEXISTS', KEYS[2], 'claimed') == 1 then
+    return -1
+end
+local first = redis.call('HSETNX', KEYS[2], 'reply_token', ARGV[3])
+redis.call('HSETNX', KEYS[2], 'user', ARGV[4])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+if redis.call('HLEN', KEYS[1]) >= tonumber(ARGV[5]) then
+    return 2
+end
+return first
+"""
+
+# 只有一個呼叫端能取得這組照片；claimed 標記留到過期，晚到的照片會單獨處理
+# 已過期（或不存在）的組不建立沒有 TTL 的 meta
+CLAIM_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 or redis.call('HSETNX', KEYS[2], 'claimed', 1) == 0 then
+    return false
+end
+local messages = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return {redis.call('HGET', KEYS[2], 'reply_token') or '', redis.call('HGET', KEYS[2], 'user') or '', messages}
+"""
+
+
+class ImageSetCollector:
+    """imageSet 收集器"""
+
+    def __init__(self):
+        self._add_script = None
+        self._claim_script = None
+
+    @staticmethod
+    def _keys(set_id: str) -> list[str]:
+        return [MESSAGES_KEY.format(set_id=set_id), META_KEY.format(set_id=set_id)]
+
+    def add(
+        self,
+        set_id: str,
+        index: int,
+        total: int,
+        message_id: str,
+        reply_token: str,
+        line_user_id: str
+    ) -> str:
+        """
+        加入一張照片
+
+        Returns:
+            FIRST / WAITING / COMPLETE / LATE
+        """
+        if self._add_script is None:
+            self._add_script = get_redis().register_script(ADD_SCRIPT)
+        result = self._add_script(
+            keys=self._keys(set_id),
+            args=[index, message_id, reply_token, line_user_id, total, settings.IMAGE_SET_TTL_SECONDS]
+        )
+        return {-1: LATE, 0: WAITING, 1: FIRST, 2: COMPLETE}[result]
+
+    def claim(self, set_id: str) -> Optional[dict]:
+        """
+        取得整組照片（依 index 排序），已被處理過時回傳 None
+
+        Returns:
+            {"reply_token": ..., "line_user_id": ..., "message_ids": [...]}
+        """
+        if self._claim_script is None:
+            self._claim_script = get_redis().register_script(CLAIM_SCRIPT)
+        result = self._claim_script(keys=self._keys(set_id))
+        if not result:
+            return None
+        reply_token, line_user_id, flat = result
+        messages = dict(zip(flat[::2], flat[1::2]))
+        if not messages:
+            return None
+        return {
+            "reply_token": reply_token,
+            "line_user_id": line_user_id,
+            "message_ids": [messages[index] for index in sorted(messages, key=int)],
+        }
+
+
+# 單例模式
+image_set_collector = ImageSetCollector()
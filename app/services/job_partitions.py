@@ -0,0 +1,186 @@
+"""
+Job Partitions
+elder_image_jobs 依 created_at 每月分區：預先建立未來的分區，超過保留月數的分區卸離後搬到冷資料表
+熱查詢帶上 created_at 範圍，Postgres 只會掃描最近的分區
+"""
+import re
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import text
+from app.config import settings
+from app.ids import uuid7_timestamp
+from app.redis_client import get_redis
+
+PARENT_TABLE = "elder_image_jobs"
+ARCHIVE_TABLE = "elder_image_jobs_archive"
+PARTITION_NAME = "elder_image_jobs_p{year:04d}{month:02d}"
+PARTITION_PATTERN = re.compile(r"^elder_image_jobs_p(\d{4})(\d{2})$")
+
+LOCK_KEY = "elder:partitions:lock"
+
+# job_id 是 UUIDv7 時，created_at 與 ID 時間的最大誤差（產生 ID 與寫入 DB 的時間差）
+JOB_ID_CLOCK_SKEW = timedelta(days=1)
+
+
+def month_start(day: date, offset: int = 0) -> date:
+    """day 所在月份往後 offset 個月的第一天"""
+    index = day.year * 12 + day.month - 1 + offset
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return PARTITION_NAME.format(year=month.year, month=month.month)
+
+
+def hot_since() -> datetime:
+    """
+    熱查詢的起始時間（作品列表等）
+    超過成品保留天數的圖片已被清掉，只查這段時間內的分區
+    """
+    return datetime.now(timezone.utc) - timedelta(days=settings.STORAGE_RETENTION_RESULT_DAYS)
+
+
+def job_id_filter(job_id: str) -> list:
+    """
+    以 job_id 查詢任務的條件；UUIDv7 的 job_id 帶有建立時間，加上 created_at 範圍讓 Postgres 只掃描對應分區
+    舊的 uuid4 job_id 無法推算時間，只比對 job_id
+    """
+    from app.models import ElderImageJob
+
+    conditions = [ElderImageJob.job_id == job_id]
+    try:
+        parsed = uuid.UUID(job_id)
+    except ValueError:
+        return conditions
+    if parsed.version == 7:
+        created = datetime.fromtimestamp(uuid7_timestamp(parsed), tz=timezone.utc)
+        conditions += [
+            ElderImageJob.created_at >= created - JOB_ID_CLOCK_SKEW,
+            ElderImageJob.created_at < created + JOB_ID_CLOCK_SKEW,
+        ]
+    return conditions
+
+
+def job_ids_filter(job_ids: list[str]) -> list:
+    """同 job_id_filter，一次查多個任務（全部是 UUIDv7 時才加上 created_at 範圍）"""
+    from app.models import ElderImageJob
+
+    conditions = [ElderImageJob.job_id.in_(job_ids)]
+    try:
+        parsed = [uuid.UUID(job_id) for job_id in job_ids]
+    except ValueError:
+        return conditions
+    if parsed and all(p.version == 7 for p in parsed):
+        created = [datetime.fromtimestamp(uuid7_timestamp(p), tz=timezone.utc) for p in parsed]
+        conditions += [
+            ElderImageJob.created_at >= min(created) - JOB_ID_CLOCK_SKEW,
+            ElderImageJob.created_at < max(created) + JOB_ID_CLOCK_SKEW,
+        ]
+    return conditions
+
+
+class JobPartitionManager:
+    """任務表分區維護"""
+
+    def ensure_partitions(self, conn, months_ahead: int = None) -> list[str]:
+        """建立本月到未來 months_ahead 個月的分區（已存在就略過）"""
+        months_ahead = settings.JOB_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+        this_month = month_start(datetime.now(timezone.utc).date())
+        existing = set(self._partitions(conn))
+        created = []
+        for offset in range(months_ahead + 1):
+            month = month_start(this_month, offset)
+            name = partition_name(month)
+            if name in existing:
+                continue
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{month_start(month, 1).isoformat()}')"
+            ))
+            created.append(name)
+        return created
+
+    @staticmethod
+    def _partitions(conn) -> dict:
+        """目前掛在任務表下的分區 {名稱: 是否卸離中（DETACH CONCURRENTLY 中斷）}"""
+        rows = conn.execute(text("""
+            SELECT c.relname, i.inhdetachpending
+            FROM pg_inherits AS i
+            JOIN pg_class AS c ON c.oid = i.inhrelid
+            WHERE i.inhparent = CAST(:parent AS regclass)
+        """), {"parent": PARENT_TABLE}).all()
+        return {row.relname: row.inhdetachpending for row in rows}
+
+    @staticmethod
+    def _detached(conn) -> list[str]:
+        """已卸離但還沒搬到冷資料表的分區（上次中斷）"""
+        rows = conn.execute(text("""
+            SELECT c.relname
+            FROM pg_class AS c
+            JOIN pg_namespace AS n ON n.oid = c.relnamespace
+            WHERE n.nspname = current_schema() AND c.relkind = 'r' AND NOT c.relispartition
+              AND c.relname LIKE 'elder_image_jobs_p%'
+        """)).all()
+        return [row.relname for row in rows if PARTITION_PATTERN.match(row.relname)]
+
+    def _archive_table(self, engine, name: str):
+        """把卸離的分區搬進冷資料表後刪除（同一個交易）"""
+        with engine.begin() as conn:
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS)"
+            ))
+            conn.execute(text(f"INSERT INTO {ARCHIVE_TABLE} SELECT * FROM {name}"))
+            conn.execute(text(f"DROP TABLE {name}"))
+
+    def archive_old(self, engine, keep_months: int = None) -> list[str]:
+        """
+        超過 keep_months 個月的分區：DETACH CONCURRENTLY（不阻擋寫入）→ 搬到冷資料表
+        """
+        keep_months = settings.JOB_ARCHIVE_AFTER_MONTHS if keep_months is None else keep_months
+        cutoff = month_start(datetime.now(timezone.utc).date(), -keep_months)
+
+        # DETACH CONCURRENTLY 不能在交易中執行
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for name, pending in self._partitions(conn).items():
+                match = PARTITION_PATTERN.match(name)
+                if not match or date(int(match[1]), int(match[2]), 1) >= cutoff:
+                    continue
+                mode = "FINALIZE" if pending else "CONCURRENTLY"
+                conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name} {mode}"))
+                print(f"📦 卸離任務分區 {name}")
+            detached = self._detached(conn)
+
+        for name in detached:
+            self._archive_table(engine, name)
+            print(f"📦 任務分區 {name} 已搬到 {ARCHIVE_TABLE}")
+        return detached
+
+    def run(self) -> dict:
+        """
+        建立未來分區並封存舊分區（同時間只會有一個在跑）
+
+        Returns:
+            {"success": True, "created": [...], "archived": [...]}
+        """
+        from app.database import engine
+
+        if engine is None or engine.dialect.name != "postgresql":
+            return {"success": False, "error": "分區只支援 PostgreSQL"}
+
+        lock = get_redis().lock(LOCK_KEY, timeout=3600, thread_local=False)
+        if not lock.acquire(blocking=False):
+            return {"success": False, "error": "已有分區維護在執行"}
+        try:
+            with engine.begin() as conn:
+                created = self.ensure_partitions(conn)
+            archived = self.archive_old(engine)
+            return {"success": True, "created": created, "archived": archived}
+        finally:
+            try:
+                lock.release()
+            except Exception:
+                pass
+
+
+# 單例模式
+job_partitions = JobPartitionManager()
@@ -0,0 +1,224 @@
+"""
+Job Scheduler
+生成任務的公平排程：每個用戶在 Redis 有自己的子佇列，輪流（round-robin）送進 Celery
+- 每個 Celery queue 同時送出的任務數有上限，broker 裡不會堆積長長的 FIFO
+- 每個用戶同時執行中的任務數有上限，一次上傳 30 張的用戶不會佔滿 worker
+單張照片的用戶最多只需等待「目前有任務的用戶數」輪，不受其他用戶排了多少張影響
+
+所有 key 都帶同一個 hash tag，Lua script 只存取 KEYS 中宣告的 key（Redis Cluster 相容）：
+    {elder:jobs}:lanes            有用過的 Celery queue
+    {elder:jobs}:leases           已送出、尚未結束的任務 {job_id: {"lane", "user", "weight", "at"}}
+    {elder:jobs}:inflight         執行中的任務數 {"lane:user": n}
+    {elder:jobs}:totals           各 queue 已送出的任務數 {lane: n}
+    {elder:jobs}:<lane>:ring      輪替順序（有排隊任務的用戶）
+    {elder:jobs}:<lane>:members   在輪替中的用戶
+    {elder:jobs}:<lane>:pending   所有用戶的子佇列（zset，成員 "user:序號:payload"，以字典序取出用戶最早的任務）
+    {elder:jobs}:<lane>:seq       序號
+"""
+import json
+import time
+import redis
+from app.config import settings
+from app.redis_client import get_redis
+
+KEY_PREFIX = "{elder:jobs}:"
+LANES_KEY = KEY_PREFIX + "lanes"
+LEASES_KEY = KEY_PREFIX + "leases"
+INFLIGHT_KEY = KEY_PREFIX + "inflight"
+TOTALS_KEY = KEY_PREFIX + "totals"
+
+DEFAULT_TASK = "tasks.process_elder_image"
+
+# 加入用戶子佇列；用戶原本沒有排隊的任務時排到輪替尾端
+# ARGV[4] 為空時取新序號，送出失敗排回時沿用原序號（維持在用戶子佇列最前面）
+SUBMIT_SCRIPT = """
+local user = ARGV[1]
+local seq = tonumber(ARGV[4])
+redis.call('SADD', KEYS[1], ARGV[3])
+if not seq then
+    seq = redis.call('INCR', KEYS[5])
+end
+redis.call('ZADD', KEYS[4], 0, user .. ':' .. string.format('%020d', seq) .. ':' .. ARGV[2])
+if redis.call('SADD', KEYS[3], user) == 1 then
+    redis.call('RPUSH', KEYS[2], user)
+end
+return seq
+"""
+
+# 輪流從各用戶子佇列取出任務，直到 queue 額度用完或繞一圈都沒有可送的任務
+# 任務的權重（一組照片的張數，最多等於用戶上限）計入用戶與 queue 的額度
+PUMP_SCRIPT = """
+local user_cap = tonumber(ARGV[1])
+local lane_cap = tonumber(ARGV[2])
+local lane = ARGV[3]
+local total = tonumber(redis.call('HGET', KEYS[6], lane) or '0')
+local dispatched = {}
+local idle = 0
+while total < lane_cap and idle < redis.call('LLEN', KEYS[2]) do
+    local user = redis.call('LPOP', KEYS[2])
+    local first, last = '[' .. user .. ':', '(' .. user .. ';'
+    local slot = lane .. ':' .. user
+    local member = redis.call('ZRANGEBYLEX', KEYS[4], first, last, 'LIMIT', 0, 1)[1]
+    local payload = nil
+    local weight = 1
+    if member then
+        payload = cjson.decode(string.sub(member, #user + 23))
+        weight = math.min(tonumber(payload.weight) or 1, user_cap)
+        if tonumber(redis.call('HGET', KEYS[5], slot) or '0') + weight > user_cap then
+            payload = nil
+        end
+    end
+    if payload then
+        redis.call('ZREM', KEYS[4], member)
+        redis.call('HINCRBY', KEYS[5], slot, weight)
+        total = total + weight
+        redis.call('HSET', KEYS[1], payload.job_id,
+            cjson.encode({lane = lane, user = user, weight = weight, at = tonumber(ARGV[4])}))
+        table.insert(dispatched, member)
+        idle = 0
+    else
+        idle = idle + 1
+    end
+    if redis.call('ZLEXCOUNT', KEYS[4], first, last) > 0 then
+        redis.call('RPUSH', KEYS[2], user)
+    else
+        redis.call('SREM', KEYS[3], user)
+    end
+end
+redis.call('HSET', KEYS[6], lane, total)
+return dispatched
+"""
+
+# 任務結束：釋放用戶與 queue 的額度，回傳 queue 名稱（不在租約中時回傳 false）
+COMPLETE_SCRIPT = """
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+if not raw then
+    return false
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+local lease = cjson.decode(raw)
+local slot = lease.lane .. ':' .. lease.user
+local weight = tonumber(lease.weight) or 1
+if redis.call('HINCRBY', KEYS[2], slot, -weight) <= 0 then
+    redis.call('HDEL', KEYS[2], slot)
+end
+if redis.call('HINCRBY', KEYS[3], lease.lane, -weight) < 0 then
+    redis.call('HSET', KEYS[3], lease.lane, 0)
+end
+return lease.lane
+"""
+
+
+class JobScheduler:
+    """生成任務公平排程（依 Celery queue 分開計算額度）"""
+
+    def __init__(self):
+        self.user_inflight = settings.JOB_SCHEDULER_USER_INFLIGHT
+        self.max_dispatched = settings.JOB_SCHEDULER_MAX_DISPATCHED
+        self._scripts = {}
+
+    def _script(self, source: str):
+        if source not in self._scripts:
+            self._scripts[source] = get_redis().register_script(source)
+        return self._scripts[source]
+
+    @staticmethod
+    def _lane_keys(lane: str) -> dict:
+        prefix = f"{KEY_PREFIX}{lane}:"
+        return {name: prefix + name for name in ("ring", "members", "pending", "seq")}
+
+    def _enqueue(self, lane: str, user: str, payload: str, seq: str = ""):
+        keys = self._lane_keys(lane)
+        self._script(SUBMIT_SCRIPT)(
+            keys=[LANES_KEY, keys["ring"], keys["members"], keys["pending"], keys["seq"]],
+            args=[user, payload, lane, seq]
+        )
+
+    @staticmethod
+    def _send(lane: str, payload: dict):
+        from app.worker import celery_app
+
+        celery_app.tasks[payload.get("task", DEFAULT_TASK)].apply_async(kwargs=payload["kwargs"], queue=lane)
+
+    def submit(
+        self,
+        user_id: int,
+        job_id: str,
+        kwargs: dict,
+        queue: str = None,
+        task: str = DEFAULT_TASK,
+        weight: int = 1
+    ):
+        """
+        把生成任務排進用戶的子佇列，並嘗試送出
+        Redis 無法使用時直接送進 Celery（退回 FIFO）
+        有例外拋出時任務沒有排進任何地方，由呼叫端退點
+
+        Args:
+            job_id: 排程用的 ID（批次任務用第一個 job_id），任務結束時以此釋放額度
+            task: Celery task 名稱
+            weight: 佔用的額度（批次任務為照片張數，最多算到 JOB_SCHEDULER_USER_INFLIGHT）
+        """
+        lane = queue or "celery"
+        payload = json.dumps(
+            {"job_id": job_id, "task": task, "weight": weight, "kwargs": kwargs}, ensure_ascii=False
+        )
+        try:
+            self._enqueue(lane, str(user_id), payload)
+        except redis.RedisError as e:
+            print(f"⚠️  公平排程無法使用，任務 {job_id} 直接送出: {e}")
+            self._send(lane, {"task": task, "kwargs": kwargs})
+            return
+        try:
+            self.pump(lane)
+        except redis.RedisError as e:
+            # 已排進子佇列，交給定期的 pump_all 送出
+            print(f"⚠️  任務 {job_id} 已排入，暫時無法送出: {e}")
+
+    def pump(self, lane: str) -> int:
+        """依輪替順序送出任務，直到額度用完；回傳送出的數量"""
+        keys = self._lane_keys(lane)
+        members = self._script(PUMP_SCRIPT)(
+            keys=[LEASES_KEY, keys["ring"], keys["members"], keys["pending"], INFLIGHT_KEY, TOTALS_KEY],
+            args=[self.user_inflight, self.max_dispatched, lane, int(time.time())]
+        )
+        for member in members:
+            user, seq, raw = member.split(":", 2)
+            payload = json.loads(raw)
+            try:
+                self._send(lane, payload)
+            except Exception as e:
+                # 送不出去（broker 中斷等）就釋放額度並以原序號排回子佇列，交給下次 pump
+                print(f"❌ 任務 {payload['job_id']} 送出失敗: {e}")
+                self.complete(payload["job_id"], pump=False)
+                self._enqueue(lane, user, raw, seq)
+        return len(members)
+
+    def complete(self, job_id: str, pump: bool = True):
+        """任務結束（成功或最終失敗）後釋放額度，並送出下一批"""
+        lane = self._script(COMPLETE_SCRIPT)(keys=[LEASES_KEY, INFLIGHT_KEY, TOTALS_KEY], args=[job_id])
+        if lane and pump:
+            self.pump(lane)
+
+    def pump_all(self) -> dict:
+        """
+        定期執行：釋放超過租約時間仍未結束的任務（worker 被強制終止等），再逐一 queue 送出
+
+        Returns:
+            {"success": True, "expired": 0, "dispatched": {"celery": 3}}
+        """
+        client = get_redis()
+        deadline = time.time() - settings.JOB_SCHEDULER_LEASE_SECONDS
+        expired = 0
+        for job_id, raw in client.hgetall(LEASES_KEY).items():
+            if json.loads(raw)["at"] < deadline:
+                print(f"⚠️  任務 {job_id} 超過租約時間仍未結束，釋放排程額度")
+                self.complete(job_id, pump=False)
+                expired += 1
+
+        dispatched = {lane: self.pump(lane) for lane in client.smembers(LANES_KEY)}
+        return {"success": True, "expired": expired, "dispatched": dispatched}
+
+
+# 單例模式
+job_scheduler = JobScheduler()
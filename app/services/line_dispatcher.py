@@ -0,0 +1,356 @@
+"""
+LINE Outbound Dispatcher
+所有主動推播先進 Redis 佇列，再由 async sender 依全域 token bucket 的速率送出
+429 / 5xx / 網路錯誤以指數退避重試，並帶同一個 X-Line-Retry-Key，LINE 端不會重複送出
+LINE 大量失敗時，產圖 worker 只負責入列，不會被拖慢或標成失敗
+
+佇列結構（Redis）：
+    elder:line:outbox                ready 佇列（LPUSH 入列、從右側取出）
+    elder:line:outbox:delayed        等待重試（zset，score = 可重送的時間）
+    elder:line:outbox:processing:*   各 dispatcher 處理中的訊息（dispatcher 停止心跳後由其他 dispatcher 放回 ready）
+    elder:line:outbox:heartbeat:*    各 dispatcher 的心跳（TTL）
+    elder:line:outbox:dead           超過重試次數或無法重試的訊息
+"""
+import asyncio
+import json
+import os
+import random
+import socket
+import time
+import uuid
+from typing import Optional
+import httpx
+import redis
+from app.config import settings
+from app.http_client import get_http_client
+from app.redis_client import get_async_redis, get_redis
+
+LINE_API_URL = "https://api.line.me"
+
+OUTBOX_KEY = "elder:line:outbox"
+DELAYED_KEY = "elder:line:outbox:delayed"
+PROCESSING_KEY_PREFIX = "elder:line:outbox:processing:"
+HEARTBEAT_KEY_PREFIX = "elder:line:outbox:heartbeat:"
+DEAD_KEY = "elder:line:outbox:dead"
+BUCKET_KEY = "elder:line:bucket"
+PAUSE_KEY = "elder:line:pause"
+
+DEAD_LETTER_MAX = 10000
+PROMOTE_BATCH = 500
+HEARTBEAT_TTL = 30  # 秒，超過沒更新視為 dispatcher 已停止
+RECOVER_INTERVAL = 60  # 秒，定期接手已停止的 dispatcher 留下的訊息
+
+# Token bucket：回傳需要等待的秒數（0 表示已取得）
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 60)
+return tostring(wait)
+"""
+
+# 把到期的延遲訊息移回 ready 佇列
+PROMOTE_SCRIPT = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, item in ipairs(items) do
+    redis.call('ZREM', KEYS[1], item)
+    redis.call('LPUSH', KEYS[2], item)
+end
+return #items
+"""
+
+
+class LineDispatcher:
+    """LINE 推播 Dispatcher"""
+
+    def __init__(self):
+        self.consumer_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._bucket_script = None
+
+    @property
+    def processing_key(self) -> str:
+        return f"{PROCESSING_KEY_PREFIX}{self.consumer_id}"
+
+    @property
+    def heartbeat_key(self) -> str:
+        return f"{HEARTBEAT_KEY_PREFIX}{self.consumer_id}"
+
+    # ============= 入列（同步，worker / API 都可呼叫） =============
+    @staticmethod
+    def serialize_messages(messages) -> str:
+        """
+        訊息 → JSON 陣列字串
+        模板訊息（PreparedMessage）直接沿用快取的 JSON，SDK 物件 / dict 才序列化
+        """
+        from app.services.message_templates import PreparedMessage
+
+        if not isinstance(messages, (list, tuple)):
+            messages = [messages]
+        fragments = []
+        for m in messages:
+            if isinstance(m, PreparedMessage):
+                fragments.append(m.json)
+            else:
+                payload = m.as_json_dict() if hasattr(m, "as_json_dict") else m
+                fragments.append(json.dumps(payload, ensure_ascii=False, separators=(",", ":")))
+        return "[" + ",".join(fragments) + "]"
+
+    def _enqueue(self, endpoint: str, to, messages: str, retry_key: Optional[str] = None) -> str:
+        envelope = {
+            "id": retry_key or str(uuid.uuid4()),  # 同時作為 X-Line-Retry-Key（必須是 UUID）
+            "endpoint": endpoint,
+            # 送出時直接當 request body，不再重新序列化
+            "payload": '{"to":%s,"messages":%s}' % (json.dumps(to, ensure_ascii=False), messages),
+            "attempts": 0,
+            "enqueued_at": time.time(),
+        }
+        get_redis().lpush(OUTBOX_KEY, json.dumps(envelope, ensure_ascii=False))
+        return envelope["id"]
+
+    def enqueue_push(self, to: str, messages) -> Optional[str]:
+        """
+        推播訊息給單一用戶（不等待送出）
+        Redis 無法使用時退回直接推播
+
+        Returns:
+            訊息 ID（retry key），直接推播時回傳 None
+        """
+        try:
+            return self._enqueue("push", to, self.serialize_messages(messages))
+        except redis.RedisError as e:
+            print(f"⚠️  推播佇列無法使用，改為直接推播: {e}")
+            from app.services.line_service import line_service
+
+            line_service.push_message(to, messages)
+            return None
+
+    def enqueue_multicast(self, to: list[str], messages, retry_key: Optional[str] = None) -> str:
+        """
+        推播給多個用戶（最多 500 人，不等待送出）
+        retry_key 固定時，重複入列同一批也只會送達一次（LINE 保留 24 小時）
+        messages 可以直接傳 serialize_messages 的結果，整個活動的每一批共用同一份 JSON
+        """
+        if not isinstance(messages, str):
+            messages = self.serialize_messages(messages)
+        return self._enqueue("multicast", list(to), messages, retry_key)
+
+    # ============= 速率限制 =============
+    async def _acquire(self, endpoint: str):
+        """取得 token bucket 額度（push / multicast 各自限速）；LINE 回 429 時所有 sender 一起暫停"""
+        client = get_async_redis()
+        if self._bucket_script is None or self._bucket_script.registered_client is not client:
+            self._bucket_script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        while True:
+            pause_ms = await client.pttl(PAUSE_KEY)
+            if pause_ms and pause_ms > 0:
+                await asyncio.sleep(pause_ms / 1000)
+                continue
+            rate = settings.LINE_MULTICAST_RATE if endpoint == "multicast" else settings.LINE_DISPATCH_RATE
+            wait = float(await self._bucket_script(
+                keys=[f"{BUCKET_KEY}:{endpoint}"],
+                args=[rate, settings.LINE_DISPATCH_BURST, time.time(), 1]
+            ))
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def _pause(self, seconds: float):
+        await get_async_redis().set(PAUSE_KEY, "1", px=max(1, int(seconds * 1000)))
+
+    # ============= 送出 =============
+    def _backoff(self, attempts: int) -> float:
+        delay = min(settings.LINE_DISPATCH_BACKOFF_MAX, settings.LINE_DISPATCH_BACKOFF_BASE * 2 ** attempts)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _send(self, envelope: dict) -> tuple:
+        """
+        送出一則訊息
+
+        Returns:
+            ("ok", None) / ("retry", 延遲秒數) / ("dead", 錯誤說明)
+        """
+        headers = {
+            "Authorization": f"Bearer {settings.LINE_CHANNEL_ACCESS_TOKEN}",
+            "Content-Type": "application/json",
+            "X-Line-Retry-Key": envelope["id"],
+        }
+        try:
+            response = await get_http_client().post(
+                f"{LINE_API_URL}/v2/bot/message/{envelope['endpoint']}",
+                content=envelope["payload"].encode("utf-8"),
+                headers=headers,
+            )
+        except httpx.TransportError:
+            return "retry", self._backoff(envelope["attempts"])
+
+        status = response.status_code
+        # 409：同一個 retry key 已經被接受過（前一次其實成功了）
+        if status < 300 or status == 409:
+            return "ok", None
+        if status == 429:
+            # 月額度用完，重試也沒用
+            if "monthly limit" in response.text:
+                return "dead", f"429 {response.text[:200]}"
+            retry_after = response.headers.get("Retry-After")
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else \
+                self._backoff(envelope["attempts"])
+            await self._pause(delay)
+            return "retry", delay
+        if status >= 500:
+            return "retry", self._backoff(envelope["attempts"])
+        return "dead", f"{status} {response.text[:200]}"
+
+    async def _handle(self, raw: str):
+        client = get_async_redis()
+        envelope = json.loads(raw)
+        await self._acquire(envelope["endpoint"])
+        outcome, detail = await self._send(envelope)
+
+        if outcome == "retry":
+            envelope["attempts"] += 1
+            if envelope["attempts"] >= settings.LINE_DISPATCH_MAX_ATTEMPTS:
+                outcome, detail = "dead", "超過重試次數"
+            else:
+                await client.zadd(
+                    DELAYED_KEY, {json.dumps(envelope, ensure_ascii=False): time.time() + detail}
+                )
+        if outcome == "dead":
+            envelope["error"] = detail
+            print(f"❌ LINE 推播失敗，移到 dead-letter: {detail}")
+            await client.lpush(DEAD_KEY, json.dumps(envelope, ensure_ascii=False))
+            await client.ltrim(DEAD_KEY, 0, DEAD_LETTER_MAX - 1)
+
+        await client.lrem(self.processing_key, 1, raw)
+
+    async def _dead_letter(self, raw: str, error: Exception):
+        """無法處理的訊息（格式錯誤、非預期例外）直接移到 dead-letter，不再放回佇列"""
+        client = get_async_redis()
+        try:
+            envelope = json.loads(raw)
+            if not isinstance(envelope, dict):
+                raise ValueError("envelope 不是 object")
+        except ValueError:
+            envelope = {"raw": raw}
+        envelope["error"] = f"{type(error).__name__}: {error}"
+        print(f"❌ LINE 推播無法處理，移到 dead-letter: {envelope['error']}")
+        await client.lpush(DEAD_KEY, json.dumps(envelope, ensure_ascii=False))
+        await client.ltrim(DEAD_KEY, 0, DEAD_LETTER_MAX - 1)
+        await client.lrem(self.processing_key, 1, raw)
+
+    async def _sender(self, stop: asyncio.Event):
+        """從 ready 佇列取訊息並送出（每個 dispatcher 跑多個）"""
+        client = get_async_redis()
+        while not stop.is_set():
+            try:
+                raw = await client.blmove(OUTBOX_KEY, self.processing_key, 1, "RIGHT", "LEFT")
+                if raw is None:
+                    continue
+                try:
+                    await self._handle(raw)
+                except redis.RedisError:
+                    raise
+                except Exception as e:
+                    # 單則訊息的錯誤不能讓 sender 停下（留在處理中的話，重啟後又會再次觸發）
+                    await self._dead_letter(raw, e)
+            except redis.RedisError as e:
+                print(f"⚠️  推播佇列錯誤: {e}")
+                await asyncio.sleep(1)
+
+    async def _promoter(self, stop: asyncio.Event):
+        """每秒把到期的重試訊息移回 ready 佇列"""
+        client = get_async_redis()
+        script = client.register_script(PROMOTE_SCRIPT)
+        while not stop.is_set():
+            try:
+                moved = await script(keys=[DELAYED_KEY, OUTBOX_KEY], args=[time.time(), PROMOTE_BATCH])
+                if moved >= PROMOTE_BATCH:
+                    continue
+            except redis.RedisError as e:
+                print(f"⚠️  推播重試佇列錯誤: {e}")
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _recover(self, include_own: bool = False) -> int:
+        """
+        把處理中的訊息放回 ready 佇列（retry key 不變，不會重複送達）
+        接手心跳已過期的 dispatcher 留下的訊息（重新部署後 hostname / pid 都會變）；
+        自己的處理中清單只在啟動時接手（執行中的訊息還在處理）
+        """
+        client = get_async_redis()
+        recovered = 0
+        async for key in client.scan_iter(match=f"{PROCESSING_KEY_PREFIX}*", count=100):
+            consumer_id = key[len(PROCESSING_KEY_PREFIX):]
+            if consumer_id == self.consumer_id:
+                if not include_own:
+                    continue
+            elif await client.exists(f"{HEARTBEAT_KEY_PREFIX}{consumer_id}"):
+                continue
+            while await client.lmove(key, OUTBOX_KEY, "RIGHT", "RIGHT"):
+                recovered += 1
+        if recovered:
+            print(f"📮 放回 {recovered} 則未完成的推播")
+        return recovered
+
+    async def _heartbeat(self, stop: asyncio.Event):
+        """定期更新心跳，並接手已停止的 dispatcher 留下的訊息"""
+        client = get_async_redis()
+        last_recover = time.monotonic()
+        while not stop.is_set():
+            try:
+                await client.set(self.heartbeat_key, "1", ex=HEARTBEAT_TTL)
+                if time.monotonic() - last_recover >= RECOVER_INTERVAL:
+                    last_recover = time.monotonic()
+                    await self._recover()
+            except redis.RedisError as e:
+                print(f"⚠️  推播 dispatcher 心跳錯誤: {e}")
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=HEARTBEAT_TTL / 3)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, stop: Optional[asyncio.Event] = None):
+        """執行 dispatcher 直到 stop 被設定"""
+        stop = stop or asyncio.Event()
+        try:
+            # 先送出心跳，其他 dispatcher 才不會接手這個處理中清單
+            await get_async_redis().set(self.heartbeat_key, "1", ex=HEARTBEAT_TTL)
+            await self._recover(include_own=True)
+        except redis.RedisError as e:
+            print(f"⚠️  無法放回未完成的推播: {e}")
+        print(f"📮 LINE 推播 dispatcher 啟動（{settings.LINE_DISPATCH_CONCURRENCY} 個 sender）")
+        await asyncio.gather(
+            self._heartbeat(stop),
+            self._promoter(stop),
+            *(self._sender(stop) for _ in range(settings.LINE_DISPATCH_CONCURRENCY)),
+        )
+
+    def stats(self) -> dict:
+        """佇列長度（監控用）"""
+        client = get_redis()
+        return {
+            "ready": client.llen(OUTBOX_KEY),
+            "delayed": client.zcard(DELAYED_KEY),
+            "dead": client.llen(DEAD_KEY),
+        }
+
+
+# 單例模式
+line_dispatcher = LineDispatcher()
+
+
+if __name__ == "__main__":
+    asyncio.run(line_dispatcher.run())
@@ -4,17 +4,34 @@ LINE 訊息處理與回覆服務
 """
 import hashlib
 import base64
-from typing import Optional, List
+import json
+import httpx
+from typing import AsyncIterator, Optional, List
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError, LineBotApiError
 from linebot.models import (
     MessageEvent, TextMessage, ImageMessage,
     TextSendMessage, ImageSendMessage,
     QuickReply, QuickReplyButton, MessageAction,
-    FlexSendMessage, BubbleContainer, ImageComponent, BoxComponent,
+    FlexSendMessage, BubbleContainer, CarouselContainer, ImageComponent, BoxComponent,
     TextComponent, ButtonComponent, SeparatorComponent, URIAction
 )
 from app.config import settings
+from app.http_client import get_http_client
+
+LINE_API_URL = "https://api.line.me"
+# 用戶上傳內容（圖片 / 影片）走另一個網域
+LINE_DATA_API_URL = "https://api-data.line.me"
+CONTENT_CHUNK_SIZE = 64 * 1024
+CAROUSEL_MAX_BUBBLES = 12  # Flex carousel 上限
+
+
+class ContentTooLarge(Exception):
+    """用戶上傳的內容超過大小上限"""
+
+
+class ContentNotReady(Exception):
+    """LINE 還在處理內容（影片等），稍後再取"""
 
 
 class LineService:
@@ -60,7 +77,14 @@ class LineService:
     def reply_message(self, reply_token: str, messages: List):
         """
         回覆訊息
+        全部都是預先序列化的模板訊息（message_templates）時直接送出 JSON bytes
         """
+        from app.services.message_templates import PreparedMessage
+
+        if messages and all(isinstance(m, PreparedMessage) for m in messages):
+            from app.utils import run_async
+
+            return run_async(self.reply_prepared(reply_token, messages))
         try:
             self.api.reply_message(reply_token, messages)
             return True
@@ -68,6 +92,29 @@ class LineService:
             print(f"LINE 回覆失敗: {e}")
             return False
 
+    async def reply_prepared(self, reply_token: str, messages: List) -> bool:
+        """以預先序列化的訊息回覆（不經過 SDK 物件與 json 序列化）"""
+        body = b"".join((
+            b'{"replyToken":', json.dumps(reply_token).encode("utf-8"),
+            b',"messages":[', b",".join(m.data for m in messages), b"]}",
+        ))
+        try:
+            response = await get_http_client().post(
+                f"{LINE_API_URL}/v2/bot/message/reply",
+                content=body,
+                headers={
+                    "Authorization": f"Bearer {settings.LINE_CHANNEL_ACCESS_TOKEN}",
+                    "Content-Type": "application/json",
+                },
+            )
+        except httpx.HTTPError as e:
+            print(f"LINE 回覆失敗: {e}")
+            return False
+        if response.status_code >= 300:
+            print(f"LINE 回覆失敗: {response.status_code} {response.text[:200]}")
+            return False
+        return True
+
     def push_message(self, to: str, messages: List):
         """
         主動推播訊息
@@ -95,6 +142,42 @@ class LineService:
             print(f"取得用戶資料失敗: {e}")
             return None
 
+    async def iter_message_content(
+        self,
+        message_id: str,
+        max_bytes: Optional[int] = None,
+        chunk_size: int = CONTENT_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        """
+        串流讀取用戶上傳的內容，每次產出一個 chunk，不會把整個檔案放進記憶體
+        Content-Length 或已讀取的量超過 max_bytes 時立即中斷下載
+
+        Raises:
+            ContentTooLarge: 超過大小上限
+            ContentNotReady: LINE 回應 202（內容尚未準備好）
+            httpx.HTTPError: 網路或 HTTP 錯誤
+        """
+        max_bytes = max_bytes or settings.IMAGE_MAX_INPUT_BYTES
+        async with get_http_client().stream(
+            "GET",
+            f"{LINE_DATA_API_URL}/v2/bot/message/{message_id}/content",
+            headers={"Authorization": f"Bearer {settings.LINE_CHANNEL_ACCESS_TOKEN}"},
+        ) as response:
+            if response.status_code == 202:
+                raise ContentNotReady(message_id)
+            response.raise_for_status()
+
+            declared = response.headers.get("Content-Length")
+            if declared and declared.isdigit() and int(declared) > max_bytes:
+                raise ContentTooLarge(f"檔案過大 ({int(declared) // 1024} KB)")
+
+            received = 0
+            async for chunk in response.aiter_bytes(chunk_size):
+                received += len(chunk)
+                if received > max_bytes:
+                    raise ContentTooLarge(f"檔案超過 {max_bytes // 1024} KB")
+                yield chunk
+
     # ============= 訊息模板 =============
     @staticmethod
     def text_message(text: str) -> TextSendMessage:
@@ -109,6 +192,35 @@ class LineService:
             preview_image_url=preview_url or original_url
         )
 
+    @staticmethod
+    def create_result_carousel(urls: List[str]) -> List[FlexSendMessage]:
+        """
+        多張成品合併成 Flex carousel（每 12 張一則），點圖片開啟原圖
+
+        Args:
+            urls: 成品圖 URL
+        """
+        bubbles = [
+            BubbleContainer(
+                size="kilo",
+                hero=ImageComponent(
+                    url=url,
+                    size="full",
+                    aspect_ratio="1:1",
+                    aspect_mode="cover",
+                    action=URIAction(uri=url)
+                )
+            )
+            for url in urls
+        ]
+        return [
+            FlexSendMessage(
+                alt_text=f"您的 {len(urls)} 張長輩圖",
+                contents=CarouselContainer(contents=bubbles[i:i + CAROUSEL_MAX_BUBBLES])
+            )
+            for i in range(0, len(bubbles), CAROUSEL_MAX_BUBBLES)
+        ]
+
     @staticmethod
     def create_menu_flex() -> FlexSendMessage:
         """
@@ -0,0 +1,141 @@
+"""
+Message Templates
+LINE 訊息模板：啟動時把所有固定訊息（Flex / 文字）建好並序列化成 JSON 一次
+帶參數的模板只在預留的欄位填值，不再重建 SDK 物件樹、也不再重新序列化
+"""
+import json
+import re
+from app.config import settings
+
+# 欄位標記：json.dumps 會把 \x00 轉成 \u0000，序列化後可以安全地切開
+_SLOT_PATTERN = re.compile(r"\\u0000(\w+)\\u0000")
+
+
+def slot(name: str) -> str:
+    """在模板字串中預留欄位（只能放在 JSON 字串值裡）"""
+    return f"\x00{name}\x00"
+
+
+class PreparedMessage:
+    """已序列化的單則訊息（JSON 物件）"""
+
+    __slots__ = ("json", "data")
+
+    def __init__(self, json_text: str):
+        self.json = json_text
+        self.data = json_text.encode("utf-8")
+
+    def as_json_dict(self) -> dict:
+        """相容 SDK 訊息物件的介面"""
+        return json.loads(self.json)
+
+
+def _dumps(message) -> str:
+    payload = message.as_json_dict() if hasattr(message, "as_json_dict") else message
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+class MessageTemplate:
+    """可填入欄位的訊息模板"""
+
+    def __init__(self, message):
+        raw = _dumps(message)
+        self._parts = _SLOT_PATTERN.split(raw)  # 文字、欄位名稱交錯
+        self.slots = tuple(self._parts[1::2])
+        self._static = None if self.slots else PreparedMessage(raw)
+
+    def render(self, **values) -> PreparedMessage:
+        """填入欄位；沒有欄位的模板直接回傳快取的訊息"""
+        if self._static is not None:
+            return self._static
+        parts = self._parts[:]
+        for index in range(1, len(parts), 2):
+            # 只跳脫值本身（去掉 json.dumps 加上的前後引號）
+            parts[index] = json.dumps(str(values[parts[index]]), ensure_ascii=False)[1:-1]
+        return PreparedMessage("".join(parts))
+
+
+def _text(text: str) -> dict:
+    return {"type": "text", "text": text}
+
+
+def build_message_templates() -> dict[str, MessageTemplate]:
+    """建立所有訊息模板（啟動時執行一次）"""
+    from app.services.line_service import LineService
+    from app.services.template_service import TEMPLATES
+
+    points_per_image = settings.POINTS_PER_IMAGE
+    texts = {
+        # 指令
+        "help": (
+            "👋 歡迎來到長輩圖販賣機！\n\n"
+            "指令列表:\n"
+            "📸 /generate - 生成長輩圖\n"
+            "✏️ /caption 早安 - 照片加上問候語\n"
+            "⚡ /instant 中秋 - 快速模式（節慶模板）\n"
+            "💰 /points - 查詢點數\n"
+            "💳 /topup - 儲值點數\n"
+            "📚 /history - 我的作品\n"
+            "📋 /menu - 主選單"
+        ),
+        "points": f"💰 您的點數: {slot('points')}",
+        "topup": f"💳 點擊下方連結儲值\n{slot('url')}",
+        "history": f"📸 最近的作品:\n\n{slot('items')}",
+        "history_empty": "還沒有作品哦，快來生成一張吧！",
+        "ask_photo_generate": "請上傳一張照片，我會根據您的提示生成長輩圖",
+        "ask_photo_caption": f"請上傳一張照片，我會幫您加上「{slot('caption')}」",
+        "ask_photo_instant": f"⚡ 請上傳一張照片，馬上幫您做成「{slot('title')}」長輩圖",
+        "instant_templates": "⚡ 快速模式可用模板:\n" + "、".join(TEMPLATES) + "\n\n例如: /instant 中秋",
+        "welcome": (
+            f"👋 歡迎 {slot('name')}！\n\n"
+            f"送您 {settings.FREE_INITIAL_POINTS} 點免費點數\n"
+            f"現在就可以生成長輩圖了！"
+        ),
+        # 圖片任務
+        "insufficient_points": (
+            f"❌ 點數不足！\n"
+            f"需要 {points_per_image} 點，您目前有 {slot('points')} 點\n"
+            f"請使用 /topup 儲值"
+        ),
+        "job_accepted": (
+            f"✅ 收到照片！\n"
+            f"消耗 {points_per_image} 點，剩餘 {slot('points')} 點\n"
+            f"預計 30 秒內完成，請稍候..."
+        ),
+        "job_completed": "✅ 您的長輩圖生成完成！",
+        "job_failed": f"❌ 圖片生成失敗，點數已退還。\n錯誤: {slot('error')}",
+        # 一次上傳多張（imageSet）
+        "insufficient_points_set": (
+            f"❌ 點數不足！\n"
+            f"{slot('count')} 張照片需要 {slot('cost')} 點，您目前有 {slot('points')} 點\n"
+            f"請使用 /topup 儲值"
+        ),
+        "job_set_accepted": (
+            f"✅ 收到 {slot('count')} 張照片！\n"
+            f"消耗 {slot('cost')} 點，剩餘 {slot('points')} 點\n"
+            f"全部完成後會一起傳給您，請稍候..."
+        ),
+        "job_set_completed": f"✅ {slot('count')} 張長輩圖生成完成！",
+        # Postback
+        "postback_generate": "請上傳一張照片，我會生成長輩圖",
+        "postback_points": "查詢點數中...",
+        # 儲值
+        "topup_success": f"💰 儲值成功！獲得 {slot('points')} 點",
+    }
+
+    templates = {name: MessageTemplate(_text(text)) for name, text in texts.items()}
+    templates["menu"] = MessageTemplate(LineService.create_menu_flex())
+    templates["result_image"] = MessageTemplate({
+        "type": "image",
+        "originalContentUrl": slot("original_url"),
+        "previewImageUrl": slot("preview_url"),
+    })
+    return templates
+
+
+MESSAGE_TEMPLATES = build_message_templates()
+
+
+def render(template: str, /, **values) -> PreparedMessage:
+    """取得訊息（固定訊息直接回傳快取，帶參數的只填欄位）"""
+    return MESSAGE_TEMPLATES[template].render(**values)
@@ -6,10 +6,12 @@ import hashlib
 import urllib.parse
 import binascii
 import time
-from datetime import datetime
+import httpx
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad, unpad
 from app.config import settings
+from app.http_client import get_http_client
+from app.ids import new_order_no
 
 
 class NewebPayService:
@@ -124,15 +126,60 @@ class NewebPayService:
         calculated_sha = self.create_checksum(trade_info)
         return calculated_sha == received_sha
 
+    def create_query_check_value(self, order_no: str, amount: int) -> str:
+        """
+        QueryTradeInfo 的 CheckValue
+        格式: IV=HashIV&Amt=...&MerchantID=...&MerchantOrderNo=...&Key=HashKey → SHA256 → 轉大寫
+        """
+        query = urllib.parse.urlencode({
+            "Amt": amount,
+            "MerchantID": self.merchant_id,
+            "MerchantOrderNo": order_no,
+        })
+        raw = f"IV={settings.NEWEBPAY_HASH_IV or ''}&{query}&Key={settings.NEWEBPAY_HASH_KEY or ''}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest().upper()
+
+    async def query_trade(self, order_no: str, amount: int) -> dict:
+        """
+        查詢單筆交易（QueryTradeInfo）
+
+        Returns:
+            {"success": True, "found": True, "result": {...TradeStatus, TradeNo, PaymentType...}}
+            藍新回報查無交易時 found 為 False；網路或 HTTP 錯誤時 success 為 False
+        """
+        if not self._is_configured():
+            return {"success": False, "error": "藍新金流未設定"}
+
+        try:
+            response = await get_http_client().post(
+                f"{settings.NEWEBPAY_API_URL}/API/QueryTradeInfo",
+                data={
+                    "MerchantID": self.merchant_id,
+                    "Version": "1.3",
+                    "RespondType": "JSON",
+                    "CheckValue": self.create_query_check_value(order_no, amount),
+                    "TimeStamp": int(time.time()),
+                    "MerchantOrderNo": order_no,
+                    "Amt": amount,
+                },
+            )
+            response.raise_for_status()
+            payload = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            return {"success": False, "error": str(e)}
+
+        if payload.get("Status") != "SUCCESS":
+            return {"success": True, "found": False, "error": f"{payload.get('Status')} {payload.get('Message')}"}
+        return {"success": True, "found": True, "result": payload.get("Result") or {}}
+
     def generate_order_no(self, user_id: int) -> str:
         """
         生成訂單號
-        格式: EG + 年月日時 + 用戶ID後4碼 + 4位隨機數
-        例: EG2501180112345678
-        """
-        now = datetime.now()
-        date_str = now.strftime("%y%m%d%H")
-        user_suffix = str(user_id)[-4:].zfill(4)
-        import random
-        random_suffix = random.randint(1000, 9999)
-        return f"EG{date_str}{user_suffix}{random_suffix}"
+        格式: EG + Snowflake ID（時間有序、不會重複，不需要撞號重試）
+        例: EG1507012345678901234
+        """
+        return new_order_no()
+
+
+# 單例模式
+payment_service = NewebPayService()
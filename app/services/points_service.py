@@ -0,0 +1,144 @@
+"""
+Points Service
+點數扣款 / 退款 / 加值：每次異動都是單一 SQL（data-modifying CTE），同時寫入點數帳本
+扣款以條件式 UPDATE 完成，並行上傳也不會扣成負數；退款與加值靠帳本唯一鍵保證只做一次
+所有方法都不 commit，由呼叫端決定交易範圍（commit 後自動讓用戶快取失效）
+"""
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.services.user_cache import user_cache
+
+# 扣點 + 帳本 + 建立任務，一次來回（一組照片一起扣，點數不足時整組都不建立）
+RESERVE_JOBS_SQL = text("""
+    WITH charged AS (
+        UPDATE elder_users
+        SET points = points - :total, updated_at = NOW()
+        WHERE id = :user_id AND points >= :total
+        RETURNING id, points
+    ), ids AS (
+        SELECT job_id FROM unnest(CAST(:job_ids AS varchar[])) AS job_id
+    ), entry AS (
+        INSERT INTO elder_points_ledger (user_id, delta, reason, ref)
+        SELECT charged.id, 0 - :cost, 'reserve', ids.job_id FROM charged, ids
+    ), job AS (
+        INSERT INTO elder_image_jobs (job_id, user_id, mode, prompt_used, status, cost_points, created_at)
+        SELECT ids.job_id, charged.id, :mode, :prompt_used, 'QUEUED', :cost, NOW() FROM charged, ids
+    )
+    SELECT (SELECT points FROM charged) AS remaining, points AS balance, line_user_id
+    FROM elder_users
+    WHERE id = :user_id
+""")
+
+# 先寫帳本（唯一鍵擋掉重複），有寫入才加點
+CREDIT_SQL = text("""
+    WITH entry AS (
+        INSERT INTO elder_points_ledger (user_id, delta, reason, ref)
+        VALUES (:user_id, :amount, :reason, :ref)
+        ON CONFLICT (reason, ref) DO NOTHING
+        RETURNING user_id, delta
+    )
+    UPDATE elder_users AS u
+    SET points = u.points + e.delta, updated_at = NOW()
+    FROM entry AS e
+    WHERE u.id = e.user_id
+    RETURNING u.points, u.line_user_id
+""")
+
+# 退還該任務實際扣掉的點數（沒有扣款紀錄的任務不退）
+REFUND_SQL = text("""
+    WITH entry AS (
+        INSERT INTO elder_points_ledger (user_id, delta, reason, ref)
+        SELECT user_id, 0 - delta, 'refund', ref
+        FROM elder_points_ledger
+        WHERE reason = 'reserve' AND ref = :job_id
+        ON CONFLICT (reason, ref) DO NOTHING
+        RETURNING user_id, delta
+    )
+    UPDATE elder_users AS u
+    SET points = u.points + e.delta, updated_at = NOW()
+    FROM entry AS e
+    WHERE u.id = e.user_id
+    RETURNING u.points, u.line_user_id
+""")
+
+
+class PointsService:
+    """點數服務"""
+
+    def reserve_job(
+        self,
+        db: Session,
+        user_id: int,
+        job_id: str,
+        cost: int,
+        mode: str,
+        prompt_used: Optional[str] = None
+    ) -> dict:
+        """
+        扣點並建立 QUEUED 任務（同一個 SQL，點數不足時兩者都不會發生）
+
+        Returns:
+            {"success": True, "points": 剩餘點數} 或 {"success": False, "points": 目前點數}
+        """
+        return self.reserve_jobs(db, user_id, [job_id], cost, mode, prompt_used)
+
+    def reserve_jobs(
+        self,
+        db: Session,
+        user_id: int,
+        job_ids: list[str],
+        cost: int,
+        mode: str,
+        prompt_used: Optional[str] = None
+    ) -> dict:
+        """
+        一次扣 len(job_ids) × cost 點並建立多個 QUEUED 任務（每個任務各一筆帳本，可以個別退款）
+
+        Returns:
+            同 reserve_job
+        """
+        row = db.execute(RESERVE_JOBS_SQL, {
+            "user_id": user_id,
+            "job_ids": list(job_ids),
+            "cost": cost,
+            "total": cost * len(job_ids),
+            "mode": mode,
+            "prompt_used": prompt_used,
+        }).one()
+        if row.remaining is None:
+            return {"success": False, "points": row.balance}
+        user_cache.invalidate_on_commit(db, row.line_user_id)
+        return {"success": True, "points": row.remaining}
+
+    def credit(self, db: Session, user_id: int, amount: int, reason: str, ref: str) -> Optional[dict]:
+        """
+        加點（儲值等），同一個 reason + ref 只會加一次
+
+        Returns:
+            {"points": 加點後點數, "line_user_id": ...}，已經加過時回傳 None
+        """
+        row = db.execute(CREDIT_SQL, {
+            "user_id": user_id, "amount": amount, "reason": reason, "ref": ref
+        }).first()
+        if row is None:
+            return None
+        user_cache.invalidate_on_commit(db, row.line_user_id)
+        return dict(row._mapping)
+
+    def refund(self, db: Session, job_id: str) -> Optional[dict]:
+        """
+        退還任務扣的點數，重複呼叫只會退一次
+
+        Returns:
+            {"points": 退款後點數, "line_user_id": ...}，已退過或沒有扣款時回傳 None
+        """
+        row = db.execute(REFUND_SQL, {"job_id": job_id}).first()
+        if row is None:
+            return None
+        user_cache.invalidate_on_commit(db, row.line_user_id)
+        return dict(row._mapping)
+
+
+# 單例模式
+points_service = PointsService()
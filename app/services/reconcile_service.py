@@ -0,0 +1,192 @@
+"""
+Payment Reconciliation
+定期以藍新 QueryTradeInfo 核對訂單：補上漏接 Notify 的付款、找出狀態不一致的訂單、讓逾期未付款的訂單過期
+以 keyset cursor 分頁讀取 PENDING 與近期訂單，每頁同時查詢（限制並行數），一頁的補單在同一個 SQL 完成
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_, select, text, update
+from app.config import settings
+from app.redis_client import get_redis
+from app.services.payment_service import payment_service
+from app.services.user_cache import user_cache
+from app.utils import run_async
+
+LOCK_KEY = "elder:reconcile:lock"
+
+# 藍新 TradeStatus：0 未付款、1 付款成功、2 付款失敗、3 取消、6 退款
+TRADE_PAID = "1"
+
+# 補單：訂單轉 PAID → 寫帳本（唯一鍵擋重複）→ 依用戶加總加點，一頁一個 SQL
+CREDIT_PAID_SQL = text("""
+    WITH paid AS (
+        UPDATE elder_orders AS o
+        SET status = 'PAID',
+            neweb_trade_no = v.trade_no,
+            neweb_payment_type = v.payment_type,
+            pay_time = NOW(),
+            updated_at = NOW()
+        FROM unnest(
+            CAST(:order_nos AS varchar[]),
+            CAST(:trade_nos AS varchar[]),
+            CAST(:payment_types AS varchar[])
+        ) AS v(order_no, trade_no, payment_type)
+        WHERE o.order_no = v.order_no AND o.status IN ('PENDING', 'EXPIRED')
+        RETURNING o.user_id, o.points_added, o.order_no
+    ), entry AS (
+        INSERT INTO elder_points_ledger (user_id, delta, reason, ref)
+        SELECT user_id, points_added, 'topup', order_no FROM paid
+        ON CONFLICT (reason, ref) DO NOTHING
+        RETURNING user_id, delta
+    )
+    UPDATE elder_users AS u
+    SET points = u.points + e.total, updated_at = NOW()
+    FROM (SELECT user_id, SUM(delta) AS total, COUNT(*) AS orders FROM entry GROUP BY user_id) AS e
+    WHERE u.id = e.user_id
+    RETURNING u.line_user_id, e.total, e.orders
+""")
+
+
+class PaymentReconciler:
+    """藍新金流對帳"""
+
+    def __init__(self):
+        self.page_size = settings.RECONCILE_PAGE_SIZE
+        self.concurrency = settings.RECONCILE_CONCURRENCY
+
+    def _page(self, db, after_id: int, since: datetime) -> list:
+        """下一頁需要核對的訂單（依 id 遞增）"""
+        from app.models import ElderOrder
+
+        return db.execute(
+            select(ElderOrder.id, ElderOrder.order_no, ElderOrder.amount, ElderOrder.status)
+            .where(
+                ElderOrder.id > after_id,
+                or_(ElderOrder.status == "PENDING", ElderOrder.created_at >= since)
+            )
+            .order_by(ElderOrder.id)
+            .limit(self.page_size)
+        ).all()
+
+    async def _query_page(self, orders: list) -> list[dict]:
+        """同時查詢一頁訂單（最多 concurrency 個請求）"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _query(order):
+            async with semaphore:
+                return await payment_service.query_trade(order.order_no, order.amount)
+
+        return await asyncio.gather(*(_query(order) for order in orders))
+
+    def _credit_paid(self, db, payments: list[dict]) -> list:
+        """補上一頁中已付款但未入帳的訂單（不 commit）"""
+        if not payments:
+            return []
+        rows = db.execute(CREDIT_PAID_SQL, {
+            "order_nos": [p["order_no"] for p in payments],
+            "trade_nos": [p.get("TradeNo") for p in payments],
+            "payment_types": [p.get("PaymentType") for p in payments],
+        }).all()
+        for row in rows:
+            user_cache.invalidate_on_commit(db, row.line_user_id)
+        return rows
+
+    def _expire(self, db, exclude: list[str]) -> int:
+        """把超過付款期限仍 PENDING 的訂單標為 EXPIRED（單一 UPDATE；本次查詢失敗的訂單不動）"""
+        from app.models import ElderOrder
+
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=settings.ORDER_EXPIRE_HOURS)
+        stmt = update(ElderOrder).where(
+            ElderOrder.status == "PENDING",
+            ElderOrder.created_at < cutoff
+        )
+        if exclude:
+            stmt = stmt.where(ElderOrder.order_no.notin_(exclude))
+        return db.execute(stmt.values(status="EXPIRED")).rowcount
+
+    def _notify(self, credited: list):
+        from app.services import message_templates
+        from app.services.line_dispatcher import line_dispatcher
+
+        for row in credited:
+            line_dispatcher.enqueue_push(
+                row.line_user_id,
+                [message_templates.render("topup_success", points=row.total)]
+            )
+
+    def run(self) -> dict:
+        """
+        執行一次對帳（同時間只會有一個在跑）
+
+        Returns:
+            {"success": True, "checked": 120, "credited": 2, "mismatched": 0, "failed": 1, "expired": 30}
+        """
+        from app.database import SessionLocal
+
+        if SessionLocal is None:
+            return {"success": False, "error": "資料庫未設定"}
+
+        lock = get_redis().lock(LOCK_KEY, timeout=settings.RECONCILE_INTERVAL_SECONDS, thread_local=False)
+        if not lock.acquire(blocking=False):
+            return {"success": False, "error": "已有對帳在執行"}
+
+        stats = {"checked": 0, "found": 0, "credited": 0, "mismatched": 0, "failed": 0, "expired": 0}
+        failed: list[str] = []
+        since = datetime.now(timezone.utc) - timedelta(hours=settings.RECONCILE_LOOKBACK_HOURS)
+        db = SessionLocal()
+        try:
+            after_id = 0
+            while True:
+                orders = self._page(db, after_id, since)
+                db.rollback()  # 查詢 API 期間不佔住交易
+                if not orders:
+                    break
+                after_id = orders[-1].id
+
+                paid = []
+                for order, result in zip(orders, run_async(self._query_page(orders))):
+                    stats["checked"] += 1
+                    if not result["success"]:
+                        failed.append(order.order_no)
+                        continue
+                    if not result["found"]:
+                        continue
+                    stats["found"] += 1
+                    trade_status = str(result["result"].get("TradeStatus", ""))
+                    if trade_status == TRADE_PAID and order.status in ("PENDING", "EXPIRED"):
+                        paid.append({**result["result"], "order_no": order.order_no})
+                    elif (trade_status == TRADE_PAID) != (order.status == "PAID"):
+                        # 兩邊狀態對不上（退款、我們標為失敗等），只記錄不自動調整點數
+                        stats["mismatched"] += 1
+                        print(f"⚠️  對帳不一致：訂單 {order.order_no} 藍新狀態 {trade_status}")
+
+                credited = self._credit_paid(db, paid)
+                db.commit()
+                stats["credited"] += sum(row.orders for row in credited)
+                self._notify(credited)
+                lock.extend(settings.RECONCILE_INTERVAL_SECONDS, replace_ttl=True)
+
+            stats["failed"] = len(failed)
+            if stats["checked"] > stats["failed"] and not stats["found"]:
+                # 一筆都查不到多半是設定錯誤（CheckValue / 商店代號），先不要讓訂單過期
+                print("⚠️  對帳時藍新查無任何訂單，略過過期處理")
+            else:
+                stats["expired"] = self._expire(db, failed)
+                db.commit()
+
+            print(
+                f"💳 對帳完成：核對 {stats['checked']} 筆，補單 {stats['credited']} 筆，"
+                f"不一致 {stats['mismatched']} 筆，過期 {stats['expired']} 筆"
+            )
+            return {"success": True, **stats}
+        finally:
+            db.rollback()
+            db.close()
+            try:
+                lock.release()
+            except Exception:
+                pass
+
+
+# 單例模式
+payment_reconciler = PaymentReconciler()
@@ -0,0 +1,592 @@
+"""
+Storage Backends
+圖片儲存後端介面與實作：UDA LINK (R2)、本地檔案系統、記憶體
+StorageService 負責內容定址與引用計數，實際存取由 STORAGE_BACKEND 指定的後端處理
+"""
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import AsyncIterator, BinaryIO, Optional, Union
+import httpx
+import redis
+from app.config import settings
+from app.http_client import get_http_client
+from app.redis_client import get_redis
+
+# 跨行程共用的 Token（Redis）
+TOKEN_CACHE_KEY = "elder:storage:token"
+TOKEN_LOCK_KEY = "elder:storage:token:lock"
+TOKEN_REFRESH_MARGIN = 5 * 60  # 提前 5 分鐘刷新（秒）
+
+
+# ============= Backend Interface =============
+class StorageBackend:
+    """
+    儲存後端基底類別
+    子類別實作 put / get / delete / exists / public_url；串流上傳與批次刪除有預設實作
+    put 的回傳格式：
+        {"success": True, "path": "...", "full_url": "...", "remote_id": "..."}
+        或 {"success": False, "error": "...", "path": "..."}
+    """
+
+    name = "base"
+
+    def is_configured(self) -> bool:
+        """檢查是否已設定"""
+        return True
+
+    async def put(self, data: bytes, path: str, content_type: str) -> dict:
+        """上傳一個物件"""
+        raise NotImplementedError
+
+    async def put_stream(self, chunks: AsyncIterator[bytes], path: str, content_type: str) -> dict:
+        """串流上傳（預設先收集成 bytes 再 put，能邊收邊寫的後端應覆寫）"""
+        data = b"".join([chunk async for chunk in chunks])
+        return await self.put(data, path, content_type)
+
+    async def get(self, path: str) -> Optional[bytes]:
+        """讀取物件，不存在時回傳 None"""
+        raise NotImplementedError
+
+    async def delete(self, remote_id: str) -> bool:
+        """刪除物件"""
+        raise NotImplementedError
+
+    async def delete_many(self, remote_ids: list[str]) -> dict[str, bool]:
+        """
+        批次刪除（預設以有限並行度逐一呼叫 delete）
+
+        Returns:
+            {remote_id: 是否刪除成功}
+        """
+        semaphore = asyncio.Semaphore(settings.STORAGE_DELETE_CONCURRENCY)
+
+        async def _delete(remote_id: str) -> bool:
+            async with semaphore:
+                return await self.delete(remote_id)
+
+        results = await asyncio.gather(*(_delete(remote_id) for remote_id in remote_ids))
+        return dict(zip(remote_ids, results))
+
+    async def exists(self, path: str) -> bool:
+        """物件是否存在"""
+        raise NotImplementedError
+
+    def public_url(self, path: str) -> str:
+        """物件的公開 URL"""
+        raise NotImplementedError
+
+
+def media_url(path: str) -> str:
+    """本地 / 記憶體後端的公開 URL（由 API 的 /media 路由提供）"""
+    base = (settings.MEDIA_BASE_URL or "").rstrip("/")
+    return f"{base}/media/{path}"
+
+
+# ============= UDA LINK (R2) =============
+class UdaStorageBackend(StorageBackend):
+    """UDA LINK 圖片託管 (Supabase Edge Functions + R2，使用 VIP 用戶，支援自動刷新 Token)"""
+
+    name = "uda"
+
+    def __init__(self):
+        self.base_url = settings.SUPABASE_URL
+        self.email = settings.ELDER_GEN_EMAIL
+        self.password = settings.ELDER_GEN_PASSWORD
+
+        # Token 狀態（行程內快取，來源為 Redis）
+        self._access_token: Optional[str] = None
+        self._refresh_token: Optional[str] = None
+        self._token_expires_at: Optional[float] = None  # epoch 秒
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop = None
+
+    def is_configured(self) -> bool:
+        return bool(self.base_url and self.email and self.password)
+
+    def _get_lock(self) -> asyncio.Lock:
+        """
+        取得目前 event loop 的 Token 鎖
+        不同執行緒各自有 event loop，鎖不能跨 loop 共用
+        """
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    def _token_is_fresh(self) -> bool:
+        return bool(
+            self._access_token and self._token_expires_at
+            and time.time() + TOKEN_REFRESH_MARGIN < self._token_expires_at
+        )
+
+    def _set_token(self, data: dict):
+        """從 Supabase Auth 回應更新 Token 狀態"""
+        self._access_token = data.get("access_token")
+        self._refresh_token = data.get("refresh_token", self._refresh_token)
+        self._token_expires_at = time.time() + data.get("expires_in", 3600)
+
+    async def _get_valid_token(self) -> str:
+        """取得有效的 access_token，必要時自動刷新"""
+        async with self._get_lock():
+            if not self._token_is_fresh():
+                await self._refresh_shared_token()
+            return self._access_token
+
+    async def _invalidate_token(self, stale_token: Optional[str]):
+        """
+        收到 401 時呼叫：若其他行程已換過 Token 就直接沿用，否則刷新
+        """
+        async with self._get_lock():
+            if self._access_token != stale_token and self._token_is_fresh():
+                return
+            await self._refresh_shared_token(stale_token)
+
+    # ============= Redis Token 快取 =============
+    def _read_cached_token(self) -> Optional[dict]:
+        raw = get_redis().get(TOKEN_CACHE_KEY)
+        return json.loads(raw) if raw else None
+
+    def _write_cached_token(self):
+        ttl = int(self._token_expires_at - time.time())
+        if ttl <= 0:
+            return
+        get_redis().set(
+            TOKEN_CACHE_KEY,
+            json.dumps({
+                "access_token": self._access_token,
+                "refresh_token": self._refresh_token,
+                "expires_at": self._token_expires_at,
+            }),
+            ex=ttl
+        )
+
+    def _adopt_cached_token(self, cached: Optional[dict], stale_token: Optional[str]) -> bool:
+        """採用 Redis 中其他行程刷新好的 Token"""
+        if not cached or cached.get("access_token") == stale_token:
+            return False
+        if time.time() + TOKEN_REFRESH_MARGIN >= cached.get("expires_at", 0):
+            return False
+        self._access_token = cached["access_token"]
+        self._refresh_token = cached.get("refresh_token")
+        self._token_expires_at = cached["expires_at"]
+        return True
+
+    async def _refresh_shared_token(self, stale_token: Optional[str] = None) -> bool:
+        """
+        跨行程刷新 Token
+        1. 先看 Redis 是否已有有效 Token
+        2. 沒有的話取得分散式鎖，只讓一個行程呼叫 Supabase Auth
+        3. 拿到鎖後再檢查一次（等鎖期間可能已被別人刷新），再刷新並寫回 Redis
+        Redis 無法使用時退回行程內刷新
+        """
+        try:
+            cached = await asyncio.to_thread(self._read_cached_token)
+            if self._adopt_cached_token(cached, stale_token):
+                return True
+
+            # thread_local=False：acquire / release 可能在不同執行緒（asyncio.to_thread）
+            lock = get_redis().lock(
+                TOKEN_LOCK_KEY, timeout=30, blocking_timeout=15, thread_local=False
+            )
+            acquired = await asyncio.to_thread(lock.acquire)
+            try:
+                cached = await asyncio.to_thread(self._read_cached_token)
+                if self._adopt_cached_token(cached, stale_token):
+                    return True
+
+                # 沿用 Redis 中最新的 refresh_token（Supabase 的 refresh_token 只能用一次）
+                if cached and cached.get("refresh_token"):
+                    self._refresh_token = cached["refresh_token"]
+
+                refreshed = await self._refresh_access_token()
+                if refreshed:
+                    await asyncio.to_thread(self._write_cached_token)
+                return refreshed
+            finally:
+                if acquired:
+                    try:
+                        await asyncio.to_thread(lock.release)
+                    except redis.exceptions.LockError:
+                        pass
+
+        except redis.RedisError as e:
+            print(f"⚠️  Redis Token 快取無法使用，改為行程內刷新: {e}")
+            return await self._refresh_access_token()
+
+    async def _refresh_access_token(self) -> bool:
+        """刷新 access_token"""
+        try:
+            client = get_http_client()
+            # 嘗試用 refresh_token 刷新
+            if self._refresh_token:
+                response = await client.post(
+                    f"{self.base_url}/auth/v1/token?grant_type=refresh_token",
+                    json={
+                        "refresh_token": self._refresh_token
+                    }
+                )
+
+                if response.status_code == 200:
+                    self._set_token(response.json())
+                    print("✅ Token 刷新成功")
+                    return True
+
+            # refresh_token 失敗或不存在，重新登入
+            if self.email and self.password:
+                return await self._relogin()
+
+            print("❌ 無法刷新 Token：缺少 email/password")
+            return False
+
+        except Exception as e:
+            print(f"❌ Token 刷新失敗: {e}")
+            # 嘗試重新登入
+            if self.email and self.password:
+                return await self._relogin()
+            return False
+
+    async def _relogin(self) -> bool:
+        """重新登入獲取新的 token"""
+        try:
+            response = await get_http_client().post(
+                f"{self.base_url}/auth/v1/token?grant_type=password",
+                json={
+                    "email": self.email,
+                    "password": self.password,
+                }
+            )
+
+            if response.status_code == 200:
+                self._set_token(response.json())
+                print("✅ 重新登入成功")
+                return True
+            else:
+                print(f"❌ 重新登入失敗: {response.status_code} - {response.text}")
+                return False
+
+        except Exception as e:
+            print(f"❌ 重新登入錯誤: {e}")
+            return False
+
+    # ============= 物件操作 =============
+    async def put(self, data: Union[bytes, BinaryIO], path: str, content_type: str) -> dict:
+        """
+        透過 /upload-image 端點上傳（失敗時自動刷新 token 重試一次）
+        data 也可以是檔案物件，multipart 會分段讀取
+        """
+        filename = path.rsplit("/", 1)[-1]
+        # 嘗試上傳，失敗時自動刷新 token 重試
+        token = None
+        for attempt in range(2):  # 最多重試 1 次
+            try:
+                token = await self._get_valid_token()
+                if hasattr(data, "seek"):
+                    data.seek(0)
+
+                # 準備 multipart form data
+                files = {
+                    "file": (filename, data, content_type)
+                }
+
+                headers = {
+                    "Authorization": f"Bearer {token}"
+                }
+
+                response = await get_http_client().post(
+                    f"{self.base_url}/functions/v1/upload-image",
+                    files=files,
+                    headers=headers,
+                    timeout=60.0
+                )
+
+                # 401 表示 token 過期，刷新後重試
+                if response.status_code == 401 and attempt == 0:
+                    await self._invalidate_token(token)
+                    continue
+
+                response.raise_for_status()
+                result = response.json()
+
+                if result.get("success"):
+                    return {
+                        "success": True,
+                        "path": path,
+                        "full_url": result["data"]["url"],
+                        "filename": result["data"].get("fileName", filename),
+                        "r2_path": result["data"].get("fileName", path),
+                        "remote_id": result["data"].get("id") or result["data"].get("fileName")
+                    }
+                else:
+                    return {
+                        "success": False,
+                        "error": result.get("error", "上傳失敗"),
+                        "path": path
+                    }
+
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code == 401 and attempt == 0:
+                    await self._invalidate_token(token)
+                    continue
+                return {
+                    "success": False,
+                    "error": f"HTTP 錯誤: {e.response.status_code}",
+                    "path": path
+                }
+            except Exception as e:
+                return {
+                    "success": False,
+                    "error": str(e),
+                    "path": path
+                }
+
+        return {
+            "success": False,
+            "error": "上傳失敗：無法獲取有效 token",
+            "path": path
+        }
+
+    async def put_stream(self, chunks: AsyncIterator[bytes], path: str, content_type: str) -> dict:
+        """
+        串流上傳：先寫入暫存檔（記憶體中最多 IMAGE_SPOOL_BYTES），再以檔案物件上傳
+        /upload-image 需要 multipart，401 重試時也要能從頭再送一次
+        """
+        with tempfile.SpooledTemporaryFile(max_size=settings.IMAGE_SPOOL_BYTES) as spool:
+            try:
+                async for chunk in chunks:
+                    await asyncio.to_thread(spool.write, chunk)
+            except Exception as e:
+                return {"success": False, "error": str(e), "path": path}
+            return await self.put(spool, path, content_type)
+
+    async def get(self, path: str) -> Optional[bytes]:
+        """從公開 URL 下載（path 也可以直接是完整 URL）"""
+        url = path if path.startswith("http") else self.public_url(path)
+        response = await get_http_client().get(url)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.content
+
+    async def delete(self, remote_id: str) -> bool:
+        """透過 /delete-image 端點刪除（remote_id 為上傳回應的圖片 ID）"""
+        if not self.is_configured():
+            print("⚠️  UDA LINK 服務未設定，跳過刪除")
+            return False
+
+        # 嘗試刪除，失敗時自動刷新 token 重試
+        token = None
+        for attempt in range(2):
+            try:
+                token = await self._get_valid_token()
+
+                headers = {
+                    "Authorization": f"Bearer {token}",
+                    "Content-Type": "application/json"
+                }
+
+                payload = {"imageId": remote_id}
+
+                response = await get_http_client().post(
+                    f"{self.base_url}/functions/v1/delete-image",
+                    headers=headers,
+                    json=payload
+                )
+
+                # 401 表示 token 過期，刷新後重試
+                if response.status_code == 401 and attempt == 0:
+                    await self._invalidate_token(token)
+                    continue
+
+                response.raise_for_status()
+                result = response.json()
+
+                return result.get("success", False)
+
+            except Exception as e:
+                if attempt == 0:
+                    await self._invalidate_token(token)
+                    continue
+                print(f"刪除圖片失敗: {e}")
+                return False
+
+        return False
+
+    async def exists(self, path: str) -> bool:
+        url = path if path.startswith("http") else self.public_url(path)
+        try:
+            response = await get_http_client().head(url)
+        except httpx.HTTPError:
+            return False
+        return response.status_code == 200
+
+    def public_url(self, path: str) -> str:
+        """
+        R2 的公開 URL 應該由上傳回應返回，這裡只作備用
+        """
+        if settings.R2_PUBLIC_URL:
+            return f"{settings.R2_PUBLIC_URL}/{path}"
+        return path
+
+
+# ============= 本地檔案系統 =============
+class LocalStorageBackend(StorageBackend):
+    """
+    本地檔案系統（開發、壓測用）
+    檔案由 API 的 /media 路由提供（支援 Range），API 與 Worker 需共用同一個目錄
+    """
+
+    name = "local"
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = os.path.realpath(root or settings.STORAGE_LOCAL_ROOT)
+
+    def resolve(self, path: str) -> str:
+        """物件路徑 → 檔案路徑（拒絕跳出根目錄的路徑）"""
+        full_path = os.path.realpath(os.path.join(self.root, path))
+        if not full_path.startswith(self.root + os.sep):
+            raise ValueError(f"不合法的路徑: {path}")
+        return full_path
+
+    def _open_temp(self, full_path: str):
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        return tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(full_path), prefix=".upload-", delete=False
+        )
+
+    def _write(self, full_path: str, data: bytes):
+        """先寫暫存檔再改名，讀取端不會看到寫一半的檔案"""
+        with self._open_temp(full_path) as tmp:
+            tmp.write(data)
+        os.replace(tmp.name, full_path)
+
+    def _result(self, path: str) -> dict:
+        return {"success": True, "path": path, "full_url": self.public_url(path), "remote_id": path}
+
+    async def put(self, data: bytes, path: str, content_type: str) -> dict:
+        try:
+            await asyncio.to_thread(self._write, self.resolve(path), data)
+        except (OSError, ValueError) as e:
+            return {"success": False, "error": str(e), "path": path}
+        return self._result(path)
+
+    async def put_stream(self, chunks: AsyncIterator[bytes], path: str, content_type: str) -> dict:
+        """邊收邊寫，記憶體中只保留一個 chunk"""
+        try:
+            full_path = self.resolve(path)
+            tmp = await asyncio.to_thread(self._open_temp, full_path)
+        except (OSError, ValueError) as e:
+            return {"success": False, "error": str(e), "path": path}
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(tmp.write, chunk)
+            await asyncio.to_thread(tmp.close)
+            await asyncio.to_thread(os.replace, tmp.name, full_path)
+        except Exception as e:
+            return {"success": False, "error": str(e), "path": path}
+        finally:
+            # 中途失敗或被取消時清掉暫存檔（成功時已改名，不存在）
+            tmp.close()
+            if os.path.exists(tmp.name):
+                os.unlink(tmp.name)
+        return self._result(path)
+
+    def _read(self, full_path: str) -> Optional[bytes]:
+        try:
+            with open(full_path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    async def get(self, path: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._read, self.resolve(path))
+
+    def _unlink_many(self, remote_ids: list[str]) -> dict[str, bool]:
+        results = {}
+        for remote_id in remote_ids:
+            try:
+                os.unlink(self.resolve(remote_id))
+                results[remote_id] = True
+            except FileNotFoundError:
+                results[remote_id] = True  # 已經不存在，視為刪除成功
+            except (OSError, ValueError) as e:
+                print(f"刪除圖片失敗: {e}")
+                results[remote_id] = False
+        return results
+
+    async def delete(self, remote_id: str) -> bool:
+        return (await self.delete_many([remote_id]))[remote_id]
+
+    async def delete_many(self, remote_ids: list[str]) -> dict[str, bool]:
+        """同一個執行緒內逐一 unlink，不需要並行"""
+        return await asyncio.to_thread(self._unlink_many, remote_ids)
+
+    async def exists(self, path: str) -> bool:
+        return await asyncio.to_thread(os.path.isfile, self.resolve(path))
+
+    def public_url(self, path: str) -> str:
+        return media_url(path)
+
+
+# ============= 記憶體 =============
+class MemoryStorageBackend(StorageBackend):
+    """
+    記憶體儲存（測試、單行程壓測用，行程結束即消失）
+    API 與 Worker 在同一個行程時，/media 路由也能提供這些物件
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self.objects: dict[str, tuple[bytes, str]] = {}  # path → (data, content_type)
+
+    def _result(self, path: str) -> dict:
+        return {"success": True, "path": path, "full_url": self.public_url(path), "remote_id": path}
+
+    async def put(self, data: bytes, path: str, content_type: str) -> dict:
+        self.objects[path] = (bytes(data), content_type)
+        return self._result(path)
+
+    async def put_stream(self, chunks: AsyncIterator[bytes], path: str, content_type: str) -> dict:
+        """收完才寫入，讀取端不會看到寫一半的物件"""
+        buffer = bytearray()
+        async for chunk in chunks:
+            buffer += chunk
+        return await self.put(buffer, path, content_type)
+
+    async def get(self, path: str) -> Optional[bytes]:
+        stored = self.objects.get(path)
+        return stored[0] if stored else None
+
+    async def delete(self, remote_id: str) -> bool:
+        self.objects.pop(remote_id, None)
+        return True
+
+    async def delete_many(self, remote_ids: list[str]) -> dict[str, bool]:
+        for remote_id in remote_ids:
+            self.objects.pop(remote_id, None)
+        return {remote_id: True for remote_id in remote_ids}
+
+    async def exists(self, path: str) -> bool:
+        return path in self.objects
+
+    def public_url(self, path: str) -> str:
+        return media_url(path)
+
+
+BACKEND_CLASSES = {
+    "uda": UdaStorageBackend,
+    "local": LocalStorageBackend,
+    "memory": MemoryStorageBackend,
+}
+
+
+def create_backend(name: str) -> StorageBackend:
+    """依名稱建立儲存後端"""
+    backend_cls = BACKEND_CLASSES.get(name.strip().lower())
+    if backend_cls is None:
+        raise ValueError(f"未知的儲存後端: {name}（可用: {', '.join(BACKEND_CLASSES)}）")
+    return backend_cls()
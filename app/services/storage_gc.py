@@ -0,0 +1,253 @@
+"""
+Storage Garbage Collector
+依路徑前綴的保留天數清理過期圖片：
+以 server-side cursor 串流過期任務 → 每批一個交易清空路徑欄位並釋放引用 → 刪除引用歸零的遠端物件
+每批完成後寫入檢查點，長時間的清理中斷後可以接續
+"""
+import json
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import or_, select, text, tuple_
+from app.config import settings
+from app.redis_client import get_redis
+from app.services.storage_service import storage_service
+from app.utils import run_async
+
+CHECKPOINT_KEY = "elder:gc:checkpoint"
+LOCK_KEY = "elder:gc:lock"
+
+
+@dataclass(frozen=True)
+class RetentionRule:
+    """保留規則：超過 days 天、狀態符合的任務，清掉 columns 中的 (路徑欄位, URL 欄位)"""
+    name: str
+    columns: tuple
+    days: int
+    statuses: tuple
+
+
+def retention_rules() -> list[RetentionRule]:
+    """依設定產生保留規則（失敗任務的保留期通常最短，先處理）"""
+    return [
+        RetentionRule(
+            "failed",
+            (
+                ("original_image_path", "original_url"),
+                ("result_image_path", "result_url"),
+                ("preview_image_path", "preview_url"),
+            ),
+            settings.STORAGE_RETENTION_FAILED_DAYS,
+            ("FAILED",),
+        ),
+        RetentionRule(
+            "original",
+            (("original_image_path", "original_url"),),
+            settings.STORAGE_RETENTION_ORIGINAL_DAYS,
+            ("COMPLETED", "FAILED"),
+        ),
+        RetentionRule(
+            "result",
+            (("result_image_path", "result_url"),),
+            settings.STORAGE_RETENTION_RESULT_DAYS,
+            ("COMPLETED",),
+        ),
+        RetentionRule(
+            "preview",
+            (("preview_image_path", "preview_url"),),
+            settings.STORAGE_RETENTION_PREVIEW_DAYS,
+            ("COMPLETED",),
+        ),
+    ]
+
+
+class StorageGarbageCollector:
+    """儲存空間清理"""
+
+    def __init__(self):
+        self.batch_size = settings.STORAGE_GC_BATCH_SIZE
+        self.max_batches = settings.STORAGE_GC_MAX_BATCHES
+
+    # ============= 檢查點 =============
+    def _load_checkpoint(self, rule: RetentionRule) -> Optional[tuple]:
+        raw = get_redis().hget(CHECKPOINT_KEY, rule.name)
+        if not raw:
+            return None
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["created_at"]), data["job_id"]
+
+    def _save_checkpoint(self, rule: RetentionRule, created_at: datetime, job_id: str):
+        get_redis().hset(
+            CHECKPOINT_KEY,
+            rule.name,
+            json.dumps({"created_at": created_at.isoformat(), "job_id": job_id})
+        )
+
+    def _clear_checkpoint(self, rule: RetentionRule):
+        get_redis().hdel(CHECKPOINT_KEY, rule.name)
+
+    # ============= 查詢 =============
+    def _expired_jobs(self, rule: RetentionRule, checkpoint: Optional[tuple]):
+        """過期任務查詢，依 (created_at, job_id) 排序，從檢查點之後開始；只挑內容定址路徑（舊格式無引用計數，略過）"""
+        from app.models import ElderImageJob
+
+        cutoff = datetime.now(timezone.utc) - timedelta(days=rule.days)
+        path_columns = [getattr(ElderImageJob, path) for path, _ in rule.columns]
+        stmt = (
+            select(ElderImageJob.job_id, ElderImageJob.created_at)
+            .where(
+                ElderImageJob.created_at < cutoff,
+                ElderImageJob.status.in_(rule.statuses),
+                or_(*(column.like("sha256/%") for column in path_columns)),
+            )
+            .order_by(ElderImageJob.created_at, ElderImageJob.job_id)
+        )
+        if checkpoint:
+            stmt = stmt.where(
+                tuple_(ElderImageJob.created_at, ElderImageJob.job_id) > tuple_(*checkpoint)
+            )
+        return stmt
+
+    def _release_batch(self, db, rule: RetentionRule, jobs: list) -> int:
+        """
+        單一交易：鎖住這批任務、清空路徑與 URL 欄位、釋放對應的引用
+        路徑以鎖定後重新讀到的值為準，重跑同一批也不會重複釋放
+        只清內容定址路徑（sha256/），舊格式路徑沒有引用計數，保留欄位不動，避免遠端物件再也找不到
+        條件帶上這批任務的 created_at 範圍，Postgres 只掃描對應的分區
+
+        Args:
+            jobs: 依 (created_at, job_id) 排序的 (job_id, created_at)
+
+        Returns:
+            釋放的引用數
+        """
+        old_columns = ", ".join(path for path, _ in rule.columns)
+        returning = ", ".join(f"old.{path}" for path, _ in rule.columns)
+        assignments = ", ".join(
+            f"{path} = CASE WHEN old.{path} LIKE 'sha256/%' THEN NULL ELSE old.{path} END, "
+            f"{url} = CASE WHEN old.{path} LIKE 'sha256/%' THEN NULL ELSE j.{url} END"
+            for path, url in rule.columns
+        )
+        rows = db.execute(
+            text(f"""
+                UPDATE elder_image_jobs AS j
+                SET {assignments}
+                FROM (
+                    SELECT job_id, created_at, {old_columns}
+                    FROM elder_image_jobs
+                    WHERE job_id = ANY(:job_ids)
+                      AND created_at BETWEEN :first_created AND :last_created
+                    FOR UPDATE
+                ) AS old
+                WHERE j.job_id = old.job_id
+                  AND j.created_at = old.created_at
+                  AND j.created_at BETWEEN :first_created AND :last_created
+                RETURNING {returning}
+            """),
+            {
+                "job_ids": [job.job_id for job in jobs],
+                "first_created": jobs[0].created_at,
+                "last_created": jobs[-1].created_at,
+            }
+        ).all()
+
+        digests = [
+            digest
+            for row in rows
+            for digest in map(storage_service.digest_from_path, row)
+            if digest
+        ]
+        storage_service.release_objects_in(db, digests)
+        db.commit()
+        return len(digests)
+
+    # ============= 執行 =============
+    def _sweep(self, rule: RetentionRule, budget: int) -> tuple:
+        """
+        處理一條規則
+
+        Returns:
+            (使用的批次數, 釋放的引用數, 是否處理完畢)
+        """
+        from app.database import SessionLocal
+
+        checkpoint = self._load_checkpoint(rule)
+        stmt = self._expired_jobs(rule, checkpoint)
+
+        read_db = SessionLocal()
+        write_db = SessionLocal()
+        batches = released = 0
+        try:
+            # server-side cursor：只在 DB 端保留結果集，每次取一批
+            result = read_db.execute(
+                stmt.execution_options(stream_results=True, yield_per=self.batch_size)
+            )
+            for rows in result.partitions():
+                if batches >= budget:
+                    return batches, released, False
+                released += self._release_batch(write_db, rule, rows)
+                batches += 1
+                last = rows[-1]
+                self._save_checkpoint(rule, last.created_at, last.job_id)
+        finally:
+            write_db.rollback()
+            write_db.close()
+            read_db.close()
+
+        self._clear_checkpoint(rule)
+        return batches, released, True
+
+    def _purge(self, budget: int) -> int:
+        """刪除引用歸零的遠端物件"""
+        deleted = 0
+        for _ in range(budget):
+            count = run_async(storage_service.purge_unreferenced(self.batch_size))
+            deleted += count
+            if count < self.batch_size:
+                break
+        return deleted
+
+    def run(self) -> dict:
+        """
+        執行一次清理（同時間只會有一個在跑）
+
+        Returns:
+            {"success": True, "released": 12, "deleted": 10, "complete": True}
+        """
+        from app.database import SessionLocal
+
+        if SessionLocal is None:
+            return {"success": False, "error": "資料庫未設定"}
+
+        lock = get_redis().lock(
+            LOCK_KEY, timeout=settings.STORAGE_GC_INTERVAL_SECONDS, thread_local=False
+        )
+        if not lock.acquire(blocking=False):
+            return {"success": False, "error": "已有清理在執行"}
+
+        try:
+            budget = self.max_batches
+            released = 0
+            complete = True
+            for rule in retention_rules():
+                used, count, done = self._sweep(rule, budget)
+                budget -= used
+                released += count
+                if count:
+                    print(f"🧹 GC [{rule.name}] 釋放 {count} 個引用")
+                if not done:
+                    complete = False
+                    break
+
+            deleted = self._purge(max(budget, 1))
+            print(f"🧹 GC 完成：釋放 {released} 個引用，刪除 {deleted} 個物件")
+            return {"success": True, "released": released, "deleted": deleted, "complete": complete}
+        finally:
+            try:
+                lock.release()
+            except Exception:
+                pass
+
+
+# 單例模式
+storage_gc = StorageGarbageCollector()
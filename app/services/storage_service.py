@@ -1,216 +1,485 @@
 """
-UDA LINK Image Hosting Service for Elder Gen
-圖片上傳與管理服務 - 使用 Supabase Edge Functions + R2
-支援自動 Token 刷新
+Image Storage Service for Elder Gen
+圖片上傳與管理服務 - 內容定址去重、引用計數
+實際存取由儲存後端處理（UDA LINK / 本地檔案 / 記憶體，見 storage_backends）
 """
-import uuid
+import hashlib
 import asyncio
-from typing import Optional
-from datetime import datetime, timedelta
-import httpx
+import tempfile
+from collections import Counter
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Optional
+from sqlalchemy import text
 from app.config import settings
+from app.http_client import get_http_client
+from app.services.storage_backends import StorageBackend, create_backend
 
+# Content-Type → 副檔名
+CONTENT_TYPE_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/webp": "webp",
+}
 
-class StorageService:
-    """UDA LINK 圖片託管服務 (使用 VIP 用戶，支援自動刷新 Token)"""
-
-    # Supabase Auth API endpoint
-    def __init__(self):
-        self.base_url = settings.SUPABASE_URL
-        self.email = settings.ELDER_GEN_EMAIL
-        self.password = settings.ELDER_GEN_PASSWORD
-
-        # Token 狀態
-        self._access_token: Optional[str] = None
-        self._refresh_token: Optional[str] = None
-        self._token_expires_at: Optional[datetime] = None
-        self._lock = asyncio.Lock()
-
-    async def _get_valid_token(self) -> str:
-        """取得有效的 access_token，必要時自動刷新"""
-        async with self._lock:
-            # 檢查是否需要刷新
-            if self._access_token and self._token_expires_at:
-                # 提前 5 分鐘刷新
-                if datetime.now() + timedelta(minutes=5) < self._token_expires_at:
-                    return self._access_token
-
-            # 需要刷新或首次獲取
-            await self._refresh_access_token()
-            return self._access_token
-
-    async def _refresh_access_token(self) -> bool:
-        """刷新 access_token"""
-        try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                # 嘗試用 refresh_token 刷新
-                if self._refresh_token:
-                    response = await client.post(
-                        f"{self.base_url}/auth/v1/token?grant_type=refresh_token",
-                        json={
-                            "refresh_token": self._refresh_token
-                        }
-                    )
+# 串流上傳 / 計算 sha256 時每次讀取的大小
+STREAM_CHUNK_SIZE = 64 * 1024
 
-                    if response.status_code == 200:
-                        data = response.json()
-                        self._access_token = data.get("access_token")
-                        self._refresh_token = data.get("refresh_token", self._refresh_token)
+# 上傳時同一內容正被 GC 刪除或其他人上傳失敗：重新認領的次數
+CLAIM_RETRIES = 2
+# 等待 GC 刪除 / 其他人上傳時的輪詢
+CLAIM_POLLS = 20
+CLAIM_POLL_SECONDS = 0.5
+# 認領上傳超過這個時間仍未完成，視為認領者已中斷，由等待的人接手
+UPLOAD_CLAIM_STALE_SECONDS = 120
 
-                        # 解析過期時間
-                        expires_in = data.get("expires_in", 3600)
-                        self._token_expires_at = datetime.now() + timedelta(seconds=expires_in)
 
-                        print("✅ Token 刷新成功")
-                        return True
+class StorageService:
+    """圖片儲存服務（內容定址 + 引用計數，實際存取交給 STORAGE_BACKEND 指定的後端）"""
 
-            # refresh_token 失敗或不存在，重新登入
-            if self.email and self.password:
-                return await self._relogin()
+    def __init__(self, backend: Optional[StorageBackend] = None):
+        self.backend = backend or create_backend(settings.STORAGE_BACKEND)
 
-            print("❌ 無法刷新 Token：缺少 email/password")
-            return False
+    @property
+    def is_available(self) -> bool:
+        """檢查服務是否可用"""
+        return self.backend.is_configured()
+
+    # ============= Content-Addressed 物件索引 =============
+    @staticmethod
+    def content_path(digest: str, extension: str) -> str:
+        """內容定址路徑: sha256/ab/cd/abcd....jpg"""
+        return f"sha256/{digest[:2]}/{digest[2:4]}/{digest}.{extension}"
+
+    @staticmethod
+    def digest_from_path(path: str) -> Optional[str]:
+        """從內容定址路徑取回 sha256，舊格式路徑回傳 None"""
+        if not path or not path.startswith("sha256/"):
+            return None
+        return path.rsplit("/", 1)[-1].split(".", 1)[0]
+
+    def _claim_object(self, digest: str, path: str, content_type: str, size: int) -> Optional[dict]:
+        """
+        認領內容的上傳權並取得一個引用（單一 INSERT ... ON CONFLICT ... RETURNING）
+        插入新列的人（inserted）負責上傳；其他人只把引用數 +1，等上傳完成（status = ready）
 
-        except Exception as e:
-            print(f"❌ Token 刷新失敗: {e}")
-            # 嘗試重新登入
-            if self.email and self.password:
-                return await self._relogin()
-            return False
+        Returns:
+            物件資訊，同一內容正被 GC 刪除中（ref_count = -1）時回傳 None
+        """
+        from app.database import SessionLocal
 
-    async def _relogin(self) -> bool:
-        """重新登入獲取新的 token"""
+        db = SessionLocal()
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/auth/v1/token?grant_type=password",
-                    json={
-                        "email": self.email,
-                        "password": self.password,
-                    }
-                )
-
-                if response.status_code == 200:
-                    data = response.json()
-                    self._access_token = data.get("access_token")
-                    self._refresh_token = data.get("refresh_token")
+            # 等待 GC 的物件（ref_count = 0）遠端檔案還在，直接復活；-1 刪除中不能引用
+            row = db.execute(
+                text("""
+                    INSERT INTO elder_storage_objects AS o
+                        (content_hash, path, content_type, size_bytes, ref_count, status, claimed_at)
+                    VALUES (:hash, :path, :content_type, :size, 1, 'uploading', NOW())
+                    ON CONFLICT (content_hash) DO UPDATE
+                    SET ref_count = o.ref_count + 1, last_referenced_at = NOW()
+                    WHERE o.ref_count >= 0
+                    RETURNING (xmax = 0) AS inserted, status, path, url, remote_id, claimed_at
+                """),
+                {"hash": digest, "path": path, "content_type": content_type, "size": size}
+            ).first()
+            db.commit()
+            return dict(row._mapping) if row else None
+        finally:
+            db.close()
+
+    def _upload_state(self, digest: str) -> Optional[dict]:
+        """等待上傳時查詢物件狀態，物件已不存在（負責上傳的人失敗）時回傳 None"""
+        from app.database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            row = db.execute(
+                text("""
+                    SELECT status, path, url, remote_id, claimed_at,
+                           claimed_at < NOW() - make_interval(secs => :stale) AS stale
+                    FROM elder_storage_objects
+                    WHERE content_hash = :hash
+                """),
+                {"hash": digest, "stale": UPLOAD_CLAIM_STALE_SECONDS}
+            ).first()
+            return dict(row._mapping) if row else None
+        finally:
+            db.close()
+
+    def _take_over_claim(self, digest: str, claimed_at) -> Optional[dict]:
+        """認領者太久沒完成上傳（worker 被終止等）：接手上傳，同時只有一人接手成功"""
+        from app.database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            row = db.execute(
+                text("""
+                    UPDATE elder_storage_objects
+                    SET claimed_at = NOW()
+                    WHERE content_hash = :hash AND status = 'uploading' AND claimed_at = :claimed_at
+                    RETURNING status, path, url, remote_id, claimed_at
+                """),
+                {"hash": digest, "claimed_at": claimed_at}
+            ).first()
+            db.commit()
+            return dict(row._mapping) if row else None
+        finally:
+            db.close()
+
+    def _mark_ready(self, digest: str, claimed_at, upload_result: dict) -> bool:
+        """上傳完成：寫入 URL 並開放引用；認領已被接手時回傳 False"""
+        from app.database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            row = db.execute(
+                text("""
+                    UPDATE elder_storage_objects
+                    SET status = 'ready', url = :url, remote_id = :remote_id, claimed_at = NULL
+                    WHERE content_hash = :hash AND status = 'uploading' AND claimed_at = :claimed_at
+                    RETURNING content_hash
+                """),
+                {
+                    "hash": digest,
+                    "claimed_at": claimed_at,
+                    "url": upload_result["full_url"],
+                    "remote_id": upload_result.get("remote_id"),
+                }
+            ).first()
+            db.commit()
+            return row is not None
+        finally:
+            db.close()
 
-                    # 解析過期時間
-                    expires_in = data.get("expires_in", 3600)
-                    self._token_expires_at = datetime.now() + timedelta(seconds=expires_in)
+    def _abandon_claim(self, digest: str, claimed_at):
+        """
+        上傳失敗：刪除認領列，等待中的人會重新認領（他們的引用隨著這一列一起消失）
+        認領已被接手時只釋放自己的引用
+        """
+        from app.database import SessionLocal
 
-                    print("✅ 重新登入成功")
-                    return True
-                else:
-                    print(f"❌ 重新登入失敗: {response.status_code} - {response.text}")
-                    return False
+        db = SessionLocal()
+        try:
+            deleted = db.execute(
+                text("""
+                    DELETE FROM elder_storage_objects
+                    WHERE content_hash = :hash AND status = 'uploading' AND claimed_at = :claimed_at
+                """),
+                {"hash": digest, "claimed_at": claimed_at}
+            ).rowcount
+            if not deleted:
+                self.release_objects_in(db, [digest])
+            db.commit()
+        finally:
+            db.close()
+
+    def _is_deleting(self, digest: str) -> bool:
+        """物件是否正被 GC 刪除中"""
+        from sqlalchemy import select
+        from app.database import SessionLocal
+        from app.models import ElderStorageObject
+
+        db = SessionLocal()
+        try:
+            ref_count = db.execute(
+                select(ElderStorageObject.ref_count).where(ElderStorageObject.content_hash == digest)
+            ).scalar()
+            return ref_count is not None and ref_count < 0
+        finally:
+            db.close()
+
+    @staticmethod
+    def release_objects_in(db, digests: list[str]):
+        """
+        在呼叫端的交易中批次釋放引用（同一物件出現 n 次就減 n），單一 UPDATE，不 commit
+        引用數歸零的物件留在索引中，由 purge_unreferenced 刪除遠端物件後再移除
+        """
+        if not digests:
+            return
+        counts = Counter(digests)
+        db.execute(
+            text("""
+                UPDATE elder_storage_objects AS o
+                SET ref_count = GREATEST(o.ref_count - v.n, 0)
+                FROM unnest(CAST(:hashes AS varchar[]), CAST(:counts AS int[])) AS v(hash, n)
+                WHERE o.content_hash = v.hash AND o.ref_count > 0
+            """),
+            {"hashes": list(counts), "counts": list(counts.values())}
+        )
+
+    def _release_objects(self, digests: list[str]):
+        """批次釋放引用（獨立交易）"""
+        from app.database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            self.release_objects_in(db, digests)
+            db.commit()
+        finally:
+            db.close()
 
-        except Exception as e:
-            print(f"❌ 重新登入錯誤: {e}")
-            return False
+    def _claim_unreferenced(self, limit: int) -> list[dict]:
+        """
+        認領引用數歸零的物件準備刪除（ref_count 0 → -1，單一 UPDATE ... RETURNING）
+        認領後不能再被引用或復活；上次 GC 中斷留下、認領超過一小時的物件重新認領
+        """
+        from app.database import SessionLocal
 
-    @property
-    def is_available(self) -> bool:
-        """檢查服務是否可用"""
-        return bool(self.base_url and self.email and self.password)
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                text("""
+                    UPDATE elder_storage_objects
+                    SET ref_count = -1, last_referenced_at = NOW()
+                    WHERE content_hash IN (
+                        SELECT content_hash FROM elder_storage_objects
+                        WHERE ref_count = 0
+                           OR (ref_count = -1 AND last_referenced_at < NOW() - INTERVAL '1 hour')
+                        LIMIT :limit
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING content_hash, remote_id, path
+                """),
+                {"limit": limit}
+            ).all()
+            db.commit()
+            return [dict(row._mapping) for row in rows]
+        finally:
+            db.close()
+
+    def _forget_objects(self, digests: list[str]):
+        """遠端刪除成功後移除索引"""
+        from sqlalchemy import delete
+        from app.database import SessionLocal
+        from app.models import ElderStorageObject
+
+        db = SessionLocal()
+        try:
+            db.execute(
+                delete(ElderStorageObject).where(
+                    ElderStorageObject.content_hash.in_(digests),
+                    ElderStorageObject.ref_count == -1
+                )
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _unclaim_objects(self, digests: list[str]):
+        """遠端刪除失敗的物件放回等待刪除（ref_count -1 → 0），下次重試，期間也能被重新上傳復活"""
+        from sqlalchemy import update
+        from app.database import SessionLocal
+        from app.models import ElderStorageObject
+
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(ElderStorageObject)
+                .where(
+                    ElderStorageObject.content_hash.in_(digests),
+                    ElderStorageObject.ref_count == -1
+                )
+                .values(ref_count=0)
+            )
+            db.commit()
+        finally:
+            db.close()
 
     async def upload_image(
         self,
         image_data: bytes,
         user_id: int,
-        prefix: str = "original"
+        prefix: str = "original",
+        content_type: str = "image/png"
     ) -> dict:
         """
-        上傳圖片到 UDA LINK (R2)
-        使用現有的 /upload-image 端點，透過 Elder Gen VIP 用戶
+        上傳圖片到儲存後端
+        以內容 sha256 定址，先認領再上傳：認領到的人才上傳，其他人只增加引用數並等上傳完成
 
         Args:
             image_data: 圖片二進位資料
-            user_id: 用戶 ID (用於檔案命名)
-            prefix: 檔案路徑前綴 (original/result)
+            user_id: 用戶 ID (僅用於紀錄)
+            prefix: 用途 (original/result/preview)
+            content_type: 圖片 Content-Type
 
         Returns:
             {
                 "success": True,
-                "path": "elder-gen/{user_id}/{prefix}/{filename}",
+                "path": "sha256/ab/cd/{sha256}.{ext}",
                 "full_url": "https://r2...",
-                "r2_path": "..."
+                "content_hash": "...",
+                "deduplicated": True/False
             }
         """
         if not self.is_available:
             return {
                 "success": False,
-                "error": "UDA LINK 服務未設定 (缺少 ELDER_GEN_EMAIL 或 ELDER_GEN_PASSWORD)"
+                "error": f"儲存後端 {self.backend.name} 未設定"
             }
 
-        filename = f"{uuid.uuid4()}.png"
-        path = f"elder-gen/{user_id}/{prefix}/{filename}"
-
-        # 嘗試上傳，失敗時自動刷新 token 重試
-        for attempt in range(2):  # 最多重試 1 次
-            try:
-                token = await self._get_valid_token()
+        digest = hashlib.sha256(image_data).hexdigest()
+        path = self.content_path(digest, CONTENT_TYPE_EXTENSIONS.get(content_type, "png"))
+        return await self._store(
+            digest, path, content_type, len(image_data),
+            lambda: self.backend.put(image_data, path, content_type)
+        )
 
-                # 準備 multipart form data
-                files = {
-                    "file": (filename, image_data, "image/png")
-                }
-
-                headers = {
-                    "Authorization": f"Bearer {token}"
-                }
+    async def upload_file(
+        self,
+        file: BinaryIO,
+        user_id: int,
+        prefix: str = "original",
+        content_type: str = "image/png"
+    ) -> dict:
+        """
+        上傳檔案物件（例如下載時的暫存檔），分段計算 sha256 後以 put_stream 串流上傳
+        記憶體中只保留一個 chunk；回傳格式同 upload_image
+        """
+        if not self.is_available:
+            return {
+                "success": False,
+                "error": f"儲存後端 {self.backend.name} 未設定"
+            }
 
-                async with httpx.AsyncClient(timeout=60.0) as client:
-                    response = await client.post(
-                        f"{self.base_url}/functions/v1/upload-image",
-                        files=files,
-                        headers=headers
-                    )
+        digest, size = await asyncio.to_thread(self._hash_file, file)
+        path = self.content_path(digest, CONTENT_TYPE_EXTENSIONS.get(content_type, "png"))
+        return await self._store(
+            digest, path, content_type, size,
+            lambda: self.backend.put_stream(self._file_chunks(file), path, content_type)
+        )
+
+    @staticmethod
+    def _hash_file(file: BinaryIO) -> tuple[str, int]:
+        file.seek(0)
+        sha256 = hashlib.sha256()
+        size = 0
+        while chunk := file.read(STREAM_CHUNK_SIZE):
+            sha256.update(chunk)
+            size += len(chunk)
+        return sha256.hexdigest(), size
+
+    @staticmethod
+    async def _file_chunks(file: BinaryIO) -> AsyncIterator[bytes]:
+        await asyncio.to_thread(file.seek, 0)
+        while chunk := await asyncio.to_thread(file.read, STREAM_CHUNK_SIZE):
+            yield chunk
+
+    async def _store(
+        self,
+        digest: str,
+        path: str,
+        content_type: str,
+        size: int,
+        put: Callable[[], Awaitable[dict]]
+    ) -> dict:
+        """先認領再上傳：認領到的人呼叫 put()，其他人等上傳完成後沿用"""
+        from app.database import SessionLocal
 
-                    # 401 表示 token 過期，刷新後重試
-                    if response.status_code == 401 and attempt == 0:
-                        await self._refresh_access_token()
-                        continue
+        if SessionLocal is None:
+            return self._uploaded(await put(), digest)
 
-                    response.raise_for_status()
-                    result = response.json()
-
-                if result.get("success"):
+        for _ in range(CLAIM_RETRIES + 1):
+            try:
+                claim = await asyncio.to_thread(self._claim_object, digest, path, content_type, size)
+            except Exception as e:
+                print(f"⚠️  認領物件索引失敗，直接上傳: {e}")
+                return self._uploaded(await put(), digest)
+
+            if claim is None:
+                # 同一內容正被 GC 刪除，等刪完重新認領
+                await self._wait_while_deleting(digest)
+                continue
+
+            if not claim["inserted"]:
+                claim = await self._wait_for_upload(digest, claim)
+                if claim is None:
+                    # 負責上傳的人失敗，重新認領
+                    continue
+                if claim["status"] == "ready":
                     return {
                         "success": True,
-                        "path": path,
-                        "full_url": result["data"]["url"],
-                        "filename": result["data"].get("fileName", filename),
-                        "r2_path": result["data"].get("fileName", path)
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": result.get("error", "上傳失敗"),
-                        "path": path
+                        "path": claim["path"],
+                        "full_url": claim["url"],
+                        "remote_id": claim["remote_id"],
+                        "content_hash": digest,
+                        "deduplicated": True,
                     }
 
-            except httpx.HTTPStatusError as e:
-                if e.response.status_code == 401 and attempt == 0:
-                    await self._refresh_access_token()
-                    continue
-                return {
-                    "success": False,
-                    "error": f"HTTP 錯誤: {e.response.status_code}",
-                    "path": path
-                }
-            except Exception as e:
-                return {
-                    "success": False,
-                    "error": str(e),
-                    "path": path
-                }
+            # 認領成功（或接手中斷的上傳）：只有這裡會上傳
+            result = self._uploaded(await put(), digest)
+            if not result["success"]:
+                await asyncio.to_thread(self._abandon_claim, digest, claim["claimed_at"])
+                return result
+            if not await asyncio.to_thread(self._mark_ready, digest, claim["claimed_at"], result):
+                print(f"⚠️  物件 {digest} 的上傳已被接手，沿用本次上傳結果")
+            return result
+
+        return {"success": False, "error": f"物件 {digest} 無法認領上傳，請稍後重試"}
+
+    @staticmethod
+    def _uploaded(result: dict, digest: str) -> dict:
+        if result["success"]:
+            result["content_hash"] = digest
+            result["deduplicated"] = False
+        return result
+
+    async def _wait_while_deleting(self, digest: str):
+        for _ in range(CLAIM_POLLS):
+            await asyncio.sleep(CLAIM_POLL_SECONDS)
+            if not await asyncio.to_thread(self._is_deleting, digest):
+                return
+
+    async def _wait_for_upload(self, digest: str, claim: dict) -> Optional[dict]:
+        """
+        等待其他人上傳同一內容
 
-        return {
-            "success": False,
-            "error": "上傳失敗：無法獲取有效 token",
-            "path": path
-        }
+        Returns:
+            上傳完成的物件（status = ready）；接手中斷的上傳時回傳新的認領（status = uploading）；
+            物件已不存在時回傳 None
+        """
+        while claim["status"] != "ready":
+            await asyncio.sleep(CLAIM_POLL_SECONDS)
+            claim = await asyncio.to_thread(self._upload_state, digest)
+            if claim is None:
+                return None
+            if claim["status"] == "uploading" and claim["stale"]:
+                taken = await asyncio.to_thread(self._take_over_claim, digest, claim["claimed_at"])
+                if taken:
+                    print(f"⚠️  物件 {digest} 上傳逾時，接手上傳")
+                    return taken
+        return claim
+
+    async def release_images(self, paths: list[str]) -> int:
+        """
+        釋放一批引用（舊格式路徑沒有引用計數，略過）
+
+        Returns:
+            實際釋放的引用數
+        """
+        digests = [digest for digest in map(self.digest_from_path, paths) if digest]
+        if digests:
+            await asyncio.to_thread(self._release_objects, digests)
+        return len(digests)
+
+    async def purge_unreferenced(self, limit: int = 500) -> int:
+        """
+        認領引用數歸零的物件後刪除遠端檔案，成功後移除索引；失敗的放回等待刪除，下次重試
+
+        Returns:
+            刪除的物件數
+        """
+        objects = await asyncio.to_thread(self._claim_unreferenced, limit)
+        if not objects:
+            return 0
+
+        results = await self.delete_images([obj["remote_id"] or obj["path"] for obj in objects])
+        deleted, failed = [], []
+        for obj in objects:
+            (deleted if results.get(obj["remote_id"] or obj["path"]) else failed).append(obj["content_hash"])
+        if deleted:
+            await asyncio.to_thread(self._forget_objects, deleted)
+        if failed:
+            await asyncio.to_thread(self._unclaim_objects, failed)
+        return len(deleted)
 
     async def upload_image_from_url(
         self,
@@ -219,7 +488,7 @@ class StorageService:
         prefix: str = "original"
     ) -> dict:
         """
-        從 URL 下載圖片並上傳到 UDA LINK
+        從 URL 串流下載圖片並上傳（下載寫入暫存檔，記憶體中最多 IMAGE_SPOOL_BYTES）
 
         Args:
             image_url: 來源圖片 URL
@@ -229,86 +498,60 @@ class StorageService:
         Returns:
             上傳結果 dict
         """
-        try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(image_url)
-                response.raise_for_status()
-                image_data = response.content
+        with tempfile.SpooledTemporaryFile(max_size=settings.IMAGE_SPOOL_BYTES) as spool:
+            try:
+                async with get_http_client().stream("GET", image_url) as response:
+                    response.raise_for_status()
+                    content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+                    async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                        if spool.tell() + len(chunk) > settings.IMAGE_MAX_INPUT_BYTES:
+                            raise ValueError(f"檔案超過 {settings.IMAGE_MAX_INPUT_BYTES // 1024} KB")
+                        await asyncio.to_thread(spool.write, chunk)
+            except Exception as e:
+                return {
+                    "success": False,
+                    "error": f"下載圖片失敗: {str(e)}"
+                }
 
-            return await self.upload_image(image_data, user_id, prefix)
-        except Exception as e:
-            return {
-                "success": False,
-                "error": f"下載圖片失敗: {str(e)}"
-            }
+            if content_type not in CONTENT_TYPE_EXTENSIONS:
+                content_type = "image/png"
+            return await self.upload_file(spool, user_id, prefix, content_type)
 
     async def delete_image(self, image_id: str) -> bool:
         """
         刪除圖片
 
         Args:
-            image_id: 圖片 ID (UUID)
+            image_id: 上傳結果的 remote_id
 
         Returns:
             是否刪除成功
         """
-        if not self.is_available:
-            print("⚠️  UDA LINK 服務未設定，跳過刪除")
-            return False
-
-        # 嘗試刪除，失敗時自動刷新 token 重試
-        for attempt in range(2):
-            try:
-                token = await self._get_valid_token()
-
-                headers = {
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json"
-                }
-
-                payload = {"imageId": image_id}
-
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.post(
-                        f"{self.base_url}/functions/v1/delete-image",
-                        headers=headers,
-                        json=payload
-                    )
-
-                    # 401 表示 token 過期，刷新後重試
-                    if response.status_code == 401 and attempt == 0:
-                        await self._refresh_access_token()
-                        continue
-
-                    response.raise_for_status()
-                    result = response.json()
+        return await self.backend.delete(image_id)
 
-                return result.get("success", False)
-
-            except Exception as e:
-                if attempt == 0:
-                    await self._refresh_access_token()
-                    continue
-                print(f"刪除圖片失敗: {e}")
-                return False
+    async def delete_images(self, image_ids: list[str]) -> dict[str, bool]:
+        """
+        批次刪除圖片（後端支援時一次刪除，否則以有限並行度逐一刪除）
 
-        return False
+        Returns:
+            {image_id: 是否刪除成功}
+        """
+        if not image_ids:
+            return {}
+        return await self.backend.delete_many(image_ids)
 
     def get_public_url(self, r2_path: str) -> str:
         """
         取得圖片的公開 URL
-        (R2 URL 由上傳回應返回，這裡只作備用)
+        (URL 由上傳結果返回，這裡只作備用)
 
         Args:
-            r2_path: R2 檔案路徑
+            r2_path: 物件路徑
 
         Returns:
             公開 URL
         """
-        # R2 的公開 URL 應該由上傳回應返回
-        if hasattr(settings, 'R2_PUBLIC_URL') and settings.R2_PUBLIC_URL:
-            return f"{settings.R2_PUBLIC_URL}/{r2_path}"
-        return r2_path
+        return self.backend.public_url(r2_path)
 
 
 # 單例模式
@@ -0,0 +1,250 @@
+"""
+Template Compositing Service
+「快速模式」：把用戶照片合成進預先做好的節慶 / 花卉背景（NumPy 向量化，不需 GPU）
+背景與遮罩在 worker 啟動時預先計算成 .npy，之後以 memory-map 載入，子行程共用 page cache
+"""
+import io
+import os
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+from app.config import settings
+
+
+@dataclass(frozen=True)
+class TemplateSpec:
+    """模板設定"""
+    name: str
+    title: str  # 用戶輸入的觸發詞
+    caption: str  # 預設標語
+    slot: tuple  # 照片位置 (left, top, width, height)，以模板邊長比例表示
+    saturation: float = 1.0  # 照片調色：飽和度
+    gain: tuple = (1.0, 1.0, 1.0)  # 照片調色：RGB 增益
+    lift: tuple = (0.0, 0.0, 0.0)  # 照片調色：RGB 偏移
+    feather: float = 0.12  # 遮罩邊緣羽化比例
+
+
+TEMPLATES = {
+    spec.title: spec
+    for spec in (
+        TemplateSpec(
+            "mid_autumn", "中秋", "中秋快樂",
+            slot=(0.10, 0.22, 0.62, 0.62),
+            saturation=0.9, gain=(1.05, 1.0, 0.92), lift=(0.02, 0.01, 0.0),
+        ),
+        TemplateSpec(
+            "new_year", "新年", "新年快樂",
+            slot=(0.19, 0.20, 0.62, 0.62),
+            saturation=1.15, gain=(1.08, 0.98, 0.95),
+        ),
+        TemplateSpec(
+            "flowers", "花開富貴", "花開富貴",
+            slot=(0.19, 0.16, 0.62, 0.62),
+            saturation=1.2, gain=(1.04, 1.0, 1.02), lift=(0.02, 0.0, 0.02),
+        ),
+    )
+}
+
+
+# ============= 預先計算背景與遮罩 =============
+def _grid(size: int) -> tuple:
+    """回傳 (y, x) 座標網格，值域 0~1"""
+    axis = np.linspace(0.0, 1.0, size, dtype=np.float32)
+    return axis[:, None], axis[None, :]
+
+
+def _vertical_gradient(size: int, top: tuple, bottom: tuple) -> np.ndarray:
+    y, _ = _grid(size)
+    top_arr = np.asarray(top, dtype=np.float32)
+    bottom_arr = np.asarray(bottom, dtype=np.float32)
+    return np.broadcast_to(top_arr + (bottom_arr - top_arr) * y[..., None], (size, size, 3)).copy()
+
+
+def _paint_disc(canvas: np.ndarray, cx: float, cy: float, radius: float, color: tuple, softness: float = 0.01):
+    """在 canvas 上畫柔邊圓形（原地修改）"""
+    y, x = _grid(canvas.shape[0])
+    distance = np.sqrt((x - cx) ** 2 + (y - cy) ** 2)
+    alpha = np.clip((radius - distance) / softness, 0.0, 1.0)[..., None]
+    canvas *= 1.0 - alpha
+    canvas += alpha * np.asarray(color, dtype=np.float32)
+
+
+def _render_background(spec: TemplateSpec, size: int) -> np.ndarray:
+    """程序化產生模板背景（沒有提供素材圖時使用）"""
+    rng = np.random.default_rng(zlib.crc32(spec.name.encode("utf-8")))
+    y, x = _grid(size)
+
+    if spec.name == "mid_autumn":
+        canvas = _vertical_gradient(size, (10, 20, 70), (40, 30, 110))
+        # 星星
+        stars = rng.random((size, size)) > 0.9985
+        canvas[stars] = 255.0
+        _paint_disc(canvas, 0.80, 0.18, 0.14, (255, 226, 130), softness=0.02)
+    elif spec.name == "new_year":
+        distance = np.sqrt((x - 0.5) ** 2 + (y - 0.5) ** 2)[..., None]
+        canvas = np.asarray((230, 30, 30), np.float32) * (1 - distance) + \
+            np.asarray((120, 0, 10), np.float32) * distance
+        for cx, cy in rng.random((40, 2)):
+            _paint_disc(canvas, cx, cy, 0.012, (255, 210, 60))
+    else:
+        canvas = _vertical_gradient(size, (255, 236, 245), (255, 180, 210))
+        # 花朵：極座標玫瑰線
+        for cx, cy in rng.random((14, 2)):
+            theta = np.arctan2(y - cy, x - cx)
+            radius = np.sqrt((x - cx) ** 2 + (y - cy) ** 2)
+            petal = np.abs(np.cos(2.5 * theta)) * 0.07
+            alpha = np.clip((petal - radius) / 0.006, 0.0, 1.0)[..., None]
+            color = np.asarray((240, 60 + rng.integers(0, 80), 140), dtype=np.float32)
+            canvas = canvas * (1 - alpha) + color * alpha
+
+    return np.clip(canvas, 0, 255).astype(np.uint8)
+
+
+def _render_mask(spec: TemplateSpec, size: int) -> np.ndarray:
+    """照片區域的羽化橢圓遮罩 (float32, 0~1)"""
+    left, top, width, height = spec.slot
+    y, x = _grid(size)
+    nx = (x - (left + width / 2)) / (width / 2)
+    ny = (y - (top + height / 2)) / (height / 2)
+    distance = np.sqrt(nx ** 2 + ny ** 2)
+    return np.clip((1.0 - distance) / spec.feather, 0.0, 1.0).astype(np.float32)
+
+
+def _load_asset(path: str, size: int, mode: str) -> Optional[np.ndarray]:
+    """讀取素材圖（可選），不存在時回傳 None"""
+    if not os.path.exists(path):
+        return None
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return np.asarray(image.convert(mode).resize((size, size)))
+
+
+def build_templates(cache_dir: str, asset_dir: Optional[str], size: int):
+    """
+    預先計算所有模板的背景與遮罩並存成 .npy
+    asset_dir 中若有 {name}.png / {name}_mask.png 則優先使用
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    for spec in TEMPLATES.values():
+        background_path = os.path.join(cache_dir, f"{spec.name}.bg.npy")
+        mask_path = os.path.join(cache_dir, f"{spec.name}.mask.npy")
+        if os.path.exists(background_path) and os.path.exists(mask_path):
+            continue
+
+        background = mask = None
+        if asset_dir:
+            background = _load_asset(os.path.join(asset_dir, f"{spec.name}.png"), size, "RGB")
+            mask = _load_asset(os.path.join(asset_dir, f"{spec.name}_mask.png"), size, "L")
+            if mask is not None:
+                mask = (mask.astype(np.float32) / 255.0)
+
+        if background is None:
+            background = _render_background(spec, size)
+        if mask is None:
+            mask = _render_mask(spec, size)
+
+        # 先寫暫存檔再改名，避免其他行程讀到寫一半的檔案
+        for path, array in ((background_path, background), (mask_path, mask)):
+            tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+            np.save(tmp_path, np.ascontiguousarray(array))
+            os.replace(tmp_path, path)
+        print(f"🖼️  模板 {spec.name} 預先計算完成")
+
+
+class TemplateService:
+    """模板合成服務"""
+
+    def __init__(self):
+        self.cache_dir = settings.TEMPLATE_CACHE_DIR
+        self.asset_dir = settings.TEMPLATE_ASSET_DIR
+        self.size = settings.TEMPLATE_SIZE
+        self._backgrounds: dict[str, np.ndarray] = {}
+        self._masks: dict[str, np.ndarray] = {}
+
+    def prepare(self):
+        """預先計算模板（在 worker 主行程 fork 前呼叫）"""
+        build_templates(self.cache_dir, self.asset_dir, self.size)
+
+    def load(self):
+        """以 memory-map 載入所有模板（唯讀，多個子行程共用實體記憶體）"""
+        self.prepare()
+        for spec in TEMPLATES.values():
+            self._backgrounds[spec.name] = np.load(
+                os.path.join(self.cache_dir, f"{spec.name}.bg.npy"), mmap_mode="r"
+            )
+            self._masks[spec.name] = np.load(
+                os.path.join(self.cache_dir, f"{spec.name}.mask.npy"), mmap_mode="r"
+            )
+
+    @staticmethod
+    def find(title: str) -> Optional[TemplateSpec]:
+        """依觸發詞取得模板"""
+        return TEMPLATES.get(title.strip())
+
+    @staticmethod
+    def _grade(photo: np.ndarray, spec: TemplateSpec) -> np.ndarray:
+        """向量化調色：飽和度、RGB 增益與偏移（輸入輸出皆為 0~1 float32）"""
+        luminance = photo @ np.asarray((0.299, 0.587, 0.114), dtype=np.float32)
+        photo = luminance[..., None] + (photo - luminance[..., None]) * spec.saturation
+        photo = photo * np.asarray(spec.gain, dtype=np.float32) + np.asarray(spec.lift, dtype=np.float32)
+        return np.clip(photo, 0.0, 1.0)
+
+    def compose(self, photo_data: bytes, title: str) -> dict:
+        """
+        將照片合成進模板
+
+        Args:
+            photo_data: 用戶照片 bytes
+            title: 模板觸發詞（例如「中秋」）
+
+        Returns:
+            {"success": True, "data": b"...", "content_type": "image/png", "caption": "中秋快樂"}
+            或 {"success": False, "error": "..."}
+        """
+        from PIL import Image, ImageOps
+
+        spec = self.find(title)
+        if spec is None:
+            return {"success": False, "error": f"找不到模板: {title}"}
+        if spec.name not in self._backgrounds:
+            self.load()
+
+        background = self._backgrounds[spec.name]
+        mask = self._masks[spec.name]
+        size = background.shape[0]
+        left, top, width, height = (int(round(value * size)) for value in spec.slot)
+
+        try:
+            with Image.open(io.BytesIO(photo_data)) as source:
+                source.draft("RGB", (width, height))
+                photo = ImageOps.fit(
+                    ImageOps.exif_transpose(source).convert("RGB"),
+                    (width, height),
+                    Image.Resampling.BILINEAR
+                )
+        except (OSError, ValueError, SyntaxError) as e:
+            return {"success": False, "error": f"照片解碼失敗: {e}"}
+
+        photo_arr = self._grade(np.asarray(photo, dtype=np.float32) / 255.0, spec)
+
+        # 只在照片區域做 alpha blending，其餘直接複製背景
+        canvas = np.array(background)
+        region = canvas[top:top + height, left:left + width].astype(np.float32) / 255.0
+        alpha = mask[top:top + height, left:left + width, None]
+        blended = region + (photo_arr - region) * alpha
+        canvas[top:top + height, left:left + width] = (blended * 255.0 + 0.5).astype(np.uint8)
+
+        buffer = io.BytesIO()
+        Image.fromarray(canvas).save(buffer, format="PNG", compress_level=1)
+        return {
+            "success": True,
+            "data": buffer.getvalue(),
+            "content_type": "image/png",
+            "caption": spec.caption,
+        }
+
+
+# 單例模式
+template_service = TemplateService()
@@ -0,0 +1,254 @@
+"""
+User Cache
+用戶資料讀穿快取：行程內 LRU → Redis → Postgres（以 line_user_id 為 key）
+扣點、退點、儲值、個人資料等寫入在 commit 之後透過 Redis pub/sub 通知所有行程失效
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, fields
+from datetime import datetime
+from typing import Optional
+import redis
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.redis_client import get_redis
+
+USER_KEY = "elder:user:{line_user_id}"
+USER_GEN_KEY = "elder:user:{line_user_id}:gen"
+INVALIDATE_CHANNEL = "elder:user:invalidate"
+
+# Session.info 中等待 commit 後失效的用戶
+PENDING_INFO_KEY = "user_cache_invalidate"
+
+# 讀 DB 期間沒有發生失效（世代號不變）才寫入 Redis，避免舊資料蓋掉剛失效的 key
+SET_IF_GEN_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+_DATETIME_FIELDS = ("last_active_at", "created_at")
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """快取中的用戶資料（唯讀）"""
+    id: int
+    line_user_id: str
+    display_name: Optional[str]
+    picture_url: Optional[str]
+    points: int
+    is_vip: bool
+    total_images_generated: int
+    is_following: bool
+    last_active_at: Optional[datetime]
+    created_at: Optional[datetime]
+
+    @classmethod
+    def from_model(cls, user) -> "UserSnapshot":
+        data = {f.name: getattr(user, f.name) for f in fields(cls)}
+        data["total_images_generated"] = data["total_images_generated"] or 0
+        return cls(**data)
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        for key in _DATETIME_FIELDS:
+            if data[key] is not None:
+                data[key] = data[key].isoformat()
+        return json.dumps(data, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "UserSnapshot":
+        data = json.loads(raw)
+        for key in _DATETIME_FIELDS:
+            if data[key]:
+                data[key] = datetime.fromisoformat(data[key])
+        return cls(**data)
+
+
+class UserCache:
+    """用戶資料兩層快取"""
+
+    def __init__(self):
+        self._local: "OrderedDict[str, tuple[float, UserSnapshot]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._seq = 0  # 每次失效 +1，讀 DB 期間有失效就不寫入行程內層
+        self._subscribed = False  # 沒有訂閱到失效訊息時不使用行程內層
+        self._listener_pid = None
+        self._set_script = None
+
+    # ============= 行程內層 =============
+    def _local_get(self, line_user_id: str) -> Optional[UserSnapshot]:
+        with self._lock:
+            if not self._subscribed:
+                return None
+            item = self._local.get(line_user_id)
+            if item is None:
+                return None
+            expires_at, snapshot = item
+            if expires_at < time.monotonic():
+                del self._local[line_user_id]
+                return None
+            self._local.move_to_end(line_user_id)
+            return snapshot
+
+    def _local_put(self, snapshot: UserSnapshot, seq: int):
+        with self._lock:
+            if not self._subscribed or seq != self._seq:
+                return
+            self._local[snapshot.line_user_id] = (time.monotonic() + settings.USER_CACHE_LOCAL_TTL, snapshot)
+            self._local.move_to_end(snapshot.line_user_id)
+            while len(self._local) > settings.USER_CACHE_LOCAL_MAX:
+                self._local.popitem(last=False)
+
+    def _local_drop(self, line_user_id: Optional[str] = None):
+        """移除單一用戶；不指定時清空"""
+        with self._lock:
+            self._seq += 1
+            if line_user_id is None:
+                self._local.clear()
+            else:
+                self._local.pop(line_user_id, None)
+
+    def _ensure_listener(self):
+        """每個行程第一次讀取時啟動失效訊息訂閱執行緒（fork 後重新啟動）"""
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._lock:
+            if self._listener_pid == pid:
+                return
+            self._listener_pid = pid
+            self._subscribed = False
+            self._local.clear()
+        threading.Thread(target=self._listen, name="user-cache-invalidation", daemon=True).start()
+
+    def _listen(self):
+        """訂閱失效訊息；斷線期間停用行程內層，重連後清空（中間可能漏掉訊息）"""
+        while True:
+            pubsub = None
+            try:
+                pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATE_CHANNEL)
+                self._local_drop()
+                self._subscribed = True
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message:
+                        self._local_drop(message["data"])
+            except redis.RedisError as e:
+                print(f"⚠️  用戶快取失效訂閱中斷: {e}")
+                self._subscribed = False
+                self._local_drop()
+                time.sleep(1)
+            finally:
+                if pubsub is not None:
+                    pubsub.close()
+
+    # ============= 讀取 =============
+    def _load(self, line_user_id: str) -> Optional[UserSnapshot]:
+        """讀 DB（有副本時讀副本；剛寫入過的用戶讀主庫，避免把副本上的舊資料寫進快取）"""
+        from app.database import read_session
+        from app.models import ElderUser
+
+        db = read_session(line_user_id)
+        try:
+            user = db.query(ElderUser).filter(ElderUser.line_user_id == line_user_id).first()
+            return UserSnapshot.from_model(user) if user else None
+        finally:
+            db.close()
+
+    def get(self, line_user_id: str) -> Optional[UserSnapshot]:
+        """
+        取得用戶資料（行程內 → Redis → DB）
+
+        Returns:
+            UserSnapshot，用戶不存在時回傳 None
+        """
+        self._ensure_listener()
+        snapshot = self._local_get(line_user_id)
+        if snapshot is not None:
+            return snapshot
+
+        seq = self._seq
+        key = USER_KEY.format(line_user_id=line_user_id)
+        gen_key = USER_GEN_KEY.format(line_user_id=line_user_id)
+        client, gen = None, None
+        try:
+            client = get_redis()
+            raw, gen = client.mget(key, gen_key)
+            if raw:
+                snapshot = UserSnapshot.from_json(raw)
+                self._local_put(snapshot, seq)
+                return snapshot
+        except redis.RedisError as e:
+            print(f"⚠️  用戶快取無法使用，改查資料庫: {e}")
+            client = None
+
+        snapshot = self._load(line_user_id)
+        if snapshot is None:
+            return None
+
+        if client is not None:
+            try:
+                if self._set_script is None:
+                    self._set_script = client.register_script(SET_IF_GEN_SCRIPT)
+                self._set_script(
+                    keys=[key, gen_key],
+                    args=[gen or "0", snapshot.to_json(), settings.USER_CACHE_TTL]
+                )
+            except redis.RedisError as e:
+                print(f"⚠️  寫入用戶快取失敗: {e}")
+        self._local_put(snapshot, seq)
+        return snapshot
+
+    # ============= 失效 =============
+    def invalidate(self, *line_user_ids: str):
+        """立即失效（資料已 commit 之後呼叫）；有唯讀副本時同時讓這些用戶的讀取暫時走主庫"""
+        from app.database import read_engine, read_pin_key
+
+        line_user_ids = [i for i in line_user_ids if i]
+        if not line_user_ids:
+            return
+        for line_user_id in line_user_ids:
+            self._local_drop(line_user_id)
+        try:
+            pipe = get_redis().pipeline()
+            for line_user_id in line_user_ids:
+                if read_engine is not None:
+                    pipe.set(read_pin_key(line_user_id), 1, ex=settings.DATABASE_READ_PIN_SECONDS)
+                gen_key = USER_GEN_KEY.format(line_user_id=line_user_id)
+                pipe.incr(gen_key)
+                pipe.expire(gen_key, settings.USER_CACHE_TTL * 2)
+                pipe.delete(USER_KEY.format(line_user_id=line_user_id))
+                pipe.publish(INVALIDATE_CHANNEL, line_user_id)
+            pipe.execute()
+        except redis.RedisError as e:
+            print(f"⚠️  用戶快取失效失敗（最多 {settings.USER_CACHE_TTL} 秒後過期）: {e}")
+
+    def invalidate_on_commit(self, db: Session, line_user_id: Optional[str]):
+        """登記在這個 Session commit 之後失效（rollback 時取消）"""
+        if line_user_id:
+            db.info.setdefault(PENDING_INFO_KEY, set()).add(line_user_id)
+
+
+# 單例模式
+user_cache = UserCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session):
+    pending = session.info.pop(PENDING_INFO_KEY, None)
+    if pending:
+        user_cache.invalidate(*pending)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_after_rollback(session: Session, previous_transaction):
+    session.info.pop(PENDING_INFO_KEY, None)
@@ -1,16 +1,36 @@
 """
 共用工具函數
 """
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from sqlalchemy.orm import Session
 from app import models
 from app.config import settings
+from app.services.user_cache import user_cache
+
+
+_thread_state = threading.local()
+
+
+def run_async(coro):
+    """
+    在目前執行緒的常駐 event loop 上執行 coroutine（同步程式碼呼叫 async 用）
+    與 asyncio.run 不同，loop 不會每次重建，綁在 loop 上的連線池可以重複使用
+    """
+    loop = getattr(_thread_state, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _thread_state.loop = loop
+    return loop.run_until_complete(coro)
 
 
 def get_or_create_user_in_db(
     db: Session,
     line_user_id: str,
-    profile: Optional[dict] = None
+    profile: Optional[dict] = None,
+    commit: bool = True
 ) -> models.ElderUser:
     """
     取得或建立用戶（共用函數）
@@ -19,6 +39,7 @@ def get_or_create_user_in_db(
         db: 資料庫 Session
         line_user_id: LINE User ID
         profile: LINE 用戶資料 (可選)
+        commit: False 時只 flush，由呼叫端的工作單元 commit
 
     Returns:
         ElderUser 物件
@@ -35,14 +56,49 @@ def get_or_create_user_in_db(
             points=settings.FREE_INITIAL_POINTS,
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        db.flush()
+        db.add(models.ElderPointsLedger(
+            user_id=user.id, delta=settings.FREE_INITIAL_POINTS, reason="signup"
+        ))
+        _save(db, user, commit)
 
-    elif profile:
-        # 更新資料
+    elif profile and (
+        user.display_name != profile.get("display_name")
+        or user.picture_url != profile.get("picture_url")
+    ):
+        # 資料有變才寫入
         user.display_name = profile.get("display_name")
         user.picture_url = profile.get("picture_url")
-        db.commit()
-        db.refresh(user)
+        user.last_active_at = datetime.now(timezone.utc)
+        user_cache.invalidate_on_commit(db, line_user_id)
+        _save(db, user, commit)
+
+    else:
+        touch_user_activity(db, user, commit)
 
     return user
+
+
+ACTIVITY_TOUCH_INTERVAL = timedelta(hours=1)
+
+
+def activity_is_stale(last_active_at: Optional[datetime]) -> bool:
+    """最後互動時間是否該更新了"""
+    return last_active_at is None or datetime.now(timezone.utc) - last_active_at >= ACTIVITY_TOUCH_INTERVAL
+
+
+def touch_user_activity(db: Session, user: models.ElderUser, commit: bool = True):
+    """更新最後互動時間（推播分眾用），一小時內只寫一次，避免每則訊息都寫 DB"""
+    if activity_is_stale(user.last_active_at):
+        user.last_active_at = datetime.now(timezone.utc)
+        user_cache.invalidate_on_commit(db, user.line_user_id)
+        _save(db, user, commit)
+
+
+def _save(db: Session, user: models.ElderUser, commit: bool):
+    """commit 並重新讀取；commit=False 時只 flush"""
+    if commit:
+        db.commit()
+        db.refresh(user)
+    else:
+        db.flush()
@@ -2,15 +2,27 @@
 Celery Worker - 圖片生成背景任務
 處理非同步的 AI 圖片生成工作
 """
+import asyncio
 import os
 import uuid
 from datetime import datetime
 from celery import Celery
+from celery.signals import task_postrun, worker_init, worker_process_init
 from sqlalchemy.orm import Session
 from app.config import settings
 from app.database import SessionLocal, Base, engine
 from app import models
-from app.services import ai_service, storage_service, line_service
+from app.http_client import get_http_client
+from app.utils import run_async
+from app.services import (
+    ai_service, storage_service, line_service, image_service, caption_service,
+    template_service
+)
+from app.services.line_dispatcher import line_dispatcher
+from app.services import message_templates
+from app.services.points_service import points_service
+from app.services.job_partitions import job_id_filter, job_ids_filter
+from app.services.job_scheduler import job_scheduler
 
 
 # 初始化 Celery
@@ -34,14 +46,208 @@ celery_app.conf.update(
     worker_max_tasks_per_child=50,
 )
 
+# 快速模式走獨立 queue，不必排在 AI 任務後面（worker 需同時監聽 celery,instant）
+INSTANT_QUEUE = "instant"
+
+# 輕量、有時效的任務（例如 imageSet 逾時處理要趕在 reply token 過期前回覆）走獨立 queue，
+# 由另一個 thread pool worker 處理，不會被長時間的產圖任務卡住
+LIGHT_QUEUE = "light"
+celery_app.conf.task_routes = {"tasks.flush_image_set": {"queue": LIGHT_QUEUE}}
+
+
+@worker_init.connect
+def prepare_templates(**kwargs):
+    """Worker 主行程啟動時預先計算模板（fork 前完成，子行程直接 mmap）"""
+    template_service.prepare()
+
+
+@worker_process_init.connect
+def load_templates(**kwargs):
+    """每個子行程以 memory-map 載入模板"""
+    template_service.load()
+
 
 def get_db():
     """取得資料庫 Session"""
     return SessionLocal()
 
 
+class PermanentJobError(Exception):
+    """重試也不會成功的錯誤（例如圖片格式不支援），不進行重試"""
+
+
+async def _read_line_image(message_id: str):
+    """
+    從 LINE 串流下載用戶上傳的圖片，寫入暫存檔（記憶體中最多 IMAGE_SPOOL_BYTES，其餘在磁碟）
+    第一個 chunk 就檢查 magic bytes、超過大小上限立即中斷，不必下載完才發現不能用
+
+    Returns:
+        SpooledTemporaryFile，呼叫端負責關閉
+    """
+    import tempfile
+    from contextlib import aclosing
+    from app.services.image_service import sniff_format
+    from app.services.line_service import ContentTooLarge
+
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.IMAGE_SPOOL_BYTES)
+    try:
+        async with aclosing(line_service.iter_message_content(message_id)) as chunks:
+            async for chunk in chunks:
+                if not spool.tell() and sniff_format(chunk) is None:
+                    raise PermanentJobError("不支援的檔案格式")
+                await asyncio.to_thread(spool.write, chunk)
+    except BaseException as e:
+        spool.close()
+        if isinstance(e, ContentTooLarge):
+            raise PermanentJobError(str(e))
+        raise
+    return spool
+
+
+async def ingest_line_image(message_id: str, user_id: int) -> dict:
+    """
+    Pipeline 第一階段：從 LINE 取得原圖 → 正規化 → 上傳
+
+    Returns:
+        storage_service.upload_image 的結果，另外帶 "data"（正規化後的圖片 bytes）
+    """
+    with await _read_line_image(message_id) as raw:
+        normalized = await image_service.normalize_async(raw)
+    if not normalized["success"]:
+        raise PermanentJobError(f"圖片無法處理: {normalized['error']}")
+
+    upload_result = await storage_service.upload_image(
+        image_data=normalized["data"],
+        user_id=user_id,
+        prefix="original",
+        content_type=normalized["content_type"]
+    )
+    if not upload_result["success"]:
+        raise Exception(f"原圖上傳失敗: {upload_result.get('error')}")
+
+    return {**upload_result, "data": normalized["data"]}
+
+
+async def _download(url: str) -> bytes:
+    """下載圖片（共用 HTTP 連線池）"""
+    response = await get_http_client().get(url)
+    response.raise_for_status()
+    return response.content
+
+
+async def render_job(
+    original_url: str,
+    original_bytes: bytes,
+    user_id: int,
+    mode: str,
+    prompt: str,
+    caption: str = None,
+    template: str = None
+) -> tuple[dict, dict]:
+    """
+    Pipeline 第二階段：生成 → 合成標語 → 編碼 → 上傳成品圖與預覽圖
+    (在常駐 event loop 上執行，共用 HTTP 連線池)
+
+    Args:
+        original_bytes: 剛下載的原圖（沿用已上傳的原圖時為 None，改從 original_url 下載）
+
+    Returns:
+        (成品圖上傳結果, 預覽圖上傳結果)
+    """
+    # 4. 依模式取得底圖（AI 生成 / 原圖 / 模板合成）
+    caption_text = caption
+    if mode == "caption":
+        # 只加標語，直接使用原圖
+        image_bytes = original_bytes or await _download(original_url)
+    elif mode == "instant":
+        # 快速模式：照片合成進預先計算的模板
+        photo_bytes = original_bytes or await _download(original_url)
+        composed = await asyncio.get_running_loop().run_in_executor(
+            None, template_service.compose, photo_bytes, template
+        )
+        if not composed["success"]:
+            raise Exception(composed["error"])
+        image_bytes = composed["data"]
+        caption_text = caption_text or composed["caption"]
+    else:
+        ai_result = await ai_service.generate_from_url(
+            image_url=original_url,
+            prompt=prompt
+        )
+
+        if not ai_result["success"]:
+            raise Exception(f"AI 生成失敗: {ai_result.get('error')}")
+
+        # 取得生成的圖片資料，如果回傳的是 URL，需要下載
+        image_bytes = ai_result.get("image_bytes")
+        result_url = ai_result.get("image_url")
+        if result_url and not image_bytes:
+            image_bytes = await _download(result_url)
+
+    # 5. 本地合成標語（CJK 文字不交給 AI 畫）
+    captioned = caption_service.render(image_bytes, caption_text)
+    if not captioned["success"]:
+        raise Exception(captioned["error"])
+    image_bytes = captioned["data"]
+
+    # 6. 編碼成品圖與預覽圖（符合 LINE 大小限制）
+    encoded = await image_service.encode_result_async(image_bytes)
+    if not encoded["success"]:
+        raise Exception(f"成品圖編碼失敗: {encoded.get('error')}")
+
+    # 7. 成品圖與預覽圖同時上傳到 UDA LINK Storage
+    results = await asyncio.gather(
+        storage_service.upload_image(
+            image_data=encoded["original"]["data"],
+            user_id=user_id,
+            prefix="result",
+            content_type=encoded["original"]["content_type"]
+        ),
+        storage_service.upload_image(
+            image_data=encoded["preview"]["data"],
+            user_id=user_id,
+            prefix="preview",
+            content_type=encoded["preview"]["content_type"]
+        ),
+        return_exceptions=True
+    )
+
+    # 只上傳成功一張時，釋放那一張的引用（任務不會記錄它，否則永遠無法回收）
+    uploaded = [result for result in results if isinstance(result, dict) and result["success"]]
+    if len(uploaded) < len(results):
+        await storage_service.release_images([result["path"] for result in uploaded])
+    original_result, preview_result = results
+    for label, result in (("上傳失敗", original_result), ("預覽圖上傳失敗", preview_result)):
+        if isinstance(result, Exception):
+            raise Exception(f"{label}: {result}")
+        if not result["success"]:
+            raise Exception(f"{label}: {result.get('error')}")
+
+    return original_result, preview_result
+
+
+def _release_uploads(paths: list[str]):
+    """已上傳但沒寫進任務記錄的圖片：釋放引用，讓 GC 回收"""
+    if not paths:
+        return
+    try:
+        run_async(storage_service.release_images(paths))
+    except Exception as e:
+        print(f"⚠️  釋放未記錄的圖片引用失敗: {e}")
+
+
 @celery_app.task(name="tasks.process_elder_image", bind=True, max_retries=3)
-def process_elder_image(self, job_id: str, user_line_id: int, prompt: str, original_url: str = None):
+def process_elder_image(
+    self,
+    job_id: str,
+    user_line_id: int,
+    prompt: str,
+    original_url: str = None,
+    mode: str = "ai",
+    caption: str = None,
+    template: str = None,
+    message_id: str = None
+):
     """
     處理長輩圖生成任務
 
@@ -49,81 +255,78 @@ def process_elder_image(self, job_id: str, user_line_id: int, prompt: str, origi
         job_id: 任務 ID
         user_line_id: 用戶 LINE User ID
         prompt: 文字提示
-        original_url: 原圖 URL（可選）
+        original_url: 原圖 URL（可選，未提供時從 LINE 下載 message_id 的內容）
+        mode: ai（AI 生成 + 標語）、caption（只在原圖加標語）
+              或 instant（照片合成進模板），後兩者不呼叫 AI
+        caption: 標語文字，省略時依時段 / 模板挑選
+        template: instant 模式的模板觸發詞（例如「中秋」）
+        message_id: LINE 圖片訊息 ID
     """
-    import asyncio
-    import httpx
-
     db = get_db()
     job = None
+    unrecorded = []  # 已上傳、還沒 commit 到任務記錄的圖片
 
     try:
         # 1. 查詢任務記錄
-        job = db.query(models.ElderImageJob).filter(
-            models.ElderImageJob.job_id == job_id
-        ).first()
+        job = db.query(models.ElderImageJob).filter(*job_id_filter(job_id)).first()
 
         if not job:
             raise ValueError(f"找不到任務: {job_id}")
+        if job.status not in ("QUEUED", "PROCESSING"):
+            # 已結束（例如送出失敗時已退點）就不再處理
+            return {"success": False, "job_id": job_id, "error": f"任務已結束: {job.status}"}
 
         # 2. 更新狀態為 PROCESSING
         job.status = "PROCESSING"
         db.commit()
 
-        # 3. 呼叫 AI 生成圖片 (使用 asyncio.run 包裹異步函數)
-        async def _process_image():
-            ai_result = await ai_service.generate_from_url(
-                image_url=original_url,
-                prompt=prompt
-            )
-
-            if not ai_result["success"]:
-                raise Exception(f"AI 生成失敗: {ai_result.get('error')}")
-
-            # 4. 取得生成的圖片資料
-            image_bytes = ai_result.get("image_bytes")
-            result_url = ai_result.get("image_url")
-
-            # 如果回傳的是 URL，需要下載
-            if result_url and not image_bytes:
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(result_url)
-                    image_bytes = response.content
-
-            # 5. 上傳到 UDA LINK Storage
-            upload_result = await storage_service.upload_image(
-                image_data=image_bytes,
-                user_id=user_line_id,
-                prefix="result"
-            )
-
-            if not upload_result["success"]:
-                raise Exception(f"上傳失敗: {upload_result.get('error')}")
-
-            return upload_result
-
-        upload_result = asyncio.run(_process_image())
+        # 3. 從 LINE 取得原圖並上傳（重試時沿用已上傳的原圖）
+        original_url = original_url or job.original_url
+        original_bytes = None
+        if not original_url:
+            if not message_id:
+                raise PermanentJobError("任務缺少原圖")
+            ingested = run_async(ingest_line_image(message_id, user_line_id))
+            unrecorded = [ingested["path"]]
+            original_url = ingested["full_url"]
+            original_bytes = ingested["data"]
+            job.original_url = original_url
+            job.original_image_path = ingested["path"]
+            db.commit()
+            unrecorded = []
+
+        upload_result, preview_result = run_async(render_job(
+            original_url, original_bytes, user_line_id,
+            mode=mode, prompt=prompt, caption=caption, template=template
+        ))
+        unrecorded = [upload_result["path"], preview_result["path"]]
         final_url = upload_result["full_url"]
+        preview_url = preview_result["full_url"]
 
-        # 6. 更新任務狀態為 COMPLETED
+        # 8. 更新任務狀態為 COMPLETED
         job.result_url = final_url
         job.result_image_path = upload_result["path"]
+        job.preview_url = preview_url
+        job.preview_image_path = preview_result["path"]
         job.status = "COMPLETED"
         job.completed_at = datetime.now()
         db.commit()
+        unrecorded = []
 
-        # 7. 推播結果到 LINE
+        # 9. 推播結果到 LINE
         # 需要取得用戶的 LINE User ID
         user = db.query(models.ElderUser).filter(
             models.ElderUser.id == user_line_id
         ).first()
 
         if user:
-            line_service.push_message(
+            line_dispatcher.enqueue_push(
                 user.line_user_id,
                 [
-                    line_service.text_message("✅ 您的長輩圖生成完成！"),
-                    line_service.image_message(final_url)
+                    message_templates.render("job_completed"),
+                    message_templates.render(
+                        "result_image", original_url=final_url, preview_url=preview_url or final_url
+                    )
                 ]
             )
 
@@ -136,31 +339,33 @@ def process_elder_image(self, job_id: str, user_line_id: int, prompt: str, origi
     except Exception as e:
         # 錯誤處理
         error_msg = str(e)
+        db.rollback()
+        _release_uploads(unrecorded)
+        will_retry = not isinstance(e, PermanentJobError) and self.request.retries < self.max_retries
 
-        if job:
+        if job and will_retry:
+            # 還會重試：不退點、不通知
+            job.status = "QUEUED"
+            job.error_message = error_msg
+            db.commit()
+        elif job:
             job.status = "FAILED"
             job.error_message = error_msg
             job.completed_at = datetime.now()
 
-            # 退還點數
-            user = db.query(models.ElderUser).filter(
-                models.ElderUser.id == user_line_id
-            ).first()
+            # 退還點數（帳本唯一鍵保證只退一次）
+            refunded = points_service.refund(db, job_id)
+            db.commit()
 
-            if user:
-                user.points += job.cost_points
-                db.commit()
-
-                # 通知用戶
-                line_service.push_message(
-                    user.line_user_id,
-                    line_service.text_message(f"❌ 圖片生成失敗，點數已退還。\n錯誤: {error_msg}")
+            # 通知用戶
+            if refunded:
+                line_dispatcher.enqueue_push(
+                    refunded["line_user_id"],
+                    message_templates.render("job_failed", error=error_msg)
                 )
 
-        db.commit()
-
         # 重試邏輯
-        if self.request.retries < self.max_retries:
+        if will_retry:
             raise self.retry(exc=e, countdown=60 * (self.request.retries + 1))
 
         return {
@@ -172,13 +377,167 @@ def process_elder_image(self, job_id: str, user_line_id: int, prompt: str, origi
         db.close()
 
 
+@celery_app.task(name="tasks.process_elder_image_set", bind=True, max_retries=3)
+def process_elder_image_set(
+    self,
+    job_ids: list[str],
+    message_ids: list[str],
+    user_line_id: int,
+    prompt: str,
+    mode: str = "ai",
+    caption: str = None,
+    template: str = None
+):
+    """
+    處理一次上傳的多張照片（LINE imageSet）
+    每張照片一個任務記錄，整組在同一個 task 內並行處理；全部結束後推播一次（文字 + 成品 carousel）
+    失敗的照片各自退點，重試時只處理還沒完成的照片
+
+    Args:
+        job_ids: 任務 ID（與 message_ids 依序對應）
+        message_ids: LINE 圖片訊息 ID
+        其餘同 process_elder_image
+    """
+    db = get_db()
+    retry_error = None
+    unrecorded = []  # 已上傳、還沒 commit 到任務記錄的圖片
+
+    try:
+        jobs = {
+            job.job_id: job
+            for job in db.query(models.ElderImageJob).filter(*job_ids_filter(job_ids))
+        }
+        todo = [
+            (jobs[job_id], message_id)
+            for job_id, message_id in zip(job_ids, message_ids)
+            if job_id in jobs and jobs[job_id].status in ("QUEUED", "PROCESSING")
+        ]
+        if not todo:
+            # 重複投遞，已經處理完了
+            return {"success": True, "job_ids": job_ids}
+        for job, _ in todo:
+            job.status = "PROCESSING"
+        db.commit()
+
+        # 一組照片在公平排程佔 min(張數, 用戶上限) 個額度，同時處理的張數也不超過用戶上限
+        semaphore = asyncio.Semaphore(min(settings.AI_BATCH_CONCURRENCY, settings.JOB_SCHEDULER_USER_INFLIGHT))
+
+        async def _one(original_url: str, message_id: str):
+            """回傳 (剛上傳的原圖, 上傳結果或例外)，原圖上傳成功就要記錄，重試時沿用"""
+            async with semaphore:
+                ingested = None
+                try:
+                    if not original_url:
+                        ingested = await ingest_line_image(message_id, user_line_id)
+                        original_url = ingested["full_url"]
+                    return ingested, await render_job(
+                        original_url, ingested["data"] if ingested else None, user_line_id,
+                        mode=mode, prompt=prompt, caption=caption, template=template
+                    )
+                except Exception as e:
+                    return ingested, e
+
+        async def _all():
+            return await asyncio.gather(*(_one(job.original_url, message_id) for job, message_id in todo))
+
+        for (job, _), (ingested, result) in zip(todo, run_async(_all())):
+            if ingested:
+                unrecorded.append(ingested["path"])
+                job.original_url = ingested["full_url"]
+                job.original_image_path = ingested["path"]
+            if isinstance(result, Exception):
+                job.error_message = str(result)
+                if not isinstance(result, PermanentJobError) and self.request.retries < self.max_retries:
+                    job.status = "QUEUED"
+                    retry_error = retry_error or result
+                else:
+                    job.status = "FAILED"
+                    job.completed_at = datetime.now()
+                    points_service.refund(db, job.job_id)
+                continue
+
+            upload_result, preview_result = result
+            unrecorded += [upload_result["path"], preview_result["path"]]
+            job.result_url = upload_result["full_url"]
+            job.result_image_path = upload_result["path"]
+            job.preview_url = preview_result["full_url"]
+            job.preview_image_path = preview_result["path"]
+            job.status = "COMPLETED"
+            job.completed_at = datetime.now()
+        db.commit()
+        unrecorded = []
+
+        if retry_error is None:
+            _push_image_set_results(db, user_line_id, [jobs[job_id] for job_id in job_ids if job_id in jobs])
+            return {"success": True, "job_ids": job_ids}
+
+    except Exception as e:
+        db.rollback()
+        _release_uploads(unrecorded)
+        if self.request.retries < self.max_retries:
+            retry_error = e
+        else:
+            # 最終失敗：還沒完成的照片全部退點
+            jobs = db.query(models.ElderImageJob).filter(*job_ids_filter(job_ids)).all()
+            for job in jobs:
+                if job.status in ("QUEUED", "PROCESSING"):
+                    job.status = "FAILED"
+                    job.error_message = str(e)
+                    job.completed_at = datetime.now()
+                    points_service.refund(db, job.job_id)
+            db.commit()
+            _push_image_set_results(db, user_line_id, jobs)
+            return {"success": False, "error": str(e)}
+
+    finally:
+        db.close()
+
+    # 還有照片要重試（已完成的不會重做）
+    raise self.retry(exc=retry_error, countdown=60 * (self.request.retries + 1))
+
+
+def _push_image_set_results(db: Session, user_id: int, jobs: list):
+    """一組照片的結果合併成一次推播：完成的放進 carousel，失敗的一句話帶過（點數已退還）"""
+    user = db.query(models.ElderUser).filter(models.ElderUser.id == user_id).first()
+    if not user:
+        return
+
+    completed = [job for job in jobs if job.status == "COMPLETED"]
+    failed = [job for job in jobs if job.status == "FAILED"]
+    messages = []
+    if completed:
+        messages.append(message_templates.render("job_set_completed", count=len(completed)))
+        messages.extend(line_service.create_result_carousel([job.result_url for job in completed]))
+    if failed:
+        messages.append(message_templates.render(
+            "job_failed", error=f"{len(failed)} 張照片處理失敗（{failed[0].error_message}）"
+        ))
+    if messages:
+        line_dispatcher.enqueue_push(user.line_user_id, messages)
+
+
+# 走公平排程的生成任務，結束時要釋放額度（排程 ID：單張為 job_id，一組照片為第一個 job_id）
+SCHEDULED_TASKS = (process_elder_image.name, process_elder_image_set.name)
+
+
+@task_postrun.connect
+def release_job_slot(task=None, kwargs=None, state=None, **extra):
+    """生成任務結束（等待重試的不算）後釋放公平排程的額度，並送出下一個任務"""
+    if task is None or task.name not in SCHEDULED_TASKS or state == "RETRY" or not kwargs:
+        return
+    try:
+        job_scheduler.complete(kwargs.get("job_id") or kwargs["job_ids"][0])
+    except Exception as e:
+        print(f"⚠️  釋放排程額度失敗（租約到期後釋放）: {e}")
+
+
 @celery_app.task(name="tasks.send_notification")
 def send_notification(user_line_id: str, message: str):
     """
-    發送 LINE 通知
+    發送 LINE 通知（交給推播 dispatcher，依速率限制送出）
     """
     try:
-        line_service.push_message(
+        line_dispatcher.enqueue_push(
             user_line_id,
             [line_service.text_message(message)]
         )
@@ -187,12 +546,118 @@ def send_notification(user_line_id: str, message: str):
         return {"success": False, "error": str(e)}
 
 
+@celery_app.task(name="tasks.run_campaign")
+def run_campaign(campaign_id: str, messages, segment: dict = None):
+    """
+    推播活動（節慶問候等），每 500 人一次 multicast
+    中斷後以同一個 campaign_id 重新送出即可從檢查點接續
+
+    Args:
+        campaign_id: 活動 ID
+        messages: 文字，或 LINE 訊息 dict 的 list
+        segment: {"vip_only": bool, "active_within_days": int}
+    """
+    from app.services.campaign_service import campaign_service, Segment
+
+    if isinstance(messages, str):
+        messages = [{"type": "text", "text": messages}]
+    return campaign_service.run(campaign_id, messages, Segment.from_dict(segment))
+
+
+@celery_app.task(name="tasks.gc_storage")
+def gc_storage():
+    """
+    儲存空間清理：依保留天數釋放過期圖片並刪除無引用的遠端物件
+    單次處理量有上限，沒跑完的下次從檢查點接續
+    """
+    from app.services.storage_gc import storage_gc
+
+    try:
+        return storage_gc.run()
+    except Exception as e:
+        print(f"❌ 儲存空間清理失敗: {e}")
+        return {"success": False, "error": str(e)}
+
+
+@celery_app.task(name="tasks.reconcile_payments")
+def reconcile_payments():
+    """
+    藍新金流對帳：補上漏接 Notify 的付款，並讓逾期未付款的訂單過期
+    """
+    from app.services.reconcile_service import payment_reconciler
+
+    try:
+        return payment_reconciler.run()
+    except Exception as e:
+        print(f"❌ 對帳失敗: {e}")
+        return {"success": False, "error": str(e)}
+
+
+@celery_app.task(name="tasks.pump_job_scheduler")
+def pump_job_scheduler():
+    """
+    公平排程補送：釋放租約到期的額度，把還在排隊的任務送進 Celery
+    """
+    try:
+        return job_scheduler.pump_all()
+    except Exception as e:
+        print(f"❌ 公平排程補送失敗: {e}")
+        return {"success": False, "error": str(e)}
+
+
+@celery_app.task(name="tasks.flush_image_set")
+def flush_image_set(set_id: str):
+    """
+    一次上傳多張照片，等待時間到了還沒收齊：處理已收到的照片（收齊時已在 webhook 處理則略過）
+    """
+    from app.api.line_handler import process_image_set
+
+    try:
+        process_image_set(set_id)
+        return {"success": True, "set_id": set_id}
+    except Exception as e:
+        print(f"❌ 處理 imageSet {set_id} 失敗: {e}")
+        return {"success": False, "error": str(e)}
+
+
+@celery_app.task(name="tasks.maintain_job_partitions")
+def maintain_job_partitions():
+    """
+    任務表分區維護：建立未來月份的分區，超過保留月數的分區卸離並搬到冷資料表
+    """
+    from app.services.job_partitions import job_partitions
+
+    try:
+        return job_partitions.run()
+    except Exception as e:
+        print(f"❌ 任務分區維護失敗: {e}")
+        return {"success": False, "error": str(e)}
+
+
 # 啟動時建立資料表（如果不存在）
 @celery_app.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs):
-    """設定定時任務"""
-    # 可以在這裡加入定時清理任務等
-    pass
+    """設定定時任務（需另外啟動 celery beat）"""
+    sender.add_periodic_task(
+        settings.STORAGE_GC_INTERVAL_SECONDS,
+        gc_storage.s(),
+        name="storage gc"
+    )
+    sender.add_periodic_task(
+        settings.RECONCILE_INTERVAL_SECONDS,
+        reconcile_payments.s(),
+        name="payment reconciliation"
+    )
+    sender.add_periodic_task(
+        settings.JOB_SCHEDULER_PUMP_SECONDS,
+        pump_job_scheduler.s(),
+        name="job scheduler pump"
+    )
+    sender.add_periodic_task(
+        settings.JOB_PARTITION_INTERVAL_SECONDS,
+        maintain_job_partitions.s(),
+        name="job partitions"
+    )
 
 
 if __name__ == "__main__":
@@ -12,6 +12,8 @@ CREATE TABLE IF NOT EXISTS public.elder_users (
     points INTEGER DEFAULT 50,           -- 預設給 50 點
     is_vip BOOLEAN DEFAULT FALSE,
     total_images_generated INTEGER DEFAULT 0,
+    is_following BOOLEAN NOT NULL DEFAULT TRUE,   -- 封鎖 / 刪除好友後為 FALSE
+    last_active_at TIMESTAMPTZ DEFAULT NOW(),     -- 最後互動時間（推播分眾用）
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
@@ -31,30 +33,124 @@ CREATE TABLE IF NOT EXISTS public.elder_orders (
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
--- 3. 建立圖片生成任務表
+-- 3. 建立圖片生成任務表（依 created_at 每月分區，分區由 tasks.maintain_job_partitions 維護）
 CREATE TABLE IF NOT EXISTS public.elder_image_jobs (
-    job_id VARCHAR(50) PRIMARY KEY,
+    job_id VARCHAR(50) NOT NULL,
     user_id INTEGER REFERENCES public.elder_users(id) ON DELETE CASCADE,
+    mode VARCHAR(20) DEFAULT 'ai',        -- ai, caption, instant
     prompt_used TEXT,
     original_url TEXT,
     original_image_path VARCHAR(500),
     result_url TEXT,
     result_image_path VARCHAR(500),
+    preview_url TEXT,                     -- LINE 聊天泡泡用的預覽圖
+    preview_image_path VARCHAR(500),
     status VARCHAR(20) DEFAULT 'QUEUED',  -- QUEUED, PROCESSING, COMPLETED, FAILED
     error_message TEXT,
     cost_points INTEGER DEFAULT 0,
     celery_task_id VARCHAR(100),
     retry_count INTEGER DEFAULT 0,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    completed_at TIMESTAMPTZ,
+    PRIMARY KEY (job_id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- 3-1. 內容定址儲存物件索引（去重與引用計數）
+CREATE TABLE IF NOT EXISTS public.elder_storage_objects (
+    content_hash VARCHAR(64) PRIMARY KEY,  -- sha256 hex
+    path VARCHAR(500) NOT NULL,           -- sha256/ab/cd/{hash}.{ext}
+    url TEXT,                             -- 上傳完成前為 NULL
+    remote_id VARCHAR(200),
+    content_type VARCHAR(50),
+    size_bytes INTEGER,
+    ref_count INTEGER NOT NULL DEFAULT 1,
+    status VARCHAR(10) NOT NULL DEFAULT 'ready',  -- uploading, ready
+    claimed_at TIMESTAMPTZ,               -- 上傳中：負責上傳者認領的時間
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    last_referenced_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- 3-2. 點數帳本（只新增、不修改）
+CREATE TABLE IF NOT EXISTS public.elder_points_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES public.elder_users(id) ON DELETE CASCADE,
+    delta INTEGER NOT NULL,               -- 正數加點、負數扣點
+    reason VARCHAR(20) NOT NULL,          -- signup, reserve, refund, topup
+    ref VARCHAR(50),                      -- job_id / order_no
     created_at TIMESTAMPTZ DEFAULT NOW(),
-    completed_at TIMESTAMPTZ
+    CONSTRAINT uq_elder_points_ledger_ref UNIQUE (reason, ref)
 );
 
+-- 既有資料庫補上新欄位
+ALTER TABLE public.elder_image_jobs ADD COLUMN IF NOT EXISTS mode VARCHAR(20) DEFAULT 'ai';
+ALTER TABLE public.elder_image_jobs ADD COLUMN IF NOT EXISTS preview_url TEXT;
+ALTER TABLE public.elder_image_jobs ADD COLUMN IF NOT EXISTS preview_image_path VARCHAR(500);
+ALTER TABLE public.elder_users ADD COLUMN IF NOT EXISTS is_following BOOLEAN NOT NULL DEFAULT TRUE;
+ALTER TABLE public.elder_users ADD COLUMN IF NOT EXISTS last_active_at TIMESTAMPTZ DEFAULT NOW();
+ALTER TABLE public.elder_storage_objects ADD COLUMN IF NOT EXISTS status VARCHAR(10) NOT NULL DEFAULT 'ready';
+ALTER TABLE public.elder_storage_objects ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ;
+ALTER TABLE public.elder_storage_objects ALTER COLUMN url DROP NOT NULL;
+
+-- 既有的非分區任務表：改名保留 → 建立分區表 → 搬資料 → 刪除舊表
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relname = 'elder_image_jobs' AND c.relkind = 'r'
+    ) THEN
+        ALTER TABLE public.elder_image_jobs RENAME TO elder_image_jobs_unpartitioned;
+        ALTER TABLE public.elder_image_jobs_unpartitioned RENAME CONSTRAINT elder_image_jobs_pkey TO elder_image_jobs_unpartitioned_pkey;
+        DROP INDEX IF EXISTS public.idx_elder_jobs_user;
+        DROP INDEX IF EXISTS public.idx_elder_jobs_status;
+        UPDATE public.elder_image_jobs_unpartitioned SET created_at = NOW() WHERE created_at IS NULL;
+
+        CREATE TABLE public.elder_image_jobs (LIKE public.elder_image_jobs_unpartitioned INCLUDING DEFAULTS)
+            PARTITION BY RANGE (created_at);
+        ALTER TABLE public.elder_image_jobs
+            ALTER COLUMN created_at SET NOT NULL,
+            ADD PRIMARY KEY (job_id, created_at),
+            ADD FOREIGN KEY (user_id) REFERENCES public.elder_users(id) ON DELETE CASCADE;
+    END IF;
+END $$;
+
+-- 任務表分區：既有資料的月份到未來 3 個月（之後由排程任務每天補上）
+DO $$
+DECLARE
+    first_month DATE := date_trunc('month', NOW());
+    m DATE;
+BEGIN
+    IF to_regclass('public.elder_image_jobs_unpartitioned') IS NOT NULL THEN
+        EXECUTE 'SELECT LEAST($1, date_trunc(''month'', MIN(created_at))::date) FROM public.elder_image_jobs_unpartitioned'
+            INTO first_month USING first_month;
+    END IF;
+    FOR m IN
+        SELECT generate_series(first_month, date_trunc('month', NOW()) + INTERVAL '3 months', INTERVAL '1 month')::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS public.%I PARTITION OF public.elder_image_jobs FOR VALUES FROM (%L) TO (%L)',
+            'elder_image_jobs_p' || to_char(m, 'YYYYMM'), m, (m + INTERVAL '1 month')::date
+        );
+    END LOOP;
+
+    IF to_regclass('public.elder_image_jobs_unpartitioned') IS NOT NULL THEN
+        EXECUTE 'INSERT INTO public.elder_image_jobs SELECT * FROM public.elder_image_jobs_unpartitioned';
+        DROP TABLE public.elder_image_jobs_unpartitioned;
+    END IF;
+END $$;
+
+-- 任務冷資料表（超過 JOB_ARCHIVE_AFTER_MONTHS 的分區卸離後搬到這裡）
+CREATE TABLE IF NOT EXISTS public.elder_image_jobs_archive (LIKE public.elder_image_jobs INCLUDING DEFAULTS);
+
 -- 4. 建立索引加速查詢
 CREATE INDEX IF NOT EXISTS idx_elder_users_line ON public.elder_users(line_user_id);
 CREATE INDEX IF NOT EXISTS idx_elder_orders_no ON public.elder_orders(order_no);
 CREATE INDEX IF NOT EXISTS idx_elder_orders_user ON public.elder_orders(user_id);
-CREATE INDEX IF NOT EXISTS idx_elder_jobs_user ON public.elder_image_jobs(user_id);
+CREATE INDEX IF NOT EXISTS idx_elder_jobs_user ON public.elder_image_jobs(user_id, created_at);
 CREATE INDEX IF NOT EXISTS idx_elder_jobs_status ON public.elder_image_jobs(status);
+CREATE INDEX IF NOT EXISTS idx_elder_points_ledger_user ON public.elder_points_ledger(user_id, created_at);
+-- 推播分眾（partial index，只索引仍是好友的用戶）
+CREATE INDEX IF NOT EXISTS idx_elder_users_active ON public.elder_users(last_active_at, id) WHERE is_following;
+CREATE INDEX IF NOT EXISTS idx_elder_users_vip ON public.elder_users(id) WHERE is_vip AND is_following;
 
 -- 5. 建立 Storage Bucket (手動在 Dashboard 操作或使用 API)
 --    Bucket 名稱: elder-images
@@ -70,4 +166,6 @@ SELECT 'elder_users' as table_name, COUNT(*) as row_count FROM public.elder_user
 UNION ALL
 SELECT 'elder_orders', COUNT(*) FROM public.elder_orders
 UNION ALL
-SELECT 'elder_image_jobs', COUNT(*) FROM public.elder_image_jobs;
+SELECT 'elder_image_jobs', COUNT(*) FROM public.elder_image_jobs
+UNION ALL
+SELECT 'elder_storage_objects', COUNT(*) FROM public.elder_storage_objects;
@@ -0,0 +1,40 @@
+"""
+測試共用設定
+Redis 以 fakeredis 取代（支援 Lua script），不需要真的 Redis / 資料庫
+"""
+import asyncio
+import fakeredis
+import pytest
+from app import redis_client
+
+
+@pytest.fixture
+def redis_server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def fake_redis(redis_server, monkeypatch):
+    """get_redis() 改回傳 fakeredis（每個測試各自一個空的 server）"""
+    client = fakeredis.FakeRedis(server=redis_server, decode_responses=True)
+    monkeypatch.setattr(redis_client, "_client", client)
+    return client
+
+
+@pytest.fixture
+def run_async(redis_server, fake_redis):
+    """
+    在新的 event loop 執行 coroutine，get_async_redis() 回傳同一個 fakeredis server 的 async client
+    """
+    def run(coro):
+        async def main():
+            client = fakeredis.FakeAsyncRedis(server=redis_server, decode_responses=True)
+            redis_client._async_clients[asyncio.get_running_loop()] = client
+            try:
+                return await coro
+            finally:
+                await redis_client.close_async_redis()
+
+        return asyncio.run(main())
+
+    return run
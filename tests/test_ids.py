@@ -0,0 +1,98 @@
+import threading
+import time
+import uuid
+import pytest
+from app import ids
+from app.ids import _SnowflakeGenerator, _Uuid7Generator, new_order_no, snowflake_timestamp, uuid7_timestamp
+
+
+def test_uuid7_format():
+    value = ids.uuid7()
+    assert value.version == 7
+    assert value.variant == uuid.RFC_4122
+    assert abs(uuid7_timestamp(str(value)) - time.time()) < 1
+
+
+def test_uuid7_strictly_increasing():
+    generator = _Uuid7Generator()
+    values = [generator() for _ in range(20000)]
+    assert values == sorted(values)
+    assert len(set(values)) == len(values)
+    # 字串排序與時間順序一致（job_id 以字串存在 DB）
+    assert [str(v) for v in values] == sorted(str(v) for v in values)
+
+
+def test_uuid7_clock_going_backwards(monkeypatch):
+    generator = _Uuid7Generator()
+    now = [2_000_000_000_000_000_000]
+    monkeypatch.setattr(ids.time, "time_ns", lambda: now[0])
+    first = generator()
+    now[0] -= 5_000_000_000  # 時鐘倒退 5 秒
+    second = generator()
+    assert second > first
+    assert uuid7_timestamp(second) == uuid7_timestamp(first)
+
+
+def test_uuid7_counter_overflow_borrows_next_ms(monkeypatch):
+    generator = _Uuid7Generator()
+    monkeypatch.setattr(ids.time, "time_ns", lambda: 2_000_000_000_000_000_000)
+    values = [generator() for _ in range(5000)]
+    assert values == sorted(values)
+    assert uuid7_timestamp(values[-1]) > uuid7_timestamp(values[0])
+
+
+def test_uuid7_unique_across_threads():
+    generator = _Uuid7Generator()
+    results = [[] for _ in range(8)]
+
+    def work(out):
+        out.extend(generator() for _ in range(2000))
+
+    threads = [threading.Thread(target=work, args=(out,)) for out in results]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    values = [v for out in results for v in out]
+    assert len(set(values)) == len(values)
+    for out in results:
+        assert out == sorted(out)
+
+
+@pytest.fixture
+def snowflake(fake_redis, monkeypatch):
+    monkeypatch.setattr(ids.settings, "ID_WORKER_ID", 7)
+    return _SnowflakeGenerator()
+
+
+def test_snowflake_increasing(snowflake):
+    values = [snowflake() for _ in range(10000)]
+    assert values == sorted(values)
+    assert len(set(values)) == len(values)
+    assert (values[0] >> ids.SEQUENCE_BITS) & ids.MAX_WORKER_ID == 7
+    assert abs(snowflake_timestamp(values[0]) - time.time()) < 1
+
+
+class _NoRenewal:
+    """不啟動續約執行緒"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def start(self):
+        pass
+
+
+def test_snowflake_worker_lease(fake_redis, monkeypatch):
+    monkeypatch.setattr(ids.settings, "ID_WORKER_ID", None)
+    monkeypatch.setattr(ids.threading, "Thread", _NoRenewal)
+    first, second = _SnowflakeGenerator(), _SnowflakeGenerator()
+    assert first.worker_id != second.worker_id
+    assert fake_redis.get(ids.WORKER_LEASE_KEY.format(worker_id=first.worker_id)) == first._owner
+
+
+def test_order_no_fits_newebpay_limit(snowflake, monkeypatch):
+    monkeypatch.setattr(ids, "snowflake", snowflake)
+    order_no = new_order_no()
+    assert order_no.startswith("EG")
+    assert len(order_no) <= 30
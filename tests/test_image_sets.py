@@ -0,0 +1,53 @@
+import pytest
+from app.config import settings
+from app.services.image_sets import COMPLETE, FIRST, LATE, META_KEY, WAITING, ImageSetCollector
+
+
+@pytest.fixture
+def collector(fake_redis):
+    return ImageSetCollector()
+
+
+def test_collects_until_complete(collector):
+    assert collector.add("s1", 2, 3, "m2", "token-2", "U1") == FIRST
+    assert collector.add("s1", 1, 3, "m1", "token-1", "U1") == WAITING
+    assert collector.add("s1", 3, 3, "m3", "token-3", "U1") == COMPLETE
+
+    # 依 index 排序，reply token 是第一個事件的
+    assert collector.claim("s1") == {
+        "reply_token": "token-2",
+        "line_user_id": "U1",
+        "message_ids": ["m1", "m2", "m3"],
+    }
+
+
+def test_claim_only_once(collector):
+    collector.add("s1", 1, 2, "m1", "token", "U1")
+    assert collector.claim("s1")["message_ids"] == ["m1"]
+    assert collector.claim("s1") is None
+
+
+def test_late_photo_after_claim(collector):
+    collector.add("s1", 1, 3, "m1", "token", "U1")
+    collector.claim("s1")
+
+    # 逾時處理過的組，晚到的照片單獨處理
+    assert collector.add("s1", 2, 3, "m2", "token-2", "U1") == LATE
+    assert collector.claim("s1") is None
+
+
+def test_index_sort_is_numeric(collector):
+    for index in (10, 2, 1):
+        collector.add("s1", index, 10, f"m{index}", "token", "U1")
+    assert collector.claim("s1")["message_ids"] == ["m1", "m2", "m10"]
+
+
+def test_keys_expire(collector, fake_redis):
+    collector.add("s1", 1, 2, "m1", "token", "U1")
+    ttl = fake_redis.ttl(META_KEY.format(set_id="s1"))
+    assert 0 < ttl <= settings.IMAGE_SET_TTL_SECONDS
+
+
+def test_claim_unknown_set(collector, fake_redis):
+    assert collector.claim("missing") is None
+    assert not fake_redis.exists(META_KEY.format(set_id="missing"))
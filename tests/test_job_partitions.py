@@ -0,0 +1,80 @@
+import uuid
+from datetime import date, datetime, timezone
+import pytest
+from app.ids import new_job_id, uuid7_timestamp
+from app.services.job_partitions import (
+    JOB_ID_CLOCK_SKEW, job_id_filter, job_ids_filter, month_start, partition_name
+)
+
+
+def created_bounds(conditions) -> tuple:
+    """條件中 created_at 範圍的 (下限, 上限)"""
+    values = {c.operator.__name__: c.right.value for c in conditions if c.left.name == "created_at"}
+    return values["ge"], values["lt"]
+
+
+def created_at(job_id: str) -> datetime:
+    return datetime.fromtimestamp(uuid7_timestamp(job_id), tz=timezone.utc)
+
+
+def test_uuid7_job_id_adds_created_at_range():
+    job_id = new_job_id()
+    conditions = job_id_filter(job_id)
+
+    assert len(conditions) == 3
+    assert conditions[0].right.value == job_id
+    assert created_bounds(conditions) == (
+        created_at(job_id) - JOB_ID_CLOCK_SKEW, created_at(job_id) + JOB_ID_CLOCK_SKEW
+    )
+
+
+@pytest.mark.parametrize("job_id", [str(uuid.uuid4()), "legacy-job", ""])
+def test_other_job_ids_only_match_id(job_id):
+    conditions = job_id_filter(job_id)
+    assert len(conditions) == 1
+    assert conditions[0].right.value == job_id
+
+
+def test_job_ids_filter_spans_all_ids():
+    job_ids = [new_job_id() for _ in range(3)]
+    conditions = job_ids_filter(job_ids)
+
+    assert len(conditions) == 3
+    assert list(conditions[0].right.value) == job_ids
+    low, high = created_bounds(conditions)
+    assert low == min(map(created_at, job_ids)) - JOB_ID_CLOCK_SKEW
+    assert high == max(map(created_at, job_ids)) + JOB_ID_CLOCK_SKEW
+
+
+@pytest.mark.parametrize("job_ids", [
+    [new_job_id(), str(uuid.uuid4())],
+    [new_job_id(), "legacy-job"],
+    [],
+])
+def test_job_ids_filter_without_range(job_ids):
+    # 混有舊 ID 時無法推算時間，只比對 job_id
+    assert len(job_ids_filter(job_ids)) == 1
+
+
+def test_filter_compiles_for_postgres():
+    from sqlalchemy import select
+    from sqlalchemy.dialects import postgresql
+    from app.models import ElderImageJob
+
+    sql = str(select(ElderImageJob).where(*job_id_filter(new_job_id())).compile(dialect=postgresql.dialect()))
+    assert "elder_image_jobs.created_at >=" in sql
+    assert "elder_image_jobs.created_at <" in sql
+
+
+@pytest.mark.parametrize("day, offset, expected", [
+    (date(2026, 10, 19), 0, date(2026, 10, 1)),
+    (date(2026, 10, 19), 3, date(2027, 1, 1)),
+    (date(2026, 1, 31), -1, date(2025, 12, 1)),
+    (date(2026, 12, 1), 1, date(2027, 1, 1)),
+])
+def test_month_start(day, offset, expected):
+    assert month_start(day, offset) == expected
+
+
+def test_partition_name():
+    assert partition_name(date(2026, 3, 1)) == "elder_image_jobs_p202603"
@@ -0,0 +1,135 @@
+import json
+import pytest
+import redis
+from app.services.job_scheduler import LEASES_KEY, INFLIGHT_KEY, TOTALS_KEY, JobScheduler
+
+
+@pytest.fixture
+def scheduler(fake_redis):
+    scheduler = JobScheduler()
+    scheduler.user_inflight = 2
+    scheduler.max_dispatched = 8
+    scheduler.sent = []
+    scheduler._send = lambda lane, payload: scheduler.sent.append(payload["kwargs"]["job_id"])
+    return scheduler
+
+
+def submit(scheduler, user, job_id, **kwargs):
+    scheduler.submit(user, job_id, {"job_id": job_id}, **kwargs)
+
+
+def test_round_robin_between_users(scheduler):
+    scheduler.max_dispatched = 1
+    for n in range(1, 4):
+        submit(scheduler, 1, f"a{n}")
+    submit(scheduler, 2, "b1")
+    submit(scheduler, 3, "c1")
+    assert scheduler.sent == ["a1"]
+
+    # 每結束一個任務送出下一個：用戶輪流，不是依提交順序
+    for job_id in ["a1", "a2", "b1", "c1"]:
+        scheduler.complete(job_id)
+    assert scheduler.sent == ["a1", "a2", "b1", "c1", "a3"]
+
+
+def test_user_inflight_cap(scheduler, fake_redis):
+    for n in range(1, 6):
+        submit(scheduler, 1, f"a{n}")
+    submit(scheduler, 2, "b1")
+
+    # 用戶 1 最多同時 2 個，用戶 2 不必等用戶 1 的 5 張
+    assert scheduler.sent == ["a1", "a2", "b1"]
+    assert fake_redis.hget(INFLIGHT_KEY, "celery:1") == "2"
+
+    scheduler.complete("a1")
+    assert scheduler.sent[-1] == "a3"
+
+
+def test_weight_is_capped_and_released(scheduler, fake_redis):
+    submit(scheduler, 1, "set1", task="tasks.process_elder_image_set", weight=5)
+    submit(scheduler, 1, "a1")
+
+    # 一組照片最多算到用戶上限，佔滿後同一用戶的下一個任務要等
+    assert scheduler.sent == ["set1"]
+    assert fake_redis.hget(INFLIGHT_KEY, "celery:1") == "2"
+    assert fake_redis.hget(TOTALS_KEY, "celery") == "2"
+
+    scheduler.complete("set1")
+    assert scheduler.sent == ["set1", "a1"]
+    assert fake_redis.hget(INFLIGHT_KEY, "celery:1") == "1"
+
+
+def test_queues_are_counted_separately(scheduler):
+    scheduler.max_dispatched = 1
+    submit(scheduler, 1, "a1")
+    submit(scheduler, 2, "b1", queue="instant")
+    assert scheduler.sent == ["a1", "b1"]
+
+
+def test_complete_unknown_job_is_noop(scheduler, fake_redis):
+    submit(scheduler, 1, "a1")
+    scheduler.complete("missing")
+    scheduler.complete("a1")
+    scheduler.complete("a1")
+    assert fake_redis.hlen(LEASES_KEY) == 0
+    assert fake_redis.hget(TOTALS_KEY, "celery") == "0"
+
+
+def test_send_failure_requeues_at_front(scheduler, fake_redis):
+    sent = scheduler.sent
+    failures = ["a1"]
+
+    def flaky(lane, payload):
+        job_id = payload["kwargs"]["job_id"]
+        if job_id in failures:
+            failures.remove(job_id)
+            raise ConnectionError("broker down")
+        sent.append(job_id)
+
+    scheduler._send = flaky
+    scheduler.user_inflight = 1
+    submit(scheduler, 1, "a1")
+    assert sent == []
+    assert fake_redis.hlen(LEASES_KEY) == 0
+
+    # 排回時沿用原序號，之後提交的 a2 不會插隊
+    submit(scheduler, 1, "a2")
+    assert sent == ["a1"]
+    scheduler.complete("a1")
+    assert sent == ["a1", "a2"]
+
+
+def test_pump_all_expires_stale_leases(scheduler, fake_redis):
+    scheduler.user_inflight = 1
+    submit(scheduler, 1, "a1")
+    submit(scheduler, 1, "a2")
+    assert scheduler.sent == ["a1"]
+
+    lease = json.loads(fake_redis.hget(LEASES_KEY, "a1"))
+    fake_redis.hset(LEASES_KEY, "a1", json.dumps({**lease, "at": 0}))
+
+    result = scheduler.pump_all()
+    assert result == {"success": True, "expired": 1, "dispatched": {"celery": 1}}
+    assert scheduler.sent == ["a1", "a2"]
+
+
+def test_pump_failure_after_enqueue_does_not_raise(scheduler):
+    def broken_pump(lane):
+        raise redis.ConnectionError("down")
+
+    scheduler.pump = broken_pump
+    submit(scheduler, 1, "a1")
+    assert scheduler.sent == []
+
+    del scheduler.pump
+    scheduler.pump_all()
+    assert scheduler.sent == ["a1"]
+
+
+def test_falls_back_to_direct_send_without_redis(scheduler):
+    def broken_enqueue(*args, **kwargs):
+        raise redis.ConnectionError("down")
+
+    scheduler._enqueue = broken_enqueue
+    submit(scheduler, 1, "a1")
+    assert scheduler.sent == ["a1"]
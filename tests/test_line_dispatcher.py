@@ -0,0 +1,197 @@
+import json
+import sys
+from types import SimpleNamespace
+import httpx
+import pytest
+from app.config import settings
+from app.services.line_dispatcher import (
+    DEAD_KEY, DELAYED_KEY, HEARTBEAT_KEY_PREFIX, OUTBOX_KEY, PAUSE_KEY, PROCESSING_KEY_PREFIX, LineDispatcher
+)
+
+# app.services 匯出的是單例，取模組本身
+line_dispatcher_module = sys.modules["app.services.line_dispatcher"]
+
+
+class FakeClock:
+    """time.time / asyncio.sleep 的替身：sleep 只推進時間"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+        self.slept = []
+        self.on_sleep = None
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.slept.append(seconds)
+        # 和真的 sleep 一樣至少經過一點時間（浮點誤差算出極小的等待時也會前進）
+        self.now += max(seconds, 0.001)
+        if self.on_sleep:
+            self.on_sleep()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(line_dispatcher_module, "time", SimpleNamespace(time=clock.time))
+    monkeypatch.setattr(line_dispatcher_module.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def dispatcher(fake_redis):
+    dispatcher = LineDispatcher()
+    dispatcher.consumer_id = "test:1"
+    return dispatcher
+
+
+@pytest.fixture
+def line_api(monkeypatch):
+    """LINE API 回應：依序取出 responses 中的 httpx.Response（或要拋出的例外）"""
+    responses = []
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(line_dispatcher_module, "get_http_client", lambda: client)
+    return SimpleNamespace(responses=responses, requests=requests)
+
+
+def queued(dispatcher, fake_redis, attempts=0):
+    """入列一則推播並移到處理中清單（模擬 sender 剛取出）"""
+    dispatcher.enqueue_push("U1", {"type": "text", "text": "hi"})
+    raw = fake_redis.rpop(OUTBOX_KEY)
+    envelope = json.loads(raw)
+    envelope["attempts"] = attempts
+    raw = json.dumps(envelope)
+    fake_redis.lpush(dispatcher.processing_key, raw)
+    return raw
+
+
+def test_token_bucket_limits_rate(dispatcher, clock, run_async, monkeypatch):
+    monkeypatch.setattr(settings, "LINE_DISPATCH_RATE", 10.0)
+    monkeypatch.setattr(settings, "LINE_DISPATCH_BURST", 2)
+
+    async def main():
+        for _ in range(4):
+            await dispatcher._acquire("push")
+
+    run_async(main())
+    # burst 2 個不用等，之後每個等 1 / rate 秒
+    assert sum(clock.slept) == pytest.approx(0.2, abs=0.01)
+
+
+def test_token_bucket_per_endpoint(dispatcher, clock, run_async, monkeypatch):
+    monkeypatch.setattr(settings, "LINE_DISPATCH_BURST", 1)
+
+    async def main():
+        await dispatcher._acquire("push")
+        await dispatcher._acquire("multicast")
+
+    run_async(main())
+    assert clock.slept == []
+
+
+def test_acquire_waits_for_pause(dispatcher, clock, run_async, fake_redis):
+    fake_redis.set(PAUSE_KEY, "1", px=5000)
+    # fakeredis 的 TTL 依實際時間，等待結束時直接刪掉暫停標記
+    clock.on_sleep = lambda: fake_redis.delete(PAUSE_KEY)
+
+    run_async(dispatcher._acquire("push"))
+    assert len(clock.slept) == 1
+    assert 4 < clock.slept[0] <= 5
+
+
+@pytest.mark.parametrize("response, outcome", [
+    (httpx.Response(200, json={}), "ok"),
+    (httpx.Response(409, json={}), "ok"),
+    (httpx.Response(500), "retry"),
+    (httpx.ConnectError("refused"), "retry"),
+    (httpx.Response(400, text="bad request"), "dead"),
+    (httpx.Response(429, text='{"message":"You have reached your monthly limit."}'), "dead"),
+])
+def test_send_outcomes(dispatcher, fake_redis, line_api, run_async, response, outcome):
+    line_api.responses.append(response)
+    envelope = json.loads(queued(dispatcher, fake_redis))
+    assert run_async(dispatcher._send(envelope))[0] == outcome
+    assert line_api.requests[0].headers["X-Line-Retry-Key"] == envelope["id"]
+
+
+def test_429_pauses_all_senders(dispatcher, fake_redis, line_api, run_async):
+    line_api.responses.append(httpx.Response(429, headers={"Retry-After": "3"}))
+    envelope = json.loads(queued(dispatcher, fake_redis))
+    assert run_async(dispatcher._send(envelope)) == ("retry", 3.0)
+    assert 0 < fake_redis.pttl(PAUSE_KEY) <= 3000
+
+
+def test_retry_goes_to_delayed(dispatcher, fake_redis, clock, run_async, monkeypatch):
+    raw = queued(dispatcher, fake_redis)
+
+    async def retry(envelope):
+        return "retry", 5.0
+
+    monkeypatch.setattr(dispatcher, "_send", retry)
+    run_async(dispatcher._handle(raw))
+
+    [(delayed, score)] = fake_redis.zrange(DELAYED_KEY, 0, -1, withscores=True)
+    assert json.loads(delayed)["attempts"] == 1
+    assert score == clock.now + 5.0
+    assert fake_redis.llen(dispatcher.processing_key) == 0
+
+
+def test_dead_letter_after_max_attempts(dispatcher, fake_redis, clock, run_async, monkeypatch):
+    raw = queued(dispatcher, fake_redis, attempts=settings.LINE_DISPATCH_MAX_ATTEMPTS - 1)
+
+    async def retry(envelope):
+        return "retry", 5.0
+
+    monkeypatch.setattr(dispatcher, "_send", retry)
+    run_async(dispatcher._handle(raw))
+
+    assert fake_redis.zcard(DELAYED_KEY) == 0
+    assert json.loads(fake_redis.lindex(DEAD_KEY, 0))["error"] == "超過重試次數"
+    assert fake_redis.llen(dispatcher.processing_key) == 0
+
+
+def test_malformed_message_is_dead_lettered(dispatcher, fake_redis, run_async):
+    fake_redis.lpush(dispatcher.processing_key, "not json")
+    run_async(dispatcher._dead_letter("not json", ValueError("bad")))
+
+    dead = json.loads(fake_redis.lindex(DEAD_KEY, 0))
+    assert dead == {"raw": "not json", "error": "ValueError: bad"}
+    assert fake_redis.llen(dispatcher.processing_key) == 0
+
+
+def test_recover_takes_over_stopped_dispatchers(dispatcher, fake_redis, run_async):
+    fake_redis.lpush(f"{PROCESSING_KEY_PREFIX}gone:1", "a")
+    fake_redis.lpush(f"{PROCESSING_KEY_PREFIX}alive:1", "b")
+    fake_redis.set(f"{HEARTBEAT_KEY_PREFIX}alive:1", "1")
+    fake_redis.lpush(dispatcher.processing_key, "own")
+
+    assert run_async(dispatcher._recover()) == 1
+    assert fake_redis.lrange(OUTBOX_KEY, 0, -1) == ["a"]
+
+    # 啟動時連自己的處理中清單也放回
+    assert run_async(dispatcher._recover(include_own=True)) == 1
+    assert fake_redis.llen(f"{PROCESSING_KEY_PREFIX}alive:1") == 1
+
+
+def test_enqueue_falls_back_to_direct_push(dispatcher, monkeypatch):
+    import redis
+    from app.services.line_service import line_service
+
+    def broken(*args, **kwargs):
+        raise redis.ConnectionError("down")
+
+    pushed = []
+    monkeypatch.setattr(dispatcher, "_enqueue", broken)
+    monkeypatch.setattr(line_service, "push_message", lambda to, messages: pushed.append(to))
+    assert dispatcher.enqueue_push("U1", {"type": "text", "text": "hi"}) is None
+    assert pushed == ["U1"]
@@ -0,0 +1,101 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.api.media import RangeNotSatisfiable, parse_range, router
+from app.services import storage_service
+from app.services.storage_backends import LocalStorageBackend, MemoryStorageBackend
+
+DATA = bytes(range(256)) * 4  # 1024 bytes
+PATH = "sha256/ab/cd/abcd.png"
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 1023)),
+    ("bytes=-100", (924, 1023)),
+    ("bytes=-2000", (0, 1023)),
+    ("bytes=1000-5000", (1000, 1023)),
+    ("BYTES = 5-9", (5, 9)),
+    ("bytes=0-0,10-20", None),  # 多段 Range：回傳整個檔案
+    ("items=0-10", None),
+    ("bytes=abc-", None),
+    ("bytes=10-5", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1024) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=5000-6000", "bytes=-0"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, 1024)
+
+
+@pytest.fixture(params=["memory", "local"])
+def client(request, tmp_path, monkeypatch):
+    if request.param == "memory":
+        backend = MemoryStorageBackend()
+        backend.objects[PATH] = (DATA, "image/png")
+    else:
+        backend = LocalStorageBackend(str(tmp_path))
+        full_path = backend.resolve(PATH)
+        backend._write(full_path, DATA)
+    monkeypatch.setattr(storage_service, "backend", backend)
+
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def test_serve_whole_file(client):
+    response = client.get(f"/media/{PATH}")
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-type"] == "image/png"
+    assert "immutable" in response.headers["cache-control"]
+
+
+def test_serve_range(client):
+    response = client.get(f"/media/{PATH}", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content == DATA[100:200]
+    assert response.headers["content-range"] == "bytes 100-199/1024"
+    assert response.headers["content-length"] == "100"
+
+
+def test_serve_suffix_range(client):
+    response = client.get(f"/media/{PATH}", headers={"Range": "bytes=-24"})
+    assert response.status_code == 206
+    assert response.content == DATA[-24:]
+
+
+def test_range_not_satisfiable(client):
+    response = client.get(f"/media/{PATH}", headers={"Range": "bytes=2048-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1024"
+
+
+def test_head(client):
+    response = client.head(f"/media/{PATH}")
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["content-length"] == "1024"
+
+
+def test_missing_file(client):
+    assert client.get("/media/sha256/00/00/missing.png").status_code == 404
+
+
+def test_path_traversal_is_rejected(tmp_path, monkeypatch):
+    (tmp_path / "secret.txt").write_text("secret")
+    root = tmp_path / "media"
+    root.mkdir()
+    monkeypatch.setattr(storage_service, "backend", LocalStorageBackend(str(root)))
+
+    app = FastAPI()
+    app.include_router(router)
+    response = TestClient(app).get("/media/..%2Fsecret.txt")
+    assert response.status_code == 404